@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'BE.settings')
 
 application = get_asgi_application()
+
+# Chạy bằng uvicorn (docker-compose) thay cho runserver: khi DEBUG vẫn phục vụ file tĩnh
+# (admin, Swagger UI) như runserver
+if settings.DEBUG:
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+
+    application = ASGIStaticFilesHandler(application)
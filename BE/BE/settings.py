@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -143,6 +144,9 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'your-email'
 EMAIL_HOST_PASSWORD = 'your-password-app'
 
+# Thời gian (giây) cache báo cáo tổng quan của ban quản lý, 0 để tắt cache
+REPORT_OVERVIEW_CACHE_TTL = 30
+
 
 # Cấu hình DRF
 REST_FRAMEWORK = {
@@ -220,19 +224,52 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh'
 
+# Redis pub/sub cho luồng trạng thái phòng (SSE), không đặt biến môi trường thì chỉ chia sự kiện
+# trong một tiến trình
+LIVE_EVENTS_REDIS_URL = os.environ.get('LIVE_EVENTS_REDIS_URL')
+
+# Cache dùng chung giữa web và Celery worker: khóa chống đẩy trùng task tính lại số liệu
+# (_enqueue_usage_refresh) chỉ có tác dụng khi mọi tiến trình thấy cùng một cache.
+# Không đặt biến môi trường (test, chạy dev một tiến trình) thì dùng LocMemCache mặc định của Django
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+
 from celery.schedules import crontab
 
+# Task có eta (lịch hẹn theo từng booking) được worker giữ tới hạn, nên visibility_timeout
+# của Redis phải dài hơn khoảng đặt trước để task không bị giao lại cho worker khác
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': 60 * 60 * 24 * 7}
+
 CELERY_BEAT_SCHEDULE = {
-    'auto-update-booking-status-every-5-minutes': {
+    # Nhắc nhở, tự hủy và tự check-out được lên lịch theo từng booking (schedule_booking_deadlines),
+    # các lần quét dưới đây chỉ bù cho các task bị mất
+    'auto-update-booking-status-hourly': {
         'task': 'apps.bookings.services.auto_update_booking_status',
-        'schedule': crontab(minute='*/5'),  # Chạy mỗi 5 phút
+        'schedule': crontab(minute=0),  # Chạy mỗi giờ
     },
-        'send-checkin-reminder-every-minute': {
+    # Quét bù nhắc nhở; booking đã được nhắc (reminder_sent_at) không bị gửi lại
+    'send-checkin-reminder-fallback': {
         'task': 'apps.bookings.services.send_checkin_reminder',
-        'schedule': crontab(minute='*'),  # Chạy mỗi phút
+        'schedule': crontab(minute='*/5'),
     },
-    'send-checkout-reminder-every-minute': {
+    'send-checkout-reminder-fallback': {
         'task': 'apps.bookings.services.send_checkout_reminder',
-        'schedule': crontab(minute='*'),  # Chạy mỗi phút
+        'schedule': crontab(minute='*/5'),
     },
-}
\ No newline at end of file
+    # Quét bù email xác nhận đặt chỗ chưa gửi (task sau commit bị mất hoặc hết lượt thử lại)
+    'send-confirmation-emails-fallback': {
+        'task': 'apps.bookings.services.send_booking_confirmation_emails',
+        'schedule': crontab(minute='*/5'),
+    },
+    # Đối soát bảng tổng hợp sử dụng theo ngày với booking gốc
+    'reconcile-usage-rollups-nightly': {
+        'task': 'apps.bookings.services.reconcile_usage_rollups',
+        'schedule': crontab(hour=2, minute=0),  # 2 giờ sáng mỗi ngày
+    },
+}
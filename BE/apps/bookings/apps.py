@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BookingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.bookings'
+
+    def ready(self):
+        """
+        Được gọi khi ứng dụng khởi động.
+        - Import signals để cập nhật bảng tổng hợp sử dụng khi booking thay đổi.
+        """
+        import apps.bookings.signals
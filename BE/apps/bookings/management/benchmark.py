@@ -0,0 +1,134 @@
+"""
+Khung chung cho các lệnh benchmark (manage.py bench_*).
+- Mỗi lần chạy tạo một database test riêng, sinh dữ liệu giả bằng bulk_create
+  rồi xóa database khi kết thúc, không đụng tới dữ liệu thật.
+- Kích thước dữ liệu mặc định theo yêu cầu hiệu năng, có thể thu nhỏ bằng --scale.
+"""
+import os
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+
+from apps.users.models import User
+from apps.resources.models import StudySpace
+
+BATCH_SIZE = 5000
+
+
+class QueryCounter:
+    """execute_wrapper đếm số câu lệnh SQL (không giới hạn như connection.queries)"""
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class BenchmarkCommand(BaseCommand):
+    """Lớp cha: lớp con khai báo scenarios và các phương thức bench_<scenario>."""
+    scenarios = ()
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='Hệ số nhân kích thước dữ liệu (ví dụ 0.01 để chạy nhanh).')
+        parser.add_argument('--repeat', type=int, default=5, help='Số lần đo mỗi phép thử.')
+        parser.add_argument('--keepdb', action='store_true', help='Giữ lại database test sau khi chạy.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        with tempfile.TemporaryDirectory() as workdir:
+            if connection.vendor == 'sqlite':
+                # Database file thay vì bộ nhớ để các luồng song song chịu khóa thật
+                connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+                # BEGIN IMMEDIATE: giao dịch ghi xếp hàng chờ khóa thay vì lỗi "database is locked"
+                connection.settings_dict['OPTIONS'].update(transaction_mode='IMMEDIATE', timeout=30)
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+            )
+            # Email locmem, ALLOWED_HOSTS cho test client, ... như khi chạy test
+            setup_test_environment()
+            try:
+                # Không có broker: việc tính lại bảng tổng hợp thuộc về Celery worker, không đo ở đây
+                with override_settings(MEDIA_ROOT=workdir), \
+                        mock.patch('apps.bookings.services.refresh_usage_rollups_task'):
+                    getattr(self, 'bench_' + options['scenario'].replace('-', '_'))()
+            finally:
+                teardown_test_environment()
+                connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+    def scaled(self, count):
+        return max(1, int(count * self.options['scale']))
+
+    def measure(self, label, func, repeat=None):
+        """Chạy func nhiều lần, in p50/p99 (ms) và số truy vấn của lần chạy cuối."""
+        timings = []
+        for _ in range(repeat or self.options['repeat']):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"{label:<45} p50={statistics.median(timings):9.2f}ms "
+            f"p99={p99:9.2f}ms queries={counter.count}"
+        )
+        return timings
+
+    def section(self, title):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+
+
+def seed_users(count, role='student', prefix='bench'):
+    users = [
+        User(username=f'{prefix}_{role}_{i}', email=f'{prefix}_{role}_{i}@example.com',
+             role=role, password='!')
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+    return list(User.objects.filter(username__startswith=f'{prefix}_{role}_').order_by('id'))
+
+
+def seed_spaces(count, space_type='INDIVIDUAL', prefix='bench'):
+    spaces = [
+        StudySpace(name=f'{prefix}-{space_type}-{i}', capacity=4, space_type=space_type)
+        for i in range(count)
+    ]
+    StudySpace.objects.bulk_create(spaces, batch_size=BATCH_SIZE)
+    return list(StudySpace.objects.filter(name__startswith=f'{prefix}-{space_type}-').order_by('id'))
+
+
+def seed_bookings(count, spaces, users, start=None, slot=timedelta(hours=2),
+                  status_cycle=('CONFIRMED', 'CHECK_OUT', 'CANCELLED', 'CHECK_OUT')):
+    """
+    Sinh count booking không chồng lấn trên từng phòng: các phòng lần lượt nhận
+    các khung giờ liên tiếp bắt đầu từ start (mặc định 30 ngày trước).
+    """
+    from apps.bookings.models import Booking
+    start = start or timezone.now() - timedelta(days=30)
+    bookings = []
+    for i in range(count):
+        slot_index, space_index = divmod(i, len(spaces))
+        slot_start = start + slot * slot_index
+        bookings.append(Booking(
+            user=users[i % len(users)],
+            space=spaces[space_index],
+            start_time=slot_start,
+            end_time=slot_start + slot,
+            status=status_cycle[i % len(status_cycle)],
+        ))
+        if len(bookings) >= BATCH_SIZE:
+            Booking.objects.bulk_create(bookings)
+            bookings = []
+    Booking.objects.bulk_create(bookings)
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from apps.bookings.models import Booking
+from apps.bookings.services import rebuild_usage_rollups
+
+
+class Command(BaseCommand):
+    help = "Tính lại các bảng tổng hợp sử dụng theo ngày từ booking gốc, xử lý theo từng đợt ngày."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat,
+                            help='Ngày đầu tiên (YYYY-MM-DD), mặc định ngày của booking sớm nhất.')
+        parser.add_argument('--end', type=date.fromisoformat,
+                            help='Ngày cuối cùng (YYYY-MM-DD), mặc định ngày của booking muộn nhất.')
+        parser.add_argument('--chunk-days', type=int, default=7,
+                            help='Số ngày tính lại trong mỗi transaction.')
+
+    def handle(self, *args, **options):
+        bounds = Booking.objects.aggregate(first=Min('start_time'), last=Max('start_time'))
+        if bounds['first'] is None and not (options['start'] and options['end']):
+            self.stdout.write("Không có booking nào.")
+            return
+        first_day = options['start'] or timezone.localdate(bounds['first'])
+        last_day = options['end'] or timezone.localdate(bounds['last'])
+        if first_day > last_day:
+            raise CommandError("--start phải trước hoặc bằng --end.")
+        if options['chunk_days'] < 1:
+            raise CommandError("--chunk-days phải lớn hơn 0.")
+
+        chunk_start, total = first_day, 0
+        while chunk_start <= last_day:
+            chunk_end = min(chunk_start + timedelta(days=options['chunk_days'] - 1), last_day)
+            rows = rebuild_usage_rollups(chunk_start, chunk_end)
+            total += rows
+            self.stdout.write(f"{chunk_start} → {chunk_end}: {rows} dòng phòng-ngày")
+            chunk_start = chunk_end + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Hoàn tất: {total} dòng phòng-ngày từ {first_day} đến {last_day}."))
@@ -0,0 +1,611 @@
+import contextlib
+import io
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from dateutil.parser import parse
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIClient
+
+from apps.resources.models import StudySpace
+from apps.bookings.management.benchmark import BenchmarkCommand, seed_bookings, seed_spaces, seed_users
+from apps.bookings.serializers import BookingSerializer
+from apps.bookings.views import BookingCursorPagination, BookingListCreateAPIView
+from apps.bookings.models import (
+    SPACE_STATUS_MAPPING, Booking, Equipment, EquipmentReservation, EquipmentType, QRCode,
+)
+from apps.bookings.services import (
+    allocate_equipment, auto_update_booking_status, return_equipment, send_booking_confirmation_emails,
+    send_checkin_reminder, update_booking_status, validate_qr_data,
+)
+
+
+def legacy_return_equipment(booking):
+    """Bản sao return_equipment cũ: lưu từng thiết bị"""
+    for equipment in booking.equipments.all():
+        equipment.status = 'AVAILABLE'
+        equipment.booking = None
+        equipment.save()
+
+
+class SlowEmailBackend(EmailBackend):
+    """Giả lập máy chủ SMTP chậm: mỗi lần gửi mất delay giây"""
+    delay = 0.25
+
+    def send_messages(self, messages):
+        time.sleep(self.delay)
+        return super().send_messages(messages)
+
+
+class HandshakeEmailBackend(EmailBackend):
+    """Giả lập chi phí mở kết nối SMTP (TCP + TLS + AUTH): mỗi kết nối mất delay giây"""
+    delay = 0.005
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        HandshakeEmailBackend.opened += 1
+        time.sleep(self.delay)
+
+
+class Command(BenchmarkCommand):
+    help = "Benchmark các đường xử lý nóng của ứng dụng bookings."
+    scenarios = ('indexes', 'create-concurrent', 'create-latency', 'sweep', 'reminders', 'qr-validate', 'scan-batch',
+                 'status-concurrent', 'create-conflict', 'equipment',
+                 'release', 'list')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--threads', type=int, default=8, help='Số luồng gửi request song song.')
+
+    def bench_indexes(self):
+        """So sánh kế hoạch truy vấn và thời gian trước/sau khi có các chỉ mục ghép."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(5000))
+        seed_bookings(self.scaled(1_000_000), spaces, users)
+        now = timezone.now()
+        space, user = spaces[len(spaces) // 2], users[0]
+        hot_queries = {
+            'kiểm tra phòng trống': lambda: Booking.overlapping(
+                now, now + timedelta(hours=2)).filter(space=space),
+            'auto-cancel (CONFIRMED quá hạn)': lambda: Booking.objects.filter(
+                status='CONFIRMED', start_time__lt=now - timedelta(minutes=30)).values_list('id', flat=True)[:1000],
+            'nhắc nhở check-in': lambda: Booking.objects.filter(
+                status='CONFIRMED', start_time__gte=now, start_time__lte=now + timedelta(minutes=15)),
+            'nhắc nhở check-out': lambda: Booking.objects.filter(
+                status='CHECK_IN', end_time__gte=now, end_time__lte=now + timedelta(minutes=10)),
+            'danh sách booking của user': lambda: Booking.objects.filter(
+                user=user).order_by('-created_at')[:10],
+        }
+
+        def run_all(title):
+            self.section(title)
+            for label, build in hot_queries.items():
+                self.stdout.write(build().explain())
+                self.measure(label, lambda: list(build()))
+
+        indexes = Booking._meta.indexes
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.remove_index(Booking, index)
+        run_all('Trước: không có chỉ mục ghép')
+        with connection.schema_editor() as editor:
+            for index in indexes:
+                editor.add_index(Booking, index)
+        run_all('Sau: có chỉ mục ghép')
+
+    def bench_create_concurrent(self):
+        """Nhiều POST /api/bookings/ đồng thời lên cùng một phòng."""
+        space = seed_spaces(1)[0]
+        users = seed_users(self.scaled(100))
+        total = self.scaled(400)
+        threads = self.options['threads']
+        generate_qr_code = QRCode.generate_qr_code
+
+        def generate_and_render(booking):
+            # Hành vi cũ: render PNG ngay trong transaction đang giữ khóa phòng
+            qr_code = generate_qr_code(booking)
+            qr_code.render_image()
+            return qr_code
+
+        create_booking = Booking.create_booking
+        lock_hold = []
+
+        def timed_create_booking(*args, **kwargs):
+            # create_booking chạy trọn trong transaction đang giữ khóa phòng
+            started = time.perf_counter()
+            try:
+                return create_booking(*args, **kwargs)
+            finally:
+                lock_hold.append((time.perf_counter() - started) * 1000)
+
+        def run(label, day_offset):
+            base = timezone.now() + timedelta(days=day_offset)
+            lock_hold.clear()
+
+            def post(i):
+                client = APIClient()
+                client.force_authenticate(user=users[i % len(users)])
+                start_time = base + timedelta(minutes=30 * i)
+                started = time.perf_counter()
+                try:
+                    response = client.post(reverse('booking_list'), {
+                        'space_id': space.id,
+                        'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        'end_time': (start_time + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    }, format='json')
+                    ok = response.status_code == 201
+                except Exception:
+                    ok = False
+                finally:
+                    connection.close()
+                return ok, (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                results = list(pool.map(post, range(total)))
+            elapsed = time.perf_counter() - started
+            latencies = sorted(latency for _, latency in results)
+            succeeded = sum(1 for ok, _ in results if ok)
+            self.stdout.write(
+                f"{label:<30} {succeeded}/{total} thành công, {succeeded / elapsed:7.1f} req/s, "
+                f"p50={latencies[len(latencies) // 2]:.1f}ms p99={latencies[int(len(latencies) * 0.99)]:.1f}ms, "
+                f"giữ khóa trung bình={sum(lock_hold) / max(1, len(lock_hold)):.2f}ms"
+            )
+
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        self.section(f"{total} request, {threads} luồng, 1 phòng")
+        # Không có broker/Redis khi benchmark: bỏ qua task Celery và sự kiện SSE sau commit
+        with override_settings(LIVE_EVENTS_REDIS_URL=None), \
+                mock.patch('apps.bookings.views.schedule_booking_deadlines'), \
+                mock.patch('apps.bookings.views.send_booking_confirmation_emails'):
+            with mock.patch.object(Booking, 'create_booking', staticmethod(timed_create_booking)):
+                with mock.patch.object(QRCode, 'generate_qr_code', staticmethod(generate_and_render)):
+                    run('render QR trong khóa (cũ)', day_offset=1)
+                run('render QR lười sau commit', day_offset=30)
+
+    def bench_create_latency(self):
+        """Độ trễ POST /api/bookings/ khi gửi email xác nhận trong request và qua Celery."""
+        space = seed_spaces(1)[0]
+        user = seed_users(1)[0]
+        client = APIClient()
+        client.force_authenticate(user=user)
+        slots = iter(range(10_000))
+
+        def post():
+            start_time = timezone.now() + timedelta(days=1, hours=next(slots))
+            response = client.post(reverse('booking_list'), {
+                'space_id': space.id,
+                'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'end_time': (start_time + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+            }, format='json')
+            assert response.status_code == 201, response.data
+
+        repeat = max(self.options['repeat'], 20)
+        self.section(f"SMTP giả lập chậm {SlowEmailBackend.delay * 1000:.0f}ms/lần gửi")
+        with override_settings(EMAIL_BACKEND=f'{__name__}.SlowEmailBackend', LIVE_EVENTS_REDIS_URL=None), \
+                mock.patch('apps.bookings.views.schedule_booking_deadlines'):
+            with mock.patch.object(send_booking_confirmation_emails, 'delay',
+                                   lambda: send_booking_confirmation_emails.apply()):
+                self.measure('gửi email trong request (cũ)', post, repeat)
+            with mock.patch.object(send_booking_confirmation_emails, 'delay', lambda: None):
+                self.measure('đẩy task Celery sau commit', post, repeat)
+
+    def bench_sweep(self):
+        """auto_update_booking_status với 100k booking đang hoạt động: vòng lặp cũ so với UPDATE hàng loạt."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(1000))
+        # Một nửa số booking đã quá hạn (bắt đầu từ 4 ngày trước, mỗi phòng 100 khung 2 giờ)
+        seed_bookings(self.scaled(100_000), spaces, users, start=timezone.now() - timedelta(days=4),
+                      status_cycle=('CONFIRMED', 'CHECK_IN'))
+        equipment_type = EquipmentType.objects.create(name='bench', total_quantity=self.scaled(10_000))
+        Equipment.objects.bulk_create(
+            Equipment(equipment_type=equipment_type, booking_id=booking_id, status='BORROWED')
+            for booking_id in Booking.objects.order_by('id').values_list('id', flat=True)[:self.scaled(10_000)]
+        )
+
+        def legacy_sweep():
+            # Bản sao vòng lặp cũ: đọc mọi booking đang hoạt động, lưu từng dòng
+            current_time = timezone.now()
+            for booking in Booking.objects.filter(status__in=['CONFIRMED', 'CHECK_IN']):
+                if booking.status == 'CONFIRMED' and current_time > booking.start_time + timedelta(minutes=30):
+                    booking.status = 'CANCELLED'
+                elif booking.status == 'CHECK_IN' and current_time > booking.end_time + timedelta(minutes=30):
+                    booking.status = 'CHECK_OUT'
+                else:
+                    continue
+                booking.space.space_status = SPACE_STATUS_MAPPING[booking.status]
+                booking.space.save()
+                legacy_return_equipment(booking)
+                booking.save()
+
+        self.section(f"{Booking.objects.count()} booking đang hoạt động")
+        for label, sweep in (('vòng lặp từng booking (cũ)', legacy_sweep),
+                             ('UPDATE hàng loạt theo lô', auto_update_booking_status)):
+            # Mỗi cách chạy trên cùng dữ liệu ban đầu rồi rollback
+            with transaction.atomic():
+                self.measure(label, sweep, repeat=1)
+                self.measure(label + ' (lần quét kế tiếp)', sweep, repeat=1)
+                transaction.set_rollback(True)
+        with transaction.atomic():
+            self.stdout.write(f"Kết quả: {auto_update_booking_status()}")
+            transaction.set_rollback(True)
+
+    def bench_reminders(self):
+        """10k nhắc nhở check-in đến hạn, quét hai lần liên tiếp như beat chạy mỗi phút."""
+        total = self.scaled(10_000)
+        spaces = seed_spaces(total)
+        users = seed_users(self.scaled(1000))
+        seed_bookings(total, spaces, users, start=timezone.now() + timedelta(minutes=5),
+                      status_cycle=('CONFIRMED',))
+
+        def legacy_reminder():
+            # Bản sao vòng lặp cũ: không đánh dấu đã gửi, mỗi email một kết nối, N+1 user/space
+            current_time = timezone.now()
+            for booking in Booking.objects.filter(status='CONFIRMED', start_time__gte=current_time,
+                                                  start_time__lte=current_time + timedelta(minutes=15)):
+                if booking.user.email:
+                    email = EmailMessage('Nhắc nhở Check-in Đặt phòng',
+                                         f"Chào {booking.user.username}, phòng {booking.space.name}",
+                                         'noreply@example.com', [booking.user.email])
+                    email.content_subtype = "html"
+                    email.send()
+
+        self.section(f"{total} booking sắp tới giờ check-in, SMTP giả lập {HandshakeEmailBackend.delay * 1000:.0f}ms/kết nối")
+        with override_settings(EMAIL_BACKEND=f'{__name__}.HandshakeEmailBackend'):
+            for label, tick in (('gửi từng email, không chống trùng (cũ)', legacy_reminder),
+                                ('giành theo lô + một kết nối mỗi lô', send_checkin_reminder)):
+                with transaction.atomic():
+                    mail.outbox = []
+                    HandshakeEmailBackend.opened = 0
+                    self.measure(label + ' (lần 1)', tick, repeat=1)
+                    self.measure(label + ' (lần 2)', tick, repeat=1)
+                    self.stdout.write(f"  email đã gửi={len(mail.outbox)}, kết nối SMTP={HandshakeEmailBackend.opened}")
+                    transaction.set_rollback(True)
+
+    def bench_qr_validate(self):
+        """Số lượt xác thực QR mỗi giây: payload nhiều dòng (cũ) so với payload có chữ ký."""
+        total = self.scaled(10_000)
+        spaces = seed_spaces(total)
+        users = seed_users(self.scaled(1000))
+        seed_bookings(total, spaces, users, start=timezone.now() - timedelta(minutes=30), status_cycle=('CONFIRMED',))
+        QRCode.objects.bulk_create(QRCode(booking_id=booking_id) for booking_id in Booking.objects.values_list('id', flat=True))
+        scans = []
+        for qr_code in QRCode.objects.select_related('booking__user', 'booking__space'):
+            booking = qr_code.booking
+            legacy = f"QR ID: {qr_code.id} \
+                    \nBooking ID: {booking.id} \
+                    \nUser: {booking.user} \
+                    \nSpace: {booking.space} \
+                    \nTime: {booking.start_time}--{booking.end_time}"
+            scans.append((qr_code.id, legacy, qr_code.build_payload()))
+
+        def legacy_validate(qr_code_id, qr_data):
+            # Bản sao validate_qr_data cũ: đọc QRCode + booking, parse lại hai mốc thời gian
+            qr_code = QRCode.objects.get(id=qr_code_id)
+            qr_info = dict(item.split(": ") for item in qr_data.split("\n"))
+            print(f"QR Info: {qr_info}")
+            if int(qr_info.get('QR ID', '-1')) != qr_code.id or int(qr_info.get('Booking ID', '-1')) != qr_code.booking.id:
+                return False
+            start_time_str, end_time_str = qr_info.get('Time', '').rsplit('--', 1)
+            if not (parse(start_time_str.strip()) <= timezone.localtime(timezone.now()) <= parse(end_time_str.strip())):
+                return False
+            if qr_code.booking.status not in ['CONFIRMED', 'CHECK_IN']:
+                return False
+            print(f"QR Code {qr_code_id} validated successfully.")
+            return True
+
+        self.section(f"{total} mã QR")
+        for label, validate, index in (('validate_qr_data cũ, payload nhiều dòng', legacy_validate, 1),
+                                       ('validate_qr_data mới, payload nhiều dòng', validate_qr_data, 1),
+                                       ('validate_qr_data mới, payload có chữ ký', validate_qr_data, 2)):
+            def run():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    assert all(validate(scan[0], scan[index]) for scan in scans)
+            timings = self.measure(label, run, repeat=3)
+            self.stdout.write(f"  {total / (min(timings) / 1000):,.0f} lượt quét/s")
+
+    def bench_scan_batch(self):
+        """1k lượt quét check-in: từng request POST /api/bookings/scan-qr/ so với quét hàng loạt."""
+        total = self.scaled(1000)
+        spaces = seed_spaces(total)
+        users = seed_users(self.scaled(100))
+        seed_bookings(total, spaces, users, start=timezone.now() - timedelta(minutes=30), status_cycle=('CONFIRMED',))
+        QRCode.objects.bulk_create(QRCode(booking_id=booking_id) for booking_id in Booking.objects.values_list('id', flat=True))
+        scans = [{'qr_code_id': qr_code.id, 'qr_data': qr_code.build_payload()}
+                 for qr_code in QRCode.objects.select_related('booking')]
+        manager = seed_users(1, role='manager')[0]
+        client = APIClient()
+        client.force_authenticate(user=manager)
+
+        def single():
+            for scan in scans:
+                assert client.post(reverse('scan_qr'), scan, format='json').status_code == 200
+
+        def batched(size):
+            def run():
+                for i in range(0, total, size):
+                    response = client.post(reverse('scan_qr_batch'), {'scans': scans[i:i + size]}, format='json')
+                    assert all(result['ok'] for result in response.data['results'])
+            return run
+
+        self.section(f"{total} lượt quét check-in")
+        for label, run in (('từng request scan-qr', single),
+                           ('scan-qr/batch, lô 100', batched(100)),
+                           (f'scan-qr/batch, lô {total}', batched(total))):
+            # Mỗi cách chạy trên cùng dữ liệu ban đầu rồi rollback
+            with transaction.atomic():
+                timings = self.measure(label, run, repeat=1)
+                self.stdout.write(f"  {total / (timings[0] / 1000):,.0f} lượt quét/s")
+                transaction.set_rollback(True)
+
+    def bench_status_concurrent(self):
+        """Nhiều luồng cùng hủy các booking của một phòng: có/không ghi StudySpace.space_status."""
+        space = seed_spaces(1)[0]
+        users = seed_users(self.scaled(100))
+        total = self.scaled(400)
+        threads = self.options['threads']
+        seed_bookings(total, [space], users, start=timezone.now() + timedelta(days=1), status_cycle=('CONFIRMED',))
+        booking_ids = list(Booking.objects.order_by('id').values_list('id', flat=True))
+
+        def legacy_update(booking_id, new_status):
+            # Hành vi cũ của view: khóa dòng phòng rồi ghi trạng thái phòng theo SPACE_STATUS_MAPPING
+            with transaction.atomic():
+                booking = Booking.objects.get(id=booking_id)
+                locked_space = StudySpace.objects.select_for_update().get(id=booking.space_id)
+                booking.status = new_status
+                locked_space.space_status = SPACE_STATUS_MAPPING.get(new_status, 'EMPTY')
+                locked_space.save()
+                booking.save()
+                legacy_return_equipment(booking)
+
+        def run(label, update):
+            Booking.objects.update(status='CONFIRMED')
+
+            def cancel(booking_id):
+                started = time.perf_counter()
+                try:
+                    update(booking_id, 'CANCELLED')
+                finally:
+                    connection.close()
+                return (time.perf_counter() - started) * 1000
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                latencies = sorted(pool.map(cancel, booking_ids))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{label:<30} {total / elapsed:7.1f} req/s, "
+                f"p50={latencies[len(latencies) // 2]:.1f}ms p99={latencies[int(len(latencies) * 0.99)]:.1f}ms"
+            )
+
+        self.section(f"{total} lần hủy booking, {threads} luồng, 1 phòng")
+        with override_settings(LIVE_EVENTS_REDIS_URL=None):
+            run('ghi space_status (cũ)', legacy_update)
+            run('trạng thái suy ra từ booking', update_booking_status)
+
+    def bench_create_conflict(self):
+        """Nhiều luồng tranh nhau cùng các khung giờ của một phòng: khóa dòng phòng (cũ) so với lạc quan."""
+        space = seed_spaces(1)[0]
+        users = seed_users(self.scaled(100))
+        slots = self.scaled(100)
+        per_slot = 4
+        threads = self.options['threads']
+
+        def legacy_perform_create(view, serializer):
+            # Hành vi cũ: giữ khóa dòng phòng suốt quá trình tạo booking
+            equipment_requests = serializer.validated_data.pop('equipment_requests', None)
+            with transaction.atomic():
+                locked_space = StudySpace.objects.select_for_update().get(id=serializer.validated_data['space'].id)
+                serializer.instance = Booking.create_booking(
+                    view.request.user.id, locked_space.id, serializer.validated_data['start_time'],
+                    serializer.validated_data['end_time'], equipment_requests,
+                )
+
+        def run(label, day_offset):
+            base = timezone.now() + timedelta(days=day_offset)
+
+            def post(i):
+                client = APIClient()
+                client.force_authenticate(user=users[i % len(users)])
+                # per_slot request liên tiếp tranh cùng một khung giờ
+                start_time = base + timedelta(minutes=30 * (i // per_slot))
+                try:
+                    return client.post(reverse('booking_list'), {
+                        'space_id': space.id,
+                        'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                        'end_time': (start_time + timedelta(minutes=30)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    }, format='json').status_code
+                except Exception:
+                    return 500
+                finally:
+                    connection.close()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                codes = list(pool.map(post, range(slots * per_slot)))
+            elapsed = time.perf_counter() - started
+            double_booked = Booking.objects.filter(space=space).exclude(status='CANCELLED').filter(Exists(
+                Booking.overlapping(OuterRef('start_time'), OuterRef('end_time'))
+                .filter(space=space).exclude(pk=OuterRef('pk'))
+            )).count()
+            created = codes.count(201)
+            self.stdout.write(
+                f"{label:<30} {len(codes) / elapsed:7.1f} req/s, 201={created} 409={codes.count(409)} "
+                f"400={codes.count(400)} lỗi khác={len(codes) - created - codes.count(409) - codes.count(400)}, "
+                f"đặt trùng={double_booked}"
+            )
+            assert double_booked == 0
+
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        # Lỗi "database is locked" của callback on_commit (bảng tổng hợp) ở chế độ DEFERRED
+        logging.getLogger('django.db.backends.base').setLevel(logging.CRITICAL)
+        self.section(f"{slots} khung giờ × {per_slot} request, {threads} luồng, 1 phòng")
+        with override_settings(LIVE_EVENTS_REDIS_URL=None), \
+                mock.patch('apps.bookings.views.schedule_booking_deadlines'), \
+                mock.patch('apps.bookings.views.send_booking_confirmation_emails'):
+            with mock.patch.object(BookingListCreateAPIView, 'perform_create', legacy_perform_create):
+                run('khóa dòng phòng (cũ)', day_offset=1)
+            run('lạc quan + booking_version', day_offset=30)
+            if connection.vendor == 'sqlite':
+                # Như settings.py (BEGIN DEFERRED): select_for_update không có tác dụng trên SQLite
+                options = connection.settings_dict['OPTIONS']
+                options['transaction_mode'] = 'DEFERRED'
+                try:
+                    with mock.patch.object(BookingListCreateAPIView, 'perform_create', legacy_perform_create):
+                        run('khóa dòng phòng (cũ), DEFERRED', day_offset=60)
+                    run('lạc quan, DEFERRED', day_offset=90)
+                finally:
+                    options['transaction_mode'] = 'IMMEDIATE'
+
+    def bench_equipment(self):
+        """50 loại, 10k thiết bị: kiểm tra/cấp thiết bị từng dòng (cũ) so với sổ giữ chỗ."""
+        type_count, units = 50, self.scaled(10_000)
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(1000))
+        seed_bookings(self.scaled(20_000), spaces, users, start=timezone.now() - timedelta(days=2),
+                      status_cycle=('CONFIRMED', 'CHECK_IN', 'CHECK_OUT', 'CANCELLED'))
+        EquipmentType.objects.bulk_create(
+            EquipmentType(name=f'bench-{i}', total_quantity=units // type_count) for i in range(type_count)
+        )
+        types = list(EquipmentType.objects.filter(name__startswith='bench-').order_by('id'))
+        bookings = list(Booking.objects.order_by('id').values_list('id', 'start_time', 'end_time'))
+        # Mỗi booking giữ 1 thiết bị của hai loại; thiết bị của 1/4 số booking đang được mượn
+        EquipmentReservation.objects.bulk_create((
+            EquipmentReservation(booking_id=booking_id, equipment_type=types[(i + offset) % type_count], quantity=1,
+                                 start_time=start_time, end_time=end_time)
+            for i, (booking_id, start_time, end_time) in enumerate(bookings) for offset in (0, 7)
+        ), batch_size=5000)
+        borrowed = iter(bookings[::4])
+        Equipment.objects.bulk_create((
+            Equipment(equipment_type=types[i % type_count], status='BORROWED', booking_id=next(borrowed)[0])
+            if i % 10 == 0 and i // 10 < len(bookings) // 4 else Equipment(equipment_type=types[i % type_count])
+            for i in range(units)
+        ), batch_size=5000)
+
+        def legacy_available(equipment_type_id, count, start_time, end_time):
+            # Bản sao check_equipment_availability cũ: chỉ đếm thiết bị đang BORROWED
+            equipment_type = EquipmentType.objects.get(id=equipment_type_id)
+            return equipment_type.total_quantity - Equipment.objects.filter(
+                equipment_type=equipment_type, status='BORROWED',
+                booking__start_time__lt=end_time, booking__end_time__gt=start_time,
+            ).count() >= count
+
+        def legacy_allocate(booking, equipment_requests):
+            # Bản sao vòng lặp cấp thiết bị cũ: kiểm tra rồi lưu từng thiết bị
+            for request in equipment_requests:
+                assert legacy_available(request['equipment_type_id'], request['count'], booking.start_time, booking.end_time)
+                for equipment in Equipment.objects.filter(
+                        equipment_type_id=request['equipment_type_id'], status='AVAILABLE').order_by('id')[:request['count']]:
+                    equipment.status = 'BORROWED'
+                    equipment.booking = booking
+                    equipment.save()
+
+        # Khung giờ phủ lên các giữ chỗ đã sinh
+        now = timezone.now()
+        windows = [(equipment_type.id, now - timedelta(hours=48 - hour), now - timedelta(hours=46 - hour))
+                   for equipment_type in types for hour in range(0, 40, 2)]
+        self.section(f"{type_count} loại, {Equipment.objects.count()} thiết bị, "
+                     f"{EquipmentReservation.objects.count()} giữ chỗ, {len(windows)} khung giờ")
+        self.measure('số còn trống: từng (loại, khung giờ) (cũ)', lambda: [
+            legacy_available(type_id, 1, start_time, end_time) for type_id, start_time, end_time in windows
+        ], repeat=min(self.options['repeat'], 3))
+        self.measure('available_quantities (theo lô)', lambda: EquipmentReservation.available_quantities(windows))
+
+        with override_settings(LIVE_EVENTS_REDIS_URL=None):
+            booking = Booking.objects.create(user=users[0], space=spaces[0], start_time=now + timedelta(days=30),
+                                             end_time=now + timedelta(days=30, hours=2))
+        equipment_requests = [{'equipment_type_id': equipment_type.id, 'count': 4} for equipment_type in types[:5]]
+        for label, allocate in (('cấp 5 loại x 4 thiết bị từng dòng (cũ)', legacy_allocate),
+                                ('giữ chỗ 5 loại x 4 (reserve)', EquipmentReservation.reserve)):
+            def run():
+                with transaction.atomic():
+                    allocate(booking, equipment_requests)
+                    transaction.set_rollback(True)
+            self.measure(label, run)
+
+    def bench_release(self):
+        """Giao/trả thiết bị cho một lô booking: lưu từng thiết bị (cũ) so với UPDATE hàng loạt."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(100))
+        seed_bookings(len(spaces), spaces, users, start=timezone.now() - timedelta(hours=1), status_cycle=('CHECK_IN',))
+        bookings = list(Booking.objects.order_by('id'))
+        per_booking = 10
+        equipment_type = EquipmentType.objects.create(name='bench', total_quantity=per_booking * len(bookings))
+        EquipmentReservation.objects.bulk_create(
+            EquipmentReservation(booking=booking, equipment_type=equipment_type, quantity=per_booking,
+                                 start_time=booking.start_time, end_time=booking.end_time)
+            for booking in bookings
+        )
+        Equipment.objects.bulk_create(
+            (Equipment(equipment_type=equipment_type) for _ in range(per_booking * len(bookings))), batch_size=5000
+        )
+
+        def legacy_allocate():
+            # Bản sao vòng lặp cũ: lưu từng thiết bị cho từng booking
+            for booking in bookings:
+                for equipment in Equipment.objects.filter(
+                        equipment_type=equipment_type, status='AVAILABLE').order_by('id')[:per_booking]:
+                    equipment.status = 'BORROWED'
+                    equipment.booking = booking
+                    equipment.save()
+
+        def legacy_release():
+            for booking in bookings:
+                legacy_return_equipment(booking)
+
+        self.section(f"{len(bookings)} booking x {per_booking} thiết bị")
+        for label, allocate, release in (
+                ('từng thiết bị (cũ)', legacy_allocate, legacy_release),
+                ('hàng loạt', lambda: allocate_equipment(bookings), lambda: return_equipment(bookings))):
+            with transaction.atomic():
+                self.measure(f'giao: {label}', allocate, repeat=1)
+                assert Equipment.objects.filter(status='BORROWED').count() == per_booking * len(bookings)
+                self.measure(f'trả: {label}', release, repeat=1)
+                assert not Equipment.objects.filter(status='BORROWED').exists()
+                transaction.set_rollback(True)
+
+    def bench_list(self):
+        """GET /api/bookings/ của quản lý: trang 1 và trang 10.000, theo số trang (OFFSET) và theo con trỏ."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(1000))
+        manager = seed_users(1, role='manager')[0]
+        seed_bookings(self.scaled(1_000_000), spaces, users)
+        client = APIClient()
+        client.force_authenticate(user=manager)
+        url = reverse('booking_list')
+        page = min(10_000, Booking.objects.count() // 10)
+
+        # Con trỏ của trang `page`: vị trí là created_at của booking cuối trang trước
+        boundary = Booking.objects.order_by('-created_at', '-id').values_list('created_at', flat=True)[(page - 1) * 10 - 1]
+        paginator = BookingCursorPagination()
+        paginator.base_url = 'http://testserver' + url
+        deep_cursor = parse_qs(urlparse(
+            paginator.encode_cursor(Cursor(offset=0, reverse=False, position=boundary.isoformat()))
+        ).query)['cursor'][0]
+
+        def get(params):
+            def run():
+                response = client.get(url, params)
+                assert response.status_code == 200 and len(response.data['results']) == 10
+            return run
+
+        self.section(f"{Booking.objects.count()} booking, mỗi trang 10")
+        with mock.patch.object(BookingSerializer, 'setup_queryset', staticmethod(lambda bookings: bookings)):
+            self.measure('trang 1: không nạp sẵn quan hệ (cũ)', get({}))
+        self.measure('trang 1: số trang', get({}))
+        self.measure('trang 1: con trỏ', get({'pagination': 'cursor'}))
+        self.measure(f'trang {page}: số trang (OFFSET)', get({'page': page}))
+        self.measure(f'trang {page}: con trỏ', get({'pagination': 'cursor', 'cursor': deep_cursor}))
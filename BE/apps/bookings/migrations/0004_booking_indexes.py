@@ -0,0 +1,81 @@
+# Generated by Django 5.2 on 2026-10-18 01:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def cancel_overlapping_bookings(Booking):
+    """
+    Luồng tạo booking cũ không atomic nên database có thể đã có booking chồng lấn, khi đó không
+    thêm được ràng buộc. Với mỗi phòng có chồng lấn, giữ booking tạo trước (id nhỏ hơn) và hủy
+    các booking tạo sau giao với nó; trả về id các booking bị hủy.
+    """
+    active = Booking.objects.exclude(status='CANCELLED')
+    conflicting_spaces = set(active.filter(Exists(active.filter(
+        space=OuterRef('space'), start_time__lt=OuterRef('end_time'), end_time__gt=OuterRef('start_time'),
+        id__lt=OuterRef('id'),
+    ))).values_list('space_id', flat=True))
+    cancelled = []
+    for space_id in sorted(conflicting_spaces):
+        kept = []
+        for booking_id, start_time, end_time in active.filter(space_id=space_id).order_by('id').values_list(
+                'id', 'start_time', 'end_time'):
+            if any(start_time < kept_end and kept_start < end_time for kept_start, kept_end in kept):
+                cancelled.append(booking_id)
+            else:
+                kept.append((start_time, end_time))
+    Booking.objects.filter(id__in=cancelled).update(status='CANCELLED')
+    return cancelled
+
+
+# Chỉ PostgreSQL hỗ trợ ràng buộc loại trừ: database tự từ chối hai booking
+# chưa hủy của cùng một phòng có khoảng [start_time, end_time) giao nhau.
+def add_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    cancelled = cancel_overlapping_bookings(apps.get_model('bookings', 'Booking'))
+    if cancelled:
+        print(f"\n  booking_no_overlap: đã hủy {len(cancelled)} booking chồng lấn với booking tạo trước "
+              f"cùng phòng, id: {', '.join(map(str, cancelled))}")
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        "ALTER TABLE bookings_booking ADD CONSTRAINT booking_no_overlap "
+        "EXCLUDE USING gist (space_id WITH =, tstzrange(start_time, end_time, '[)') WITH &&) "
+        "WHERE (status <> 'CANCELLED')"
+    )
+
+
+def remove_overlap_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('ALTER TABLE bookings_booking DROP CONSTRAINT IF EXISTS booking_no_overlap')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0003_notificationconfig'),
+        ('resources', '0002_studyspace_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['space', 'start_time', 'end_time'], name='booking_space_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'start_time'], name='booking_status_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['status', 'end_time'], name='booking_status_end_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['user', '-created_at'], name='booking_user_created_idx'),
+        ),
+        migrations.RunPython(add_overlap_constraint, remove_overlap_constraint),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 01:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0004_booking_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qrcode',
+            name='payload',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AlterField(
+            model_name='qrcode',
+            name='image',
+            field=models.ImageField(blank=True, upload_to='qrcodes/'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_qrcode_payload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='checkin_reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='checkout_reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2 on 2026-10-18 01:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_booking_reminder_sent_at'),
+        ('resources', '0002_studyspace_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('booked_hours', models.FloatField(default=0)),
+                ('used_hours', models.FloatField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('no_shows', models.PositiveIntegerField(default=0)),
+                ('equipment_borrowed', models.PositiveIntegerField(default=0)),
+                ('day', models.DateField(unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='equipment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='is_no_show',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='SpaceTypeUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('booked_hours', models.FloatField(default=0)),
+                ('used_hours', models.FloatField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('no_shows', models.PositiveIntegerField(default=0)),
+                ('equipment_borrowed', models.PositiveIntegerField(default=0)),
+                ('space_type', models.CharField(choices=[('INDIVIDUAL', 'Individual'), ('GROUP', 'Group'), ('MENTORING', 'Mentoring')], max_length=20)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'space_type'), name='space_type_usage_daily_unique')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SpaceUsageDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('bookings', models.PositiveIntegerField(default=0)),
+                ('booked_hours', models.FloatField(default=0)),
+                ('used_hours', models.FloatField(default=0)),
+                ('cancellations', models.PositiveIntegerField(default=0)),
+                ('no_shows', models.PositiveIntegerField(default=0)),
+                ('equipment_borrowed', models.PositiveIntegerField(default=0)),
+                ('space', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='resources.studyspace')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'space'), name='space_usage_daily_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2 on 2026-10-18 02:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def reserve_borrowed_equipment(apps, schema_editor):
+    # Booking đang hoạt động đã được giao thiết bị: ghi giữ chỗ tương ứng
+    Equipment = apps.get_model('bookings', 'Equipment')
+    EquipmentReservation = apps.get_model('bookings', 'EquipmentReservation')
+    rows = Equipment.objects.filter(
+        status='BORROWED', booking__status__in=['CONFIRMED', 'CHECK_IN'],
+    ).values('booking_id', 'equipment_type_id', 'booking__start_time', 'booking__end_time').annotate(
+        quantity=Count('id')
+    ).order_by()
+    EquipmentReservation.objects.bulk_create([
+        EquipmentReservation(
+            booking_id=row['booking_id'], equipment_type_id=row['equipment_type_id'], quantity=row['quantity'],
+            start_time=row['booking__start_time'], end_time=row['booking__end_time'],
+        )
+        for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_usage_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EquipmentReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('booking', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='equipment_reservations', to='bookings.booking')),
+                ('equipment_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='reservations', to='bookings.equipmenttype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['equipment_type', 'start_time', 'end_time'], name='reservation_type_time_idx')],
+                'constraints': [models.UniqueConstraint(fields=('booking', 'equipment_type'), name='reservation_booking_type_unique')],
+            },
+        ),
+        migrations.RunPython(reserve_borrowed_equipment, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 02:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_equipment_reservation'),
+        ('resources', '0004_studyspace_booking_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['-created_at', '-id'], name='booking_created_id_idx'),
+        ),
+    ]
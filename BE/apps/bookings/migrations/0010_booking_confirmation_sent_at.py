@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 03:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_existing_confirmed(apps, schema_editor):
+    # Booking tạo trước khi có trường này đã được gửi email theo từng task riêng
+    Booking = apps.get_model('bookings', 'Booking')
+    Booking.objects.filter(confirmation_sent_at__isnull=True).update(confirmation_sent_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0009_booking_created_id_idx'),
+        ('resources', '0004_studyspace_booking_version'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='confirmation_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_confirmed, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('confirmation_sent_at__isnull', True)), fields=['id'], name='booking_unconfirmed_idx'),
+        ),
+    ]
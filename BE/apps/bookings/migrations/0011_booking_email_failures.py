@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0010_booking_confirmation_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='email_failures',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -1,15 +1,21 @@
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Exists, F, OuterRef, Q, Sum
 from apps.users.models import User
 # from django.contrib.auth.models import User
-from apps.resources.models import StudySpace
+from apps.resources.models import StudySpace, SPACE_TYPE_CHOICES
 import qrcode
 from django.core.files.base import ContentFile
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import APIException, ValidationError
 import io
+from base64 import urlsafe_b64encode
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone as dt_timezone
 from PIL import Image
+from django.conf import settings
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
 
-# Ánh xạ giữa Booking.status và StudySpace.space_status
+# Trạng thái phòng suy ra từ trạng thái booking đang diễn ra (StudySpace.get_space_status)
 SPACE_STATUS_MAPPING = {
     'CONFIRMED': 'BOOKED',
     'CHECK_IN': 'INUSE',
@@ -17,6 +23,30 @@ SPACE_STATUS_MAPPING = {
     'CANCELLED': 'EMPTY',
 }
 
+# Số lần thử tạo booking khi phòng vừa có booking khác (booking_version đổi); thử lại ngay,
+# lần cuối xếp hàng theo khóa ghi của phòng nên không cần chờ giữa các lần
+BOOKING_CREATE_ATTEMPTS = 3
+# Ràng buộc loại trừ chống đặt trùng trên PostgreSQL (migration 0004)
+BOOKING_OVERLAP_CONSTRAINT = 'booking_no_overlap'
+
+
+class BookingConflict(APIException):
+    """Khung giờ vừa bị booking khác chiếm trong lúc tạo (thua cuộc đua)"""
+    status_code = 409
+    default_detail = "Phòng vừa được đặt trong khoảng thời gian này, vui lòng chọn khung giờ khác."
+    default_code = 'booking_conflict'
+
+
+class _SpaceVersionChanged(Exception):
+    pass
+
+
+def _is_overlap_violation(error):
+    """IntegrityError do ràng buộc booking_no_overlap (đặt trùng), phân biệt với lỗi khóa ngoại, NOT NULL, ..."""
+    diag = getattr(error.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None) == BOOKING_OVERLAP_CONSTRAINT
+
+
 class EquipmentType(models.Model):
     name = models.CharField(max_length=50, unique=True)
     description = models.TextField(blank=True, null=True)
@@ -42,72 +72,124 @@ class Booking(models.Model):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Thời điểm đã gửi nhắc nhở, tránh gửi lại ở các lần quét sau
+    checkin_reminder_sent_at = models.DateTimeField(null=True, blank=True)
+    checkout_reminder_sent_at = models.DateTimeField(null=True, blank=True)
+    # Thời điểm đã gửi email xác nhận đặt chỗ (NULL: đang chờ lô gửi tiếp theo)
+    confirmation_sent_at = models.DateTimeField(null=True, blank=True)
+    # Số lần gửi email (xác nhận/nhắc nhở) thất bại, quá EMAIL_MAX_FAILURES thì không gửi lại
+    email_failures = models.PositiveSmallIntegerField(default=0)
+    # Bị hủy tự động vì không check-in (auto_update_booking_status / expire_booking)
+    is_no_show = models.BooleanField(default=False)
+    # Số thiết bị mượn kèm, giữ lại cho thống kê sau khi thiết bị đã được trả
+    equipment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Kiểm tra phòng trống / trạng thái phòng theo thời gian
+            models.Index(fields=['space', 'start_time', 'end_time'], name='booking_space_time_idx'),
+            # auto_update_booking_status và nhắc nhở check-in (CONFIRMED theo start_time)
+            models.Index(fields=['status', 'start_time'], name='booking_status_start_idx'),
+            # Tự động check-out và nhắc nhở check-out (CHECK_IN theo end_time)
+            models.Index(fields=['status', 'end_time'], name='booking_status_end_idx'),
+            # Danh sách booking của người dùng, sắp xếp theo thời gian tạo
+            models.Index(fields=['user', '-created_at'], name='booking_user_created_idx'),
+            # Danh sách toàn bộ booking của quản lý, phân trang theo con trỏ (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='booking_created_id_idx'),
+            # Các booking chưa gửi email xác nhận (send_booking_confirmation_emails)
+            models.Index(fields=['id'], name='booking_unconfirmed_idx',
+                         condition=Q(confirmation_sent_at__isnull=True)),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.space.name}"
 
+    @staticmethod
+    def has_overlap_constraint():
+        """
+        PostgreSQL có ràng buộc loại trừ booking_no_overlap (migration 0004) nên
+        database tự từ chối booking trùng; các backend khác cần khóa dòng phòng.
+        """
+        return connection.vendor == 'postgresql'
+
+    @staticmethod
+    def overlapping(start_time, end_time):
+        """Các booking chưa hủy giao với khoảng [start_time, end_time)"""
+        return Booking.objects.filter(
+            start_time__lt=end_time,
+            end_time__gt=start_time
+        ).exclude(status='CANCELLED')
+
+    @staticmethod
+    def available_spaces(spaces, start_time, end_time):
+        """Lọc các không gian trống trong khoảng thời gian bằng một truy vấn duy nhất"""
+        return spaces.exclude(space_status='INUSE').filter(
+            ~Exists(Booking.overlapping(start_time, end_time).filter(space=OuterRef('pk')))
+        )
+
     @staticmethod
     def check_room_availability(studySpace, start_time, end_time):
         """Kiểm tra phòng có trống trong khoảng thời gian"""
         if studySpace.space_status == 'INUSE':
             return False
-        return not Booking.objects.filter(
-            space=studySpace,
-            start_time__lt=end_time,
-            end_time__gt=start_time
-        ).exclude(status='CANCELLED').exists()
+        return not Booking.overlapping(start_time, end_time).filter(space=studySpace).exists()
     
     @staticmethod
     def check_equipment_availability(equipment_type_id, count, start_time, end_time):
-        """Kiểm tra số lượng thiết bị khả dụng"""
-        equipment_type = EquipmentType.objects.get(id=equipment_type_id)
-        total_available = equipment_type.total_quantity - Equipment.objects.filter(
-            equipment_type=equipment_type,
-            status='BORROWED',
-            booking__start_time__lt=end_time,
-            booking__end_time__gt=start_time
-        ).count()
-        return total_available >= count
+        """Kiểm tra số lượng thiết bị khả dụng trong khung giờ theo sổ giữ chỗ"""
+        window = (equipment_type_id, start_time, end_time)
+        return EquipmentReservation.available_quantities([window])[window] >= count
     
     @staticmethod
     def create_booking(user_id, space_id, start_time, end_time, equipment_requests=None):
-        """Tạo một booking mới"""
+        """
+        Tạo một booking mới theo kiểu lạc quan, không khóa phòng trong lúc kiểm tra:
+        - Đọc booking_version của phòng và kiểm tra phòng trống ngoài transaction.
+        - Trong transaction ghi: tăng booking_version nếu còn đúng giá trị đã đọc
+          (compare-and-swap), tạo booking, giữ chỗ thiết bị và QR.
+        - Nếu phòng vừa có booking khác được tạo (version đổi), thử lại ngay;
+          khung giờ đã bị chiếm trong lúc đó thì báo BookingConflict (409).
+        Trên PostgreSQL ràng buộc loại trừ booking_no_overlap thay cho version.
+        """
         if start_time >= end_time:
             raise ValidationError("Thời gian bắt đầu phải trước thời gian kết thúc.")
-        space = StudySpace.objects.get(id=space_id)
-        if not Booking.check_room_availability(space, start_time, end_time):
-            raise ValidationError("Phòng đã được đặt trong khoảng thời gian này.")
+        quantities = EquipmentReservation.requested_quantities(equipment_requests or [])
         user = User.objects.get(id=user_id)
-        booking = Booking.objects.create(
-            user=user,
-            space=space,
-            start_time=start_time,
-            end_time=end_time
-        )
-        # Cập nhật space_status khi tạo booking
-        space.space_status = SPACE_STATUS_MAPPING['CONFIRMED']
-        space.save()
-        if equipment_requests:
-            for request in equipment_requests:
-                equipment_type_id = request['equipment_type_id']
-                count = request['count']
-                if not Booking.check_equipment_availability(equipment_type_id, count, start_time, end_time):
-                    raise ValidationError(f"Không đủ thiết bị {equipment_type_id} trong khoảng thời gian này.")
-                available_equipments = Equipment.objects.filter(
-                    equipment_type_id=equipment_type_id,
-                    status='AVAILABLE',
-                ).order_by('id')[:count]
-                if len(available_equipments) < count:
-                    booking.delete()
-                    space.space_status = 'EMPTY'  # Rollback nếu không đủ thiết bị
-                    space.save()
-                    raise ValidationError(f"Không đủ thiết bị {equipment_type_id} khả dụng.")
-                for equipment in available_equipments:
-                    equipment.status = 'BORROWED'
-                    equipment.booking = booking
-                    equipment.save()
-        QRCode.generate_qr_code(booking)
-        return booking
+        for attempt in range(BOOKING_CREATE_ATTEMPTS):
+            space = StudySpace.objects.get(id=space_id)
+            if not Booking.check_room_availability(space, start_time, end_time):
+                if attempt:
+                    raise BookingConflict()
+                raise ValidationError("Phòng đã được đặt trong khoảng thời gian này.")
+            try:
+                with transaction.atomic():
+                    if not Booking.has_overlap_constraint():
+                        spaces = StudySpace.objects.filter(id=space_id)
+                        if attempt == BOOKING_CREATE_ATTEMPTS - 1:
+                            # Lần thử cuối: tăng version vô điều kiện (xếp hàng sau các transaction
+                            # ghi khác của phòng) rồi kiểm tra lại, chỉ báo 409 khi thật sự trùng
+                            spaces.update(booking_version=F('booking_version') + 1)
+                            if not Booking.check_room_availability(space, start_time, end_time):
+                                raise BookingConflict()
+                        elif not spaces.filter(booking_version=space.booking_version).update(
+                                booking_version=F('booking_version') + 1):
+                            raise _SpaceVersionChanged()
+                    booking = Booking.objects.create(
+                        user=user,
+                        space=space,
+                        start_time=start_time,
+                        end_time=end_time,
+                        equipment_count=sum(quantities.values())
+                    )
+                    EquipmentReservation.reserve(booking, equipment_requests or [])
+                    QRCode.generate_qr_code(booking)
+                    return booking
+            except _SpaceVersionChanged:
+                continue
+            except IntegrityError as error:
+                if _is_overlap_violation(error):
+                    raise BookingConflict()
+                raise
 
 class Equipment(models.Model):
     equipment_type = models.ForeignKey(EquipmentType, on_delete=models.PROTECT)
@@ -125,30 +207,184 @@ class Equipment(models.Model):
         booking_id = self.booking.id if self.booking else "None"
         return f"{self.equipment_type.name} (ID: {self.id}) for Booking {booking_id}"
 
+# Thông tin mã hóa trong QR, đủ để kiểm tra mà không cần đọc database
+QRClaims = namedtuple('QRClaims', ['qr_id', 'booking_id', 'start_time', 'end_time'])
+
+
+class EquipmentReservation(models.Model):
+    """
+    Sổ giữ chỗ thiết bị: booking giữ một số lượng mỗi loại thiết bị cho khung giờ của nó.
+    Thiết bị cụ thể (Equipment) chỉ được giao khi check-in (allocate_equipment).
+    Giữ chỗ của booking đã hủy hoặc đã check-out không còn chiếm số lượng.
+    """
+    booking = models.ForeignKey(Booking, on_delete=models.CASCADE, related_name='equipment_reservations')
+    equipment_type = models.ForeignKey(EquipmentType, on_delete=models.PROTECT, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    # Sao chép từ booking để tìm giữ chỗ giao khung giờ bằng chỉ mục
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['booking', 'equipment_type'], name='reservation_booking_type_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['equipment_type', 'start_time', 'end_time'], name='reservation_type_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.equipment_type_id} for Booking {self.booking_id}"
+
+    @staticmethod
+    def active():
+        return EquipmentReservation.objects.exclude(booking__status__in=['CANCELLED', 'CHECK_OUT'])
+
+    @staticmethod
+    def available_quantities(windows, totals=None):
+        """
+        Số thiết bị còn trống cho nhiều (equipment_type_id, start_time, end_time) cùng lúc:
+        total_quantity trừ tổng số lượng các giữ chỗ giao khung giờ (ước lượng an toàn,
+        không bao giờ cho giữ quá số lượng). Một truy vấn gom giữ chỗ theo (loại, khung giờ),
+        phần cộng dồn cho từng khung giờ làm trong Python.
+        """
+        windows = list(dict.fromkeys(windows))
+        if not windows:
+            return {}
+        if totals is None:
+            totals = dict(EquipmentType.objects.filter(
+                id__in={type_id for type_id, _, _ in windows}
+            ).values_list('id', 'total_quantity'))
+        reserved = defaultdict(list)
+        rows = EquipmentReservation.active().filter(
+            equipment_type_id__in={type_id for type_id, _, _ in windows},
+            start_time__lt=max(end_time for _, _, end_time in windows),
+            end_time__gt=min(start_time for _, start_time, _ in windows),
+        ).values_list('equipment_type_id', 'start_time', 'end_time').annotate(total=Sum('quantity')).order_by()
+        for type_id, start_time, end_time, total in rows:
+            reserved[type_id].append((start_time, end_time, total))
+        available = {}
+        for type_id, start_time, end_time in windows:
+            available[(type_id, start_time, end_time)] = totals.get(type_id, 0) - sum(
+                total for reserved_start, reserved_end, total in reserved[type_id]
+                if reserved_start < end_time and reserved_end > start_time
+            )
+        return available
+
+    @staticmethod
+    def requested_quantities(equipment_requests):
+        """Gộp các yêu cầu {equipment_type_id, count} thành {type_id: số lượng}, báo lỗi 400 nếu sai định dạng"""
+        quantities = {}
+        for request in equipment_requests:
+            try:
+                type_id, count = int(request['equipment_type_id']), int(request['count'])
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError("Mỗi yêu cầu thiết bị cần equipment_type_id và count là số nguyên.")
+            if count <= 0:
+                raise ValidationError("Số lượng thiết bị phải lớn hơn 0.")
+            quantities[type_id] = quantities.get(type_id, 0) + count
+        return quantities
+
+    @staticmethod
+    def reserve(booking, equipment_requests):
+        """
+        Giữ chỗ nhiều loại thiết bị cho booking trong một transaction (gọi từ create_booking):
+        khóa các dòng EquipmentType theo thứ tự id, tính số còn trống bằng một truy vấn,
+        rồi ghi toàn bộ giữ chỗ bằng một câu INSERT. Thiếu bất kỳ loại nào thì không giữ gì.
+        """
+        quantities = EquipmentReservation.requested_quantities(equipment_requests)
+        if not quantities:
+            return []
+        totals = dict(EquipmentType.objects.select_for_update().filter(
+            id__in=quantities
+        ).order_by('id').values_list('id', 'total_quantity'))
+        windows = {type_id: (type_id, booking.start_time, booking.end_time) for type_id in quantities}
+        available = EquipmentReservation.available_quantities(windows.values(), totals)
+        for type_id, quantity in quantities.items():
+            if available[windows[type_id]] < quantity:
+                raise ValidationError(f"Không đủ thiết bị {type_id} trong khoảng thời gian này.")
+        return EquipmentReservation.objects.bulk_create([
+            EquipmentReservation(booking=booking, equipment_type_id=type_id, quantity=quantity,
+                                 start_time=booking.start_time, end_time=booking.end_time)
+            for type_id, quantity in quantities.items()
+        ])
+
+
 class QRCode(models.Model):
+    # Payload dạng "<phiên bản>.<qr_id>.<booking_id>.<start>.<end>.<chữ ký>", thời gian là epoch (giây)
+    PAYLOAD_VERSION = 'SSB1'
+    SIGNATURE_BYTES = 12
+
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='qr_code')
-    image = models.ImageField(upload_to='qrcodes/')
+    payload = models.TextField(blank=True)
+    image = models.ImageField(upload_to='qrcodes/', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     @staticmethod
     def generate_qr_code(booking):
-        # Logic to generate QR code image
+        """Tạo bản ghi QR chỉ với payload, ảnh PNG được render sau (ensure_image)"""
         qr_code = QRCode.objects.create(booking=booking)
-        qr_data = f"QR ID: {qr_code.id} \
-                    \nBooking ID: {qr_code.booking.id} \
-                    \nUser: {qr_code.booking.user} \
-                    \nSpace: {qr_code.booking.space} \
-                    \nTime: {qr_code.booking.start_time}--{qr_code.booking.end_time}"
+        qr_code.payload = qr_code.build_payload()
+        qr_code.save(update_fields=['payload'])
+        return qr_code
+
+    def build_payload(self):
+        """Nội dung được mã hóa trong ảnh QR"""
+        return QRCode.sign_payload(self.id, self.booking_id, self.booking.start_time, self.booking.end_time)
+
+    @staticmethod
+    def _signature(message, secret=None):
+        digest = salted_hmac('apps.bookings.QRCode', message, secret=secret, algorithm='sha256').digest()
+        return urlsafe_b64encode(digest[:QRCode.SIGNATURE_BYTES]).decode().rstrip('=')
+
+    @staticmethod
+    def sign_payload(qr_id, booking_id, start_time, end_time):
+        """Payload ngắn gọn có chữ ký HMAC (theo SECRET_KEY) cho QR của booking"""
+        message = f"{QRCode.PAYLOAD_VERSION}.{qr_id}.{booking_id}.{int(start_time.timestamp())}.{int(end_time.timestamp())}"
+        return f"{message}.{QRCode._signature(message)}"
+
+    @staticmethod
+    def decode_payload(qr_data):
+        """
+        Kiểm tra chữ ký và trả về QRClaims, không truy vấn database.
+        Trả về None nếu không đúng định dạng hoặc sai chữ ký. Chấp nhận cả chữ ký
+        tạo bằng SECRET_KEY_FALLBACKS để QR cũ vẫn dùng được khi đổi khóa.
+        """
+        message, _, signature = qr_data.strip().rpartition('.')
+        parts = message.split('.')
+        if len(parts) != 5 or parts[0] != QRCode.PAYLOAD_VERSION:
+            return None
+        secrets = [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', [])]
+        if not any(constant_time_compare(signature, QRCode._signature(message, secret)) for secret in secrets):
+            return None
+        try:
+            qr_id, booking_id, start, end = (int(part) for part in parts[1:])
+        except ValueError:
+            return None
+        return QRClaims(
+            qr_id, booking_id,
+            datetime.fromtimestamp(start, tz=dt_timezone.utc), datetime.fromtimestamp(end, tz=dt_timezone.utc),
+        )
+
+    def render_image(self):
+        """Render payload thành ảnh PNG và lưu vào MEDIA_ROOT"""
+        if not self.payload:
+            self.payload = self.build_payload()
         qr = qrcode.QRCode(version=1, box_size=10, border=5)
-        qr.add_data(qr_data)
+        qr.add_data(self.payload)
         qr.make(fit=True)
         img = qr.make_image(fill_color="black", back_color="white")
         buffer = io.BytesIO()
         img.save(buffer, format="PNG")
-        qr_code.image.save(f"qr_code_{qr_code.booking.id}.png", ContentFile(buffer.getvalue()), save=False)
+        self.image.save(f"qr_code_{self.booking_id}.png", ContentFile(buffer.getvalue()), save=False)
         buffer.close()
-        qr_code.save()
-        return qr_code
+        self.save(update_fields=['payload', 'image'])
+        return self.image
+
+    def ensure_image(self):
+        """Trả về ảnh QR, render ở lần truy cập đầu tiên nếu chưa có"""
+        if not self.image:
+            self.render_image()
+        return self.image
 
     def validate_qr_code(self):
         """Kiểm tra tính hợp lệ của mã QR dựa trên Booking.status"""
@@ -184,4 +420,46 @@ class NotificationConfig(models.Model):
     def get_config(cls):
         # Luôn lấy bản ghi đầu tiên, nếu không tồn tại thì tạo mới
         config, created = cls.objects.get_or_create(pk=1)
-        return config
\ No newline at end of file
+        return config
+
+class UsageRollup(models.Model):
+    """
+    Số liệu sử dụng đã tổng hợp theo ngày (giờ địa phương).
+    - bookings, cancellations, no_shows, equipment_borrowed: tính vào ngày bắt đầu.
+    - booked_hours: tổng giờ của các booking không bị hủy, chia theo ranh giới ngày.
+    - used_hours: tổng giờ của các booking đã check-in (CHECK_IN, CHECK_OUT).
+    """
+    day = models.DateField()
+    bookings = models.PositiveIntegerField(default=0)
+    booked_hours = models.FloatField(default=0)
+    used_hours = models.FloatField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    no_shows = models.PositiveIntegerField(default=0)
+    equipment_borrowed = models.PositiveIntegerField(default=0)
+
+    METRICS = ('bookings', 'booked_hours', 'used_hours', 'cancellations', 'no_shows', 'equipment_borrowed')
+
+    class Meta:
+        abstract = True
+
+
+class SpaceUsageDaily(UsageRollup):
+    space = models.ForeignKey(StudySpace, on_delete=models.CASCADE, related_name='usage_rollups')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'space'], name='space_usage_daily_unique'),
+        ]
+
+
+class SpaceTypeUsageDaily(UsageRollup):
+    space_type = models.CharField(max_length=20, choices=SPACE_TYPE_CHOICES)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'space_type'], name='space_type_usage_daily_unique'),
+        ]
+
+
+class UsageDaily(UsageRollup):
+    day = models.DateField(unique=True)
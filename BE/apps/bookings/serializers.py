@@ -1,5 +1,7 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Booking, Equipment, EquipmentType
+from .models import Booking, Equipment, EquipmentReservation, EquipmentType
+from .services import MAX_SCAN_BATCH
 from apps.resources.models import StudySpace
 from django.utils import timezone
 
@@ -18,6 +20,11 @@ class EquipmentSerializer(serializers.ModelSerializer):
         model = Equipment
         fields = ['id', 'equipment_type', 'equipment_type_id', 'status', 'booking']
 
+class EquipmentReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EquipmentReservation
+        fields = ['equipment_type_id', 'quantity']
+
 class BookingSerializer(serializers.ModelSerializer):
     space_name = serializers.CharField(source='space.name', read_only=True)
     space_id = serializers.PrimaryKeyRelatedField(
@@ -25,6 +32,8 @@ class BookingSerializer(serializers.ModelSerializer):
     )
     user = serializers.StringRelatedField(read_only=True)
     equipments = EquipmentSerializer(many=True, read_only=True)
+    # Số thiết bị đã giữ chỗ, thiết bị cụ thể (equipments) được giao khi check-in
+    equipment_reservations = EquipmentReservationSerializer(many=True, read_only=True)
     equipment_requests = serializers.ListField(
         child=serializers.DictField(), write_only=True, required=False
     )
@@ -32,12 +41,20 @@ class BookingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Booking
-        fields = ['id', 'user', 'space_name', 'space_id', 'start_time', 'end_time', 'status', 'equipments', 'equipment_requests', 'qr_code_url']
+        fields = ['id', 'user', 'space_name', 'space_id', 'start_time', 'end_time', 'status', 'equipments', 'equipment_reservations', 'equipment_requests', 'qr_code_url']
+
+    @staticmethod
+    def setup_queryset(bookings):
+        """Nạp sẵn user, space, QR, thiết bị và giữ chỗ cho cả danh sách booking"""
+        return bookings.select_related('user', 'space', 'qr_code').prefetch_related(
+            'equipments__equipment_type', 'equipment_reservations'
+        )
 
     def get_qr_code_url(self, obj):
         """Trả về URL của hình ảnh mã QR"""
-        if hasattr(obj, 'qr_code') and obj.qr_code.image:
-            return self.context['request'].build_absolute_uri(obj.qr_code.image.url)
+        if hasattr(obj, 'qr_code'):
+            # Ảnh được render ở endpoint ảnh (lần lấy đầu tiên), serializer chỉ đọc
+            return self.context['request'].build_absolute_uri(reverse('booking_qr_code_image', args=[obj.id]))
         return None
 
     def validate(self, data):
@@ -45,4 +62,14 @@ class BookingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Thời gian bắt đầu phải trước thời gian kết thúc.")
         if data['start_time'] < timezone.now():
             raise serializers.ValidationError("Không thể đặt phòng trong quá khứ.")
-        return data
\ No newline at end of file
+        return data
+
+class QRScanSerializer(serializers.Serializer):
+    """Một lượt quét trong lô gửi từ máy quét ở cửa"""
+    qr_code_id = serializers.IntegerField()
+    qr_data = serializers.CharField()
+    scanned_at = serializers.DateTimeField(required=False)
+
+
+class QRScanBatchSerializer(serializers.Serializer):
+    scans = QRScanSerializer(many=True, allow_empty=False, max_length=MAX_SCAN_BATCH)
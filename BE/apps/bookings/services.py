@@ -1,207 +1,757 @@
-from rest_framework.exceptions import ValidationError
-from .models import QRCode, Booking, Equipment, SPACE_STATUS_MAPPING
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from .models import QRClaims, QRCode, Booking, Equipment, EquipmentReservation, SpaceUsageDaily, SpaceTypeUsageDaily, UsageDaily
 from django.utils import timezone
-from datetime import timedelta
+import logging
+import operator
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from functools import reduce
 from dateutil.parser import parse
-from django.utils.timezone import localtime
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.db.models.functions import TruncDate
+from apps.resources.services import publish_space_status
+from . import signals
 
-def validate_qr_data(qr_code_id, qr_data):
-    """Xác thực dữ liệu QR dựa trên qr_code_id và qr_data"""
+logger = logging.getLogger(__name__)
+
+def _decode_legacy_qr_data(qr_code_id, qr_data):
+    """
+    Payload cũ dạng nhiều dòng "Khóa: giá trị" (QR tạo trước khi có chữ ký).
+    Payload này không có chữ ký nên phải đối chiếu với QRCode trong database.
+    """
     try:
-        qr_code = QRCode.objects.get(id=qr_code_id)
-        qr_info = dict(item.split(": ") for item in qr_data.split("\n"))
-        print(f"QR Info: {qr_info}")
+        qr_info = {key.strip(): value.strip() for key, value in
+                   (item.split(": ", 1) for item in qr_data.split("\n"))}
         qr_id = int(qr_info.get('QR ID', '-1'))
         booking_id = int(qr_info.get('Booking ID', '-1'))
-        if qr_id != qr_code.id or booking_id != qr_code.booking.id:
-            print(f"ID mismatch: qr_id={qr_id}, qr_code.id={qr_code.id}, booking_id={booking_id}, booking.id={qr_code.booking.id}")
-            return False
-        current_time = localtime(timezone.now())  # Chuyển current_time sang múi giờ Việt Nam
-        time_str = qr_info.get('Time', '')
-        if not time_str:
-            print("Time field missing")
-            return False
-        # Tách thành start và end dựa trên ký tự '-' cuối cùng
-        time_parts = time_str.rsplit('--', 1)
-        if len(time_parts) != 2:
-            print(f"Invalid Time format: {time_str}")
-            return False
-        start_time_str = time_parts[0].strip()
-        end_time_str = time_parts[1].strip()
-        start_time = parse(start_time_str)
-        end_time = parse(end_time_str)
-        if not (start_time <= current_time <= end_time):
-            print(f"Time mismatch: current_time={current_time}, start_time={start_time}, end_time={end_time}")
-            return False
-        if qr_code.booking.status not in ['CONFIRMED', 'CHECK_IN']:
-            print(f"Invalid status: {qr_code.booking.status}")
-            return False
-        print(f"QR Code {qr_code_id} validated successfully.")
-        return True
-    except QRCode.DoesNotExist:
-        print(f"QRCode with id={qr_code_id} does not exist")
-        return False
-    except (KeyError, ValueError, IndexError) as e:
-        print(f"Parse error: {str(e)}")
-        return False
-
-def process_qr_scan(qr_code_id, qr_data):
-    """Xử lý quét mã QR để check-in hoặc check-out"""
+        # Tách thành start và end dựa trên ký tự '--' cuối cùng
+        start_time_str, end_time_str = qr_info['Time'].rsplit('--', 1)
+        start_time = parse(start_time_str.strip())
+        end_time = parse(end_time_str.strip())
+    except (KeyError, ValueError, IndexError):
+        return None
+    if qr_id != qr_code_id or not QRCode.objects.filter(id=qr_id, booking_id=booking_id).exists():
+        return None
+    return QRClaims(qr_id, booking_id, start_time, end_time)
+
+
+def validate_qr_data(qr_code_id, qr_data, current_time=None):
+    """
+    Xác thực dữ liệu QR, trả về QRClaims nếu hợp lệ, ngược lại None.
+    - Payload có chữ ký (QRCode.sign_payload) được kiểm tra hoàn toàn trong bộ nhớ.
+    - Payload cũ được giải mã bằng _decode_legacy_qr_data (cần một truy vấn).
+    Trạng thái booking được kiểm tra khi chuyển trạng thái (process_qr_scan).
+    """
     try:
-        if not validate_qr_data(qr_code_id, qr_data):
-            raise ValidationError("Dữ liệu QR không hợp lệ.")
+        qr_code_id = int(qr_code_id)
+    except (TypeError, ValueError):
+        return None
+    claims = QRCode.decode_payload(qr_data) or _decode_legacy_qr_data(qr_code_id, qr_data)
+    if claims is None or claims.qr_id != qr_code_id:
+        return None
+    current_time = current_time or timezone.now()
+    if not (claims.start_time <= current_time <= claims.end_time):
+        return None
+    return claims
 
-        qr_code = QRCode.objects.get(id=qr_code_id)
-        booking = qr_code.booking
-        current_time = timezone.now()
+def process_qr_scan(qr_code_id, qr_data, user=None):
+    """
+    Xử lý quét mã QR để check-in hoặc check-out.
+    Chỉ bước chuyển trạng thái đụng tới database: khóa dòng booking rồi đổi trạng thái.
+    Nếu truyền user (không phải quản lý) thì booking phải thuộc user đó.
+    """
+    claims = validate_qr_data(qr_code_id, qr_data)
+    if not claims:
+        raise ValidationError("Dữ liệu QR không hợp lệ.")
 
+    with transaction.atomic():
+        booking = Booking.objects.select_for_update(of=('self',)).select_related('user', 'space').filter(
+            id=claims.booking_id
+        ).first()
+        if booking is None:
+            raise ValidationError("Booking không tồn tại.")
+        if user is not None and booking.user_id != user.id:
+            raise PermissionDenied("Bạn không có quyền thực hiện hành động này")
         if booking.status == 'CONFIRMED':
             booking.status = 'CHECK_IN'
-            booking.space.space_status = SPACE_STATUS_MAPPING['CHECK_IN']
-            print(f"Booking status updated to CHECK_IN for booking ID: {booking.id}")
-            booking.space.save()
-            booking.save()
-            return booking
         elif booking.status == 'CHECK_IN':
             booking.status = 'CHECK_OUT'
-            booking.space.space_status = SPACE_STATUS_MAPPING['CHECK_OUT']
-            booking.space.save()
-            return_equipment(booking)
-            booking.save()
-            return booking
         else:
             raise ValidationError("Booking không ở trạng thái phù hợp để quét (phải là CONFIRMED hoặc CHECK_IN).")
-    except QRCode.DoesNotExist:
-        raise ValidationError("Mã QR không tồn tại.")
+        booking.save(update_fields=['status'])
+        if booking.status == 'CHECK_IN':
+            booking.equipment_shortfall = allocate_equipment([booking]).shortfall.get(booking.id, {})
+            schedule_booking_deadlines(booking)
+        else:
+            return_equipment([booking])
+    return booking
+
+# Lượt quét hợp lệ chuyển booking sang trạng thái kế tiếp
+SCAN_TRANSITIONS = {'CONFIRMED': 'CHECK_IN', 'CHECK_IN': 'CHECK_OUT'}
+MAX_SCAN_BATCH = 1000
+
+
+def process_qr_scans(scans, current_time=None):
+    """
+    Xử lý một lô lượt quét [(qr_code_id, qr_data, scanned_at)] từ máy quét ở cửa
+    (máy quét có thể lưu tạm khi mất mạng rồi gửi dồn, scanned_at là lúc quét thật).
+    - Xác thực từng QR trong bộ nhớ, khung giờ so với scanned_at (không muộn hơn hiện tại).
+    - Áp dụng các chuyển trạng thái theo thứ tự quét trong một transaction: khóa các
+      booking bằng một truy vấn, rồi UPDATE hàng loạt booking và thiết bị.
+    Trả về kết quả từng lượt theo đúng thứ tự gửi lên.
+    """
+    current_time = current_time or timezone.now()
+    results, valid = [], []
+    for index, (qr_code_id, qr_data, scanned_at) in enumerate(scans):
+        claims = validate_qr_data(qr_code_id, qr_data, current_time=min(scanned_at or current_time, current_time))
+        results.append({'qr_code_id': qr_code_id, 'ok': False, 'error': "Dữ liệu QR không hợp lệ."})
+        if claims:
+            valid.append((index, claims))
+
+    with transaction.atomic():
+        bookings = Booking.objects.select_for_update().in_bulk({claims.booking_id for _, claims in valid})
+        initial_status = {booking_id: booking.status for booking_id, booking in bookings.items()}
+        for index, claims in valid:
+            booking = bookings.get(claims.booking_id)
+            if booking is None:
+                results[index]['error'] = "Booking không tồn tại."
+            elif booking.status not in SCAN_TRANSITIONS:
+                results[index]['error'] = "Booking không ở trạng thái phù hợp để quét (phải là CONFIRMED hoặc CHECK_IN)."
+            else:
+                booking.status = SCAN_TRANSITIONS[booking.status]
+                results[index] = {'qr_code_id': claims.qr_id, 'ok': True, 'booking_id': booking.id, 'status': booking.status}
+
+        changed = [booking for booking in bookings.values() if booking.status != initial_status[booking.id]]
+        for new_status in ('CHECK_OUT', 'CHECK_IN'):
+            group = [booking for booking in changed if booking.status == new_status]
+            if not group:
+                continue
+            Booking.objects.filter(id__in=[booking.id for booking in group]).update(status=new_status)
+            if new_status == 'CHECK_OUT':
+                return_equipment(group)
+            else:
+                shortfall = allocate_equipment(group).shortfall
+                for result in results:
+                    if result.get('status') == 'CHECK_IN' and result['booking_id'] in shortfall:
+                        result['equipment_shortfall'] = equipment_shortfall_payload(shortfall[result['booking_id']])
+                schedule_booking_deadlines(*group)
+        # UPDATE hàng loạt không phát signal post_save
+        schedule_usage_refresh(usage_keys((booking.space_id, booking.start_time, booking.end_time) for booking in changed))
+        publish_space_status(booking.space_id for booking in changed)
+    return results
+
+# Kết quả giao thiết bị: số thiết bị đã giao và phần thiếu {booking_id: {equipment_type_id: số thiếu}}
+EquipmentAllocation = namedtuple('EquipmentAllocation', ['allocated', 'shortfall'])
+
+
+def allocate_equipment(bookings):
+    """
+    Giao thiết bị cụ thể (AVAILABLE -> BORROWED) theo số lượng đã giữ chỗ khi check-in,
+    cho một hoặc nhiều booking: mỗi loại thiết bị một truy vấn chọn thiết bị rảnh, rồi
+    mỗi booking một câu UPDATE. Thiết bị đã giao trước đó được tính vào.
+    Phát signal equipment_allocated một lần cho cả lô, trả về EquipmentAllocation.
+    Thiếu thiết bị rảnh (hỏng, đang bảo trì) không chặn check-in: phần thiếu được ghi log
+    và trả về trong shortfall để nơi gọi báo lại.
+    """
+    booking_ids = [booking.id for booking in bookings]
+    assigned = dict(
+        ((row['booking_id'], row['equipment_type_id']), row['units'])
+        for row in Equipment.objects.filter(booking_id__in=booking_ids)
+        .values('booking_id', 'equipment_type_id').annotate(units=Count('id')).order_by()
+    )
+    missing = defaultdict(list)
+    for booking_id, type_id, quantity in EquipmentReservation.objects.filter(booking_id__in=booking_ids).values_list(
+        'booking_id', 'equipment_type_id', 'quantity'
+    ):
+        missing[type_id].extend([booking_id] * (quantity - assigned.get((booking_id, type_id), 0)))
+    units = defaultdict(list)
+    shortfall = defaultdict(dict)
+    for type_id, holders in missing.items():
+        if not holders:
+            continue
+        free_units = list(Equipment.objects.select_for_update(skip_locked=True).filter(
+            equipment_type_id=type_id, status='AVAILABLE'
+        ).order_by('id').values_list('id', flat=True)[:len(holders)])
+        for equipment_id, booking_id in zip(free_units, holders):
+            units[booking_id].append(equipment_id)
+        for booking_id in holders[len(free_units):]:
+            shortfall[booking_id][type_id] = shortfall[booking_id].get(type_id, 0) + 1
+    if shortfall:
+        logger.warning("Thiếu thiết bị khi check-in (booking: {loại thiết bị: số thiếu}): %s", dict(shortfall))
+    if not units:
+        return EquipmentAllocation(0, dict(shortfall))
+    # Mỗi booking một câu UPDATE theo danh sách id (CASE của bulk_update chậm khi lô lớn);
+    # điều kiện status giữ lại để bỏ qua thiết bị vừa bị giao cho booking khác
+    allocated = sum(
+        Equipment.objects.filter(id__in=equipment_ids, status='AVAILABLE').update(status='BORROWED', booking_id=booking_id)
+        for booking_id, equipment_ids in units.items()
+    )
+    signals.equipment_allocated.send(
+        sender=Equipment,
+        equipment_ids=[equipment_id for equipment_ids in units.values() for equipment_id in equipment_ids],
+        booking_ids=sorted(units),
+    )
+    return EquipmentAllocation(allocated, dict(shortfall))
 
-def return_equipment(booking):
-    """Trả thiết bị về pool"""
-    for equipment in booking.equipments.all():
-        equipment.status = 'AVAILABLE'
-        equipment.booking = None
-        equipment.save()
+
+def equipment_shortfall_payload(shortfall):
+    """Phần thiếu thiết bị của một booking dạng trả về cho API"""
+    return [{'equipment_type_id': type_id, 'missing': count} for type_id, count in sorted(shortfall.items())]
+
+def return_equipment(bookings):
+    """
+    Trả thiết bị của các booking (đối tượng Booking hoặc id) về pool bằng một câu UPDATE.
+    UPDATE hàng loạt không phát post_save nên signal equipment_released được phát
+    một lần cho cả lô. Trả về số thiết bị đã trả.
+    """
+    borrowed = dict(Equipment.objects.filter(booking__in=bookings).values_list('id', 'booking_id'))
+    if not borrowed:
+        return 0
+    released = Equipment.objects.filter(id__in=borrowed).update(status='AVAILABLE', booking=None)
+    signals.equipment_released.send(
+        sender=Equipment,
+        equipment_ids=list(borrowed),
+        booking_ids=sorted(set(borrowed.values())),
+    )
+    return released
 
 def update_booking_status(booking_id, new_status):
     """Cập nhật trạng thái booking và xử lý thiết bị nếu cần"""
-    try:
-        booking = Booking.objects.get(id=booking_id)
-        if new_status not in [choice[0] for choice in Booking.STATUS_CHOICES]:
-            raise ValidationError("Trạng thái không hợp lệ.")
+    if new_status not in [choice[0] for choice in Booking.STATUS_CHOICES]:
+        raise ValidationError("Trạng thái không hợp lệ.")
+    with transaction.atomic():
+        try:
+            booking = Booking.objects.select_for_update(of=('self',)).select_related('user', 'space').get(id=booking_id)
+        except Booking.DoesNotExist:
+            raise ValidationError("Booking không tồn tại.")
         booking.status = new_status
-        booking.space.space_status = SPACE_STATUS_MAPPING.get(new_status, 'EMPTY')
-        booking.space.save()
-        booking.save()
+        booking.save(update_fields=['status'])
         if new_status in ['CHECK_OUT', 'CANCELLED']:
-            return_equipment(booking)
-        return booking
-    except Booking.DoesNotExist:
-        raise ValidationError("Booking không tồn tại.")
+            return_equipment([booking])
+        else:
+            if new_status == 'CHECK_IN':
+                booking.equipment_shortfall = allocate_equipment([booking]).shortfall.get(booking.id, {})
+            schedule_booking_deadlines(booking)
+    return booking
 
 
 from celery import shared_task
 
+# Tự động hủy nếu sau start_time 30 phút mà chưa check-in,
+# tự động check-out nếu sau end_time 30 phút mà chưa check-out
+AUTO_CANCEL_AFTER = timedelta(minutes=30)
+AUTO_CHECKOUT_AFTER = timedelta(minutes=30)
+SWEEP_CHUNK_SIZE = 500
+
+
+def _sweep_bookings(due_bookings, new_status, chunk_size, **changes):
+    """
+    Chuyển các booking quá hạn sang new_status (kèm các trường trong changes)
+    theo từng lô chunk_size, mỗi lô là vài câu UPDATE hàng loạt trong một transaction.
+    """
+    processed = 0
+    while True:
+        with transaction.atomic():
+            rows = list(due_bookings.select_for_update().values_list(
+                'id', 'space_id', 'start_time', 'end_time')[:chunk_size])
+            if not rows:
+                return processed
+            booking_ids = [booking_id for booking_id, _, _, _ in rows]
+            Booking.objects.filter(id__in=booking_ids).update(status=new_status, **changes)
+            # Trả thiết bị về pool cho cả lô
+            return_equipment(booking_ids)
+            schedule_usage_refresh(usage_keys(row[1:] for row in rows))
+            publish_space_status(space_id for _, space_id, _, _ in rows)
+        processed += len(rows)
+
+
 @shared_task
-def auto_update_booking_status():
-    """Tự động cập nhật trạng thái booking nếu quá thời gian"""
+def auto_update_booking_status(chunk_size=SWEEP_CHUNK_SIZE):
+    """Tự động cập nhật trạng thái booking nếu quá thời gian, trả về số booking đã xử lý"""
     current_time = timezone.now()
-    bookings = Booking.objects.filter(
-        status__in=['CONFIRMED', 'CHECK_IN']
-    )
-
-    for booking in bookings:
-        # Tự động hủy nếu sau start_time 30 phút mà chưa check-in
-        if (booking.status == 'CONFIRMED' and
-            current_time > booking.start_time + timedelta(minutes=30)):
-            booking.status = 'CANCELLED'
-            booking.space.space_status = SPACE_STATUS_MAPPING['CANCELLED']
-            booking.space.save()
-            return_equipment(booking)
-            booking.save()
-
-        # Tự động check-out nếu sau end_time 30 phút mà chưa check-out
-        elif (booking.status == 'CHECK_IN' and
-              current_time > booking.end_time + timedelta(minutes=30)):
-            booking.status = 'CHECK_OUT'
-            booking.space.space_status = SPACE_STATUS_MAPPING['CHECK_OUT']
-            booking.space.save()
-            return_equipment(booking)
-            booking.save()
+    cancelled = _sweep_bookings(
+        Booking.objects.filter(status='CONFIRMED', start_time__lt=current_time - AUTO_CANCEL_AFTER),
+        'CANCELLED',
+        chunk_size,
+        is_no_show=True,
+    )
+    checked_out = _sweep_bookings(
+        Booking.objects.filter(status='CHECK_IN', end_time__lt=current_time - AUTO_CHECKOUT_AFTER),
+        'CHECK_OUT',
+        chunk_size,
+    )
+    return {'cancelled': cancelled, 'checked_out': checked_out}
 
-from django.core.mail import EmailMessage
+from smtplib import SMTPException, SMTPServerDisconnected
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
 from .models import  NotificationConfig
 
+EMAIL_RETRY_BACKOFF_SECONDS = 30
+EMAIL_RETRY_BACKOFF_MAX_SECONDS = 600
+CONFIRMATION_BATCH_SIZE = 200
+# Số lần gửi lỗi tối đa cho một booking (người nhận bị từ chối, thiếu file ảnh QR...) trước khi bỏ qua
+EMAIL_MAX_FAILURES = 3
+# Lỗi kết nối SMTP: cả lô được trả lại và task thử lại; các lỗi khác chỉ ảnh hưởng email đang gửi
+EMAIL_CONNECTION_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def build_booking_confirmation_email(booking):
+    """Tạo email xác nhận đặt chỗ kèm ảnh mã QR"""
+    image_file = booking.qr_code.ensure_image()
+    with image_file.open('rb') as f:
+        image_data = f.read()
+    # Tạo nội dung HTML với ảnh nhúng
+    cid = "qr_code_image"  # Content-ID cho ảnh
+    html_content = (
+        f"Chào bạn,<br><br>Đặt chỗ của bạn đã thành công!<br><br>"
+        f'<img src="cid:{cid}" alt="QR Code"><br><br>'
+        f"Trân trọng,<br>Hệ thống"
+    )
+    email = EmailMessage(
+        'Đặt chỗ thành công',
+        html_content,
+        settings.EMAIL_HOST_USER,
+        [booking.user.email],
+    )
+    email.content_subtype = "html"  # Đặt nội dung là HTML
+    email.attach('qr_code.png', image_data, 'image/png')  # Gắn ảnh
+    return email
+
+
+@shared_task(bind=True, max_retries=5)
+def send_booking_confirmation_emails(self, batch_size=CONFIRMATION_BATCH_SIZE):
+    """
+    Gửi email xác nhận cho mọi booking chưa được xác nhận, theo lô qua một kết nối SMTP.
+    Mỗi request đặt chỗ chỉ đẩy task sau commit: khi nhiều booking được tạo dồn dập, lần chạy
+    đầu gom chúng vào chung lô, các lần sau không còn gì để gửi.
+    Khi mất kết nối SMTP, các booking chưa gửi được trả lại và task thử lại với backoff tăng dần;
+    lỗi của riêng một email không chặn các email còn lại (xem _deliver_unsent).
+    """
+    try:
+        return _deliver_unsent(Booking.objects.all(), 'confirmation_sent_at', build_booking_confirmation_email,
+                               ('user', 'qr_code'), batch_size)
+    except (SMTPException, OSError) as exc:
+        countdown = min(EMAIL_RETRY_BACKOFF_SECONDS * 2 ** self.request.retries, EMAIL_RETRY_BACKOFF_MAX_SECONDS)
+        raise self.retry(exc=exc, countdown=countdown)
+
+
+def build_checkin_reminder_email(booking):
+    """Tạo email nhắc nhở check-in cho một booking"""
+    html_content = (
+        f"Chào {booking.user.username},<br><br>"
+        f"Đây là thông báo nhắc nhở về đặt phòng của bạn:<br><br>"
+        f"- Phòng: {booking.space.name}<br>"
+        f"- Thời gian bắt đầu: {booking.start_time}<br>"
+        f"- Thời gian kết thúc: {booking.end_time}<br><br>"
+        f"Vui lòng check-in đúng giờ để sử dụng phòng.<br><br>"
+        f"Trân trọng,<br>Hệ thống"
+    )
+    email = EmailMessage(
+        'Nhắc nhở Check-in Đặt phòng',
+        html_content,
+        settings.EMAIL_HOST_USER,
+        [booking.user.email],
+    )
+    email.content_subtype = "html"
+    return email
+
+
+def build_checkout_reminder_email(booking):
+    """Tạo email nhắc nhở check-out cho một booking"""
+    html_content = (
+        f"Chào {booking.user.username},<br><br>"
+        f"Đây là thông báo nhắc nhở về việc sắp hết thời gian sử dụng phòng:<br><br>"
+        f"- Phòng: {booking.space.name}<br>"
+        f"- Thời gian bắt đầu: {booking.start_time}<br>"
+        f"- Thời gian kết thúc: {booking.end_time}<br><br>"
+        f"Vui lòng chuẩn bị check-out đúng giờ.<br><br>"
+        f"Trân trọng,<br>Hệ thống"
+    )
+    email = EmailMessage(
+        'Nhắc nhở Check-out Đặt phòng',
+        html_content,
+        settings.EMAIL_HOST_USER,
+        [booking.user.email],
+    )
+    email.content_subtype = "html"
+    return email
+
+
+"""
+NHẮC NHỞ CHECK-IN / CHECK-OUT
+- Mỗi booking chỉ nhận một nhắc nhở mỗi loại: dòng được "giành" bằng cách ghi
+  *_reminder_sent_at trong transaction trước khi gửi, nên các lần quét chồng lấn
+  hoặc nhiều worker chạy song song không gửi trùng.
+- Email được gửi theo lô qua một kết nối SMTP; khi mất kết nối, phần còn lại của lô được
+  trả lại (sent_at = NULL) để lần chạy sau gửi lại. Email lỗi riêng lẻ chỉ trả lại booking đó
+  (tối đa EMAIL_MAX_FAILURES lần), các email khác vẫn được gửi tiếp.
+  Email xác nhận đặt chỗ dùng cùng cơ chế (confirmation_sent_at).
+"""
+
+REMINDER_BATCH_SIZE = 200
+
+# kind -> (trạng thái booking, trường thời gian mốc, trường đánh dấu đã gửi, hàm tạo email)
+REMINDERS = {
+    'checkin': ('CONFIRMED', 'start_time', 'checkin_reminder_sent_at', build_checkin_reminder_email),
+    'checkout': ('CHECK_IN', 'end_time', 'checkout_reminder_sent_at', build_checkout_reminder_email),
+}
+
+
+def _claim_unsent(bookings, sent_field, batch_size, exclude_ids=()):
+    """Đánh dấu tối đa batch_size booking chưa gửi (sent_field = NULL) là đã gửi, trả về id của chúng"""
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        ids = list(
+            bookings.filter(**{sent_field + '__isnull': True})
+            .exclude(id__in=exclude_ids)
+            .order_by('id')
+            .select_for_update(skip_locked=skip_locked)
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if ids:
+            Booking.objects.filter(id__in=ids).update(**{sent_field: timezone.now()})
+    return ids
+
+
+def _release_failed(ids, sent_field):
+    """
+    Tăng số lần gửi lỗi của các booking; booking chưa vượt EMAIL_MAX_FAILURES được trả lại
+    cho lần chạy sau, booking đã vượt giữ nguyên dấu đã gửi để không chặn các lô sau.
+    """
+    if not ids:
+        return
+    Booking.objects.filter(id__in=ids).update(email_failures=F('email_failures') + 1)
+    Booking.objects.filter(id__in=ids, email_failures__lt=EMAIL_MAX_FAILURES).update(**{sent_field: None})
+    abandoned = list(Booking.objects.filter(id__in=ids, email_failures__gte=EMAIL_MAX_FAILURES)
+                     .values_list('id', flat=True))
+    if abandoned:
+        logger.error("Bỏ qua %s cho booking %s sau %s lần gửi lỗi", sent_field, abandoned, EMAIL_MAX_FAILURES)
+
+
+def _deliver_unsent(bookings, sent_field, build_email, related, batch_size):
+    """Giành từng lô booking chưa gửi rồi gửi email qua một kết nối SMTP, trả về số email đã gửi"""
+    sent = 0
+    # Booking gửi lỗi trong lần chạy này không được giành lại ngay
+    failed = []
+    while True:
+        ids = _claim_unsent(bookings, sent_field, batch_size, failed)
+        if not ids:
+            return sent
+        pending = set(ids)
+        batch_failed = []
+        try:
+            with get_connection() as email_connection:
+                for booking in Booking.objects.filter(id__in=ids).select_related(*related).order_by('id'):
+                    if booking.user.email:
+                        try:
+                            email_connection.send_messages([build_email(booking)])
+                        except EMAIL_CONNECTION_ERRORS:
+                            raise
+                        except (SMTPException, OSError):
+                            logger.warning("Gửi %s cho booking %s thất bại", sent_field, booking.id, exc_info=True)
+                            batch_failed.append(booking.id)
+                        else:
+                            sent += 1
+                    pending.discard(booking.id)
+        except (SMTPException, OSError):
+            # Mất kết nối: trả lại các booking chưa gửi được cho lần chạy sau
+            Booking.objects.filter(id__in=pending).update(**{sent_field: None})
+            raise
+        finally:
+            _release_failed(batch_failed, sent_field)
+            failed.extend(batch_failed)
+
+
+def deliver_reminders(kind, bookings, batch_size=REMINDER_BATCH_SIZE):
+    """Gửi nhắc nhở loại kind cho các booking (queryset) chưa được nhắc, trả về số email đã gửi"""
+    status, _, sent_field, build_email = REMINDERS[kind]
+    return _deliver_unsent(bookings.filter(status=status), sent_field, build_email, ('user', 'space'), batch_size)
+
+
+def due_reminders(kind, current_time=None):
+    """Các booking có mốc check-in/check-out nằm trong khoảng nhắc nhở của NotificationConfig"""
+    current_time = current_time or timezone.now()
+    config = NotificationConfig.get_config()
+    minutes = (config.reminder_before_checkin_minutes if kind == 'checkin'
+               else config.reminder_before_checkout_minutes)
+    _, time_field, _, _ = REMINDERS[kind]
+    return Booking.objects.filter(**{
+        time_field + '__gte': current_time,
+        time_field + '__lte': current_time + timedelta(minutes=minutes),
+    })
+
 
 @shared_task
 def send_checkin_reminder():
     """Gửi thông báo trước giờ check-in"""
-    current_time = timezone.now()
-    config = NotificationConfig.get_config()
-    reminder_minutes = config.reminder_before_checkin_minutes
-
-    # Tìm các đặt phòng có start_time trong khoảng [current_time, current_time + reminder_minutes]
-    reminder_start = current_time
-    reminder_end = current_time + timedelta(minutes=reminder_minutes)
-    bookings = Booking.objects.filter(
-        status='CONFIRMED',
-        start_time__gte=reminder_start,
-        start_time__lte=reminder_end
-    )
-
-    for booking in bookings:
-        user_email = booking.user.email
-        if user_email:
-            html_content = (
-                f"Chào {booking.user.username},<br><br>"
-                f"Đây là thông báo nhắc nhở về đặt phòng của bạn:<br><br>"
-                f"- Phòng: {booking.space.name}<br>"
-                f"- Thời gian bắt đầu: {booking.start_time}<br>"
-                f"- Thời gian kết thúc: {booking.end_time}<br><br>"
-                f"Vui lòng check-in đúng giờ để sử dụng phòng.<br><br>"
-                f"Trân trọng,<br>Hệ thống"
-            )
-            email = EmailMessage(
-                'Nhắc nhở Check-in Đặt phòng',
-                html_content,
-                settings.EMAIL_HOST_USER,
-                [user_email],
-            )
-            email.content_subtype = "html"
-            email.send()
+    return deliver_reminders('checkin', due_reminders('checkin'))
 
 @shared_task
 def send_checkout_reminder():
     """Gửi thông báo trước khi hết thời gian sử dụng phòng"""
+    return deliver_reminders('checkout', due_reminders('checkout'))
+
+
+"""
+LỊCH HẸN THEO TỪNG BOOKING
+- Khi booking được tạo (CONFIRMED) hoặc check-in (CHECK_IN), các mốc nhắc nhở và
+  tự hủy/tự check-out được đăng ký thành task Celery có eta.
+- Task không bị thu hồi khi trạng thái thay đổi: lúc chạy, task kiểm tra lại trạng
+  thái và thời gian của booking, nếu không còn khớp thì bỏ qua.
+- auto_update_booking_status vẫn chạy định kỳ (thưa hơn) để bù cho task bị mất.
+"""
+
+def schedule_booking_deadlines(*bookings):
+    """Đăng ký các mốc của các booking theo trạng thái hiện tại, sau khi transaction commit"""
+    deadlines = [(booking.id, booking.status, booking.start_time, booking.end_time) for booking in bookings]
+
+    def enqueue():
+        config = NotificationConfig.get_config()
+        for booking_id, status, start_time, end_time in deadlines:
+            if status == 'CONFIRMED':
+                send_booking_reminder.apply_async(
+                    (booking_id, 'checkin'),
+                    eta=start_time - timedelta(minutes=config.reminder_before_checkin_minutes),
+                )
+                expire_booking.apply_async((booking_id,), eta=start_time + AUTO_CANCEL_AFTER)
+            elif status == 'CHECK_IN':
+                send_booking_reminder.apply_async(
+                    (booking_id, 'checkout'),
+                    eta=end_time - timedelta(minutes=config.reminder_before_checkout_minutes),
+                )
+                expire_booking.apply_async((booking_id,), eta=end_time + AUTO_CHECKOUT_AFTER)
+
+    if deadlines:
+        transaction.on_commit(enqueue, robust=True)
+
+
+@shared_task
+def expire_booking(booking_id):
+    """Tự hủy hoặc tự check-out một booking nếu nó thực sự đã quá hạn"""
     current_time = timezone.now()
-    config = NotificationConfig.get_config()
-    reminder_minutes = config.reminder_before_checkout_minutes
-
-    # Tìm các đặt phòng có end_time trong khoảng [current_time, current_time + reminder_minutes]
-    reminder_start = current_time
-    reminder_end = current_time + timedelta(minutes=reminder_minutes)
-    bookings = Booking.objects.filter(
-        status='CHECK_IN',
-        end_time__gte=reminder_start,
-        end_time__lte=reminder_end
-    )
-
-    for booking in bookings:
-        user_email = booking.user.email
-        if user_email:
-            html_content = (
-                f"Chào {booking.user.username},<br><br>"
-                f"Đây là thông báo nhắc nhở về việc sắp hết thời gian sử dụng phòng:<br><br>"
-                f"- Phòng: {booking.space.name}<br>"
-                f"- Thời gian bắt đầu: {booking.start_time}<br>"
-                f"- Thời gian kết thúc: {booking.end_time}<br><br>"
-                f"Vui lòng chuẩn bị check-out đúng giờ.<br><br>"
-                f"Trân trọng,<br>Hệ thống"
-            )
-            email = EmailMessage(
-                'Nhắc nhở Check-out Đặt phòng',
-                html_content,
-                settings.EMAIL_HOST_USER,
-                [user_email],
+    booking = Booking.objects.filter(id=booking_id)
+    cancelled = _sweep_bookings(
+        booking.filter(status='CONFIRMED', start_time__lt=current_time - AUTO_CANCEL_AFTER),
+        'CANCELLED',
+        1,
+        is_no_show=True,
+    )
+    checked_out = _sweep_bookings(
+        booking.filter(status='CHECK_IN', end_time__lt=current_time - AUTO_CHECKOUT_AFTER),
+        'CHECK_OUT',
+        1,
+    )
+    return {'cancelled': cancelled, 'checked_out': checked_out}
+
+
+@shared_task
+def send_booking_reminder(booking_id, kind):
+    """Gửi nhắc nhở check-in/check-out cho một booking nếu nó vẫn ở trạng thái tương ứng"""
+    _, time_field, _, _ = REMINDERS[kind]
+    return deliver_reminders(kind, Booking.objects.filter(
+        id=booking_id, **{time_field + '__gte': timezone.now()}))
+
+
+"""
+BẢNG TỔNG HỢP SỬ DỤNG THEO NGÀY
+- SpaceUsageDaily (ngày, phòng) được tính lại từ các booking gốc của đúng khóa đó
+  sau mỗi lần booking thay đổi (signal post_save/post_delete và các lần quét hàng loạt),
+  ở Celery worker: các thay đổi của cùng khóa trong USAGE_REFRESH_DEBOUNCE_SECONDS được
+  gom vào một lần tính (đánh dấu chờ trong cache). Đánh dấu chờ cần cache dùng chung giữa
+  web và worker (CACHE_REDIS_URL); với LocMemCache mỗi tiến trình tự đẩy task riêng.
+- SpaceTypeUsageDaily và UsageDaily của ngày đó được tính lại từ SpaceUsageDaily.
+- reconcile_usage_rollups chạy hằng đêm tính lại các ngày gần đây để bù cho các thay
+  đổi không đi qua signal (queryset.update, bulk_create, sửa start_time, ...).
+"""
+
+ROLLUP_RECONCILE_DAYS_BEFORE = 7
+ROLLUP_RECONCILE_DAYS_AFTER = 60
+USAGE_REFRESH_DEBOUNCE_SECONDS = 30
+
+
+def _day_bounds(first_day, last_day):
+    """Khoảng thời gian [00:00 first_day, 00:00 ngày sau last_day) theo giờ địa phương"""
+    return (
+        timezone.make_aware(datetime.combine(first_day, time.min)),
+        timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min)),
+    )
+
+
+def usage_days(start_time, end_time):
+    """Các ngày (giờ địa phương) mà khoảng [start_time, end_time) đi qua"""
+    first_day = timezone.localdate(start_time)
+    last_day = max(first_day, timezone.localdate(end_time - timedelta(microseconds=1)))
+    return [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+
+def usage_keys(bookings):
+    """Các khóa (ngày, space_id) của bảng tổng hợp chịu ảnh hưởng bởi các booking (space_id, start, end)"""
+    return {(day, space_id) for space_id, start_time, end_time in bookings
+            for day in usage_days(start_time, end_time)}
+
+
+def _space_usage_rows(first_day, last_day, space_ids=None):
+    """
+    Tổng hợp các booking theo (ngày, phòng) cho các ngày trong [first_day, last_day].
+    Số booking, hủy, no-show và thiết bị tính vào ngày bắt đầu; giờ đặt/giờ dùng được chia
+    theo ranh giới ngày, nên booking qua nửa đêm góp giờ cho từng ngày nó đi qua.
+    """
+    tz = timezone.get_current_timezone()
+    range_start, range_end = _day_bounds(first_day, last_day)
+    bookings = Booking.objects.all() if space_ids is None else Booking.objects.filter(space_id__in=space_ids)
+    duration = ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField())
+    booked_filter, used_filter = ~Q(status='CANCELLED'), Q(status__in=['CHECK_IN', 'CHECK_OUT'])
+    rows = {}
+
+    def row(day, space_id):
+        if (day, space_id) not in rows:
+            rows[day, space_id] = SpaceUsageDaily(day=day, space_id=space_id)
+        return rows[day, space_id]
+
+    # Một truy vấn GROUP BY: đếm theo ngày bắt đầu, giờ tạm tính cả vào ngày bắt đầu
+    for values in bookings.filter(start_time__gte=range_start, start_time__lt=range_end).annotate(
+        day=TruncDate('start_time', tzinfo=tz)
+    ).values('day', 'space_id').annotate(
+        total=Count('id'),
+        booked=Sum(duration, filter=booked_filter),
+        used=Sum(duration, filter=used_filter),
+        cancelled=Count('id', filter=Q(status='CANCELLED')),
+        no_show=Count('id', filter=Q(is_no_show=True)),
+        equipment=Sum('equipment_count'),
+    ).order_by():
+        usage = row(values['day'], values['space_id'])
+        usage.bookings = values['total']
+        usage.booked_hours = values['booked'].total_seconds() / 3600 if values['booked'] else 0
+        usage.used_hours = values['used'].total_seconds() / 3600 if values['used'] else 0
+        usage.cancellations = values['cancelled']
+        usage.no_shows = values['no_show']
+        usage.equipment_borrowed = values['equipment'] or 0
+
+    # Booking qua nửa đêm (ít): chuyển phần giờ sau nửa đêm sang các ngày sau
+    crossing = bookings.filter(start_time__lt=range_end, end_time__gt=range_start).annotate(
+        start_day=TruncDate('start_time', tzinfo=tz), end_day=TruncDate('end_time', tzinfo=tz),
+    ).exclude(start_day=F('end_day')).filter(booked_filter)
+    day_bounds = {}
+    for space_id, start_time, end_time, status in crossing.values_list('space_id', 'start_time', 'end_time', 'status'):
+        start_day = timezone.localdate(start_time)
+        for day in usage_days(start_time, end_time):
+            if not first_day <= day <= last_day:
+                continue
+            if day not in day_bounds:
+                day_bounds[day] = _day_bounds(day, day)
+            day_start, day_end = day_bounds[day]
+            hours = ((min(end_time, day_end) - max(start_time, day_start)).total_seconds()
+                     - (end_time - start_time).total_seconds() * (day == start_day)) / 3600
+            usage = row(day, space_id)
+            usage.booked_hours += hours
+            if status in ('CHECK_IN', 'CHECK_OUT'):
+                usage.used_hours += hours
+    return list(rows.values())
+
+
+def _replace_rollups(model, existing, rows, unique_fields):
+    """Ghi đè (upsert) các dòng tổng hợp mới, xóa các dòng trong existing không còn booking nào"""
+    attnames = [model._meta.get_field(field).attname for field in unique_fields]
+    fresh = {tuple(getattr(row, attname) for attname in attnames) for row in rows}
+    stale = [key for key in existing.values_list(*attnames) if key not in fresh]
+    if stale:
+        existing.filter(reduce(operator.or_, (Q(**dict(zip(attnames, key))) for key in stale))).delete()
+    model.objects.bulk_create(
+        rows, batch_size=1000, update_conflicts=True,
+        unique_fields=unique_fields, update_fields=list(model.METRICS),
+    )
+
+
+def _refresh_totals(days):
+    """Tính lại SpaceTypeUsageDaily và UsageDaily của các ngày từ SpaceUsageDaily"""
+    sums = {metric: Sum(metric) for metric in SpaceUsageDaily.METRICS}
+    space_rows = SpaceUsageDaily.objects.filter(day__in=days)
+    _replace_rollups(
+        SpaceTypeUsageDaily,
+        SpaceTypeUsageDaily.objects.filter(day__in=days),
+        [SpaceTypeUsageDaily(**row) for row in
+         space_rows.values('day', space_type=F('space__space_type')).annotate(**sums).order_by()],
+        ['day', 'space_type'],
+    )
+    _replace_rollups(
+        UsageDaily,
+        UsageDaily.objects.filter(day__in=days),
+        [UsageDaily(**row) for row in space_rows.values('day').annotate(**sums).order_by()],
+        ['day'],
+    )
+
+
+def refresh_usage_rollups(keys):
+    """Tính lại số liệu tổng hợp cho các khóa (ngày, space_id) từ booking gốc"""
+    spaces_by_day = {}
+    for day, space_id in keys:
+        spaces_by_day.setdefault(day, set()).add(space_id)
+    if not spaces_by_day:
+        return
+    with transaction.atomic():
+        for day, space_ids in spaces_by_day.items():
+            _replace_rollups(
+                SpaceUsageDaily,
+                SpaceUsageDaily.objects.filter(day=day, space_id__in=space_ids),
+                _space_usage_rows(day, day, space_ids),
+                ['day', 'space'],
             )
-            email.content_subtype = "html"
-            email.send()
\ No newline at end of file
+        _refresh_totals(list(spaces_by_day))
+
+
+def _usage_refresh_cache_key(day, space_id):
+    return f'bookings:usage-refresh:{day.isoformat()}:{space_id}'
+
+
+@shared_task
+def refresh_usage_rollups_task(keys):
+    """Task tính lại bảng tổng hợp; bỏ đánh dấu chờ trước khi đọc để thay đổi đến sau được lên lịch lại"""
+    keys = {(date.fromisoformat(day), space_id) for day, space_id in keys}
+    cache.delete_many([_usage_refresh_cache_key(*key) for key in keys])
+    refresh_usage_rollups(keys)
+
+
+def _enqueue_usage_refresh(keys):
+    # Khóa đã có task đang chờ thì không đẩy thêm: mỗi (ngày, phòng) và các dòng tổng của ngày
+    # được tính lại nhiều nhất một lần mỗi USAGE_REFRESH_DEBOUNCE_SECONDS
+    pending = [key for key in sorted(keys)
+               if cache.add(_usage_refresh_cache_key(*key), True, USAGE_REFRESH_DEBOUNCE_SECONDS * 4)]
+    if pending:
+        refresh_usage_rollups_task.apply_async(
+            ([[day.isoformat(), space_id] for day, space_id in pending],), countdown=USAGE_REFRESH_DEBOUNCE_SECONDS,
+        )
+
+
+def schedule_usage_refresh(keys):
+    """Lên lịch tính lại (ở Celery worker, gom theo khóa) các khóa (ngày, space_id) sau khi transaction commit"""
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: _enqueue_usage_refresh(keys), robust=True)
+
+
+def rebuild_usage_rollups(first_day, last_day):
+    """Tính lại toàn bộ số liệu tổng hợp của các ngày trong [first_day, last_day], trả về số dòng phòng-ngày"""
+    days = [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+    with transaction.atomic():
+        rows = _space_usage_rows(first_day, last_day)
+        # Xóa cả khoảng rồi ghi lại: nhanh hơn so khớp từng khóa khi tính lại nhiều ngày
+        SpaceUsageDaily.objects.filter(day__gte=first_day, day__lte=last_day).delete()
+        SpaceUsageDaily.objects.bulk_create(
+            rows, batch_size=1000, update_conflicts=True,
+            unique_fields=['day', 'space'], update_fields=list(SpaceUsageDaily.METRICS),
+        )
+        _refresh_totals(days)
+    return len(rows)
+
+
+@shared_task
+def reconcile_usage_rollups():
+    """Đối soát hằng đêm: tính lại số liệu tổng hợp của các ngày gần đây từ booking gốc"""
+    today = timezone.localdate()
+    return rebuild_usage_rollups(
+        today - timedelta(days=ROLLUP_RECONCILE_DAYS_BEFORE),
+        today + timedelta(days=ROLLUP_RECONCILE_DAYS_AFTER),
+    )
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from apps.resources.services import publish_space_status
+from . import services
+from .models import Booking
+
+# Giao/trả thiết bị bằng UPDATE hàng loạt không phát post_save cho từng thiết bị,
+# thay vào đó phát một lần cho cả lô với equipment_ids và booking_ids
+equipment_allocated = Signal()
+equipment_released = Signal()
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def refresh_booking_usage(sender, instance, **kwargs):
+    """Cập nhật bảng tổng hợp sử dụng của các (ngày, phòng) mà booking đi qua sau khi commit"""
+    services.schedule_usage_refresh(services.usage_keys([(instance.space_id, instance.start_time, instance.end_time)]))
+
+
+@receiver(post_save, sender=Booking)
+@receiver(post_delete, sender=Booking)
+def publish_booking_space_status(sender, instance, **kwargs):
+    """Đẩy trạng thái mới của phòng tới các client đang theo dõi luồng SSE"""
+    publish_space_status([instance.space_id])
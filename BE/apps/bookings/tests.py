@@ -1,3 +1,957 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import datetime, time, timedelta
+from importlib import import_module
+from io import StringIO
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import IntegrityError, connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APITestCase
+
+from apps.resources.models import StudySpace
+from apps.users.models import User
+from .models import (
+    BOOKING_CREATE_ATTEMPTS, Booking, BookingConflict, Equipment, EquipmentReservation, EquipmentType,
+    NotificationConfig, QRCode, SpaceTypeUsageDaily, SpaceUsageDaily, UsageDaily,
+)
+from .services import (
+    EMAIL_MAX_FAILURES, allocate_equipment, auto_update_booking_status, deliver_reminders, expire_booking,
+    refresh_usage_rollups_task, return_equipment, send_booking_confirmation_emails, send_booking_reminder,
+    send_checkin_reminder, send_checkout_reminder, update_booking_status, validate_qr_data,
+)
+from .signals import equipment_allocated, equipment_released
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT tạm cho mỗi test để ảnh QR không ghi vào thư mục media thật"""
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class AvailabilityTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space_a = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.space_b = StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        self.space_c = StudySpace.objects.create(name='G-01', capacity=6, space_type='GROUP')
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(hours=2)
+
+    def book(self, space, start, end, status='CONFIRMED'):
+        return Booking.objects.create(user=self.student, space=space, start_time=start, end_time=end, status=status)
+
+    def test_available_spaces_excludes_overlapping_bookings(self):
+        """Kiểm tra phòng có booking chồng lấn bị loại, booking đã hủy thì không"""
+        self.book(self.space_a, self.start + timedelta(hours=1), self.end + timedelta(hours=1))
+        self.book(self.space_b, self.start, self.end, status='CANCELLED')
+        spaces = Booking.available_spaces(StudySpace.objects.all(), self.start, self.end)
+        self.assertEqual({s.id for s in spaces}, {self.space_b.id, self.space_c.id})
+
+    def test_adjacent_booking_does_not_block(self):
+        """Kiểm tra booking kết thúc đúng lúc bắt đầu không làm phòng bận"""
+        self.book(self.space_a, self.start - timedelta(hours=2), self.start)
+        self.assertTrue(Booking.check_room_availability(self.space_a, self.start, self.end))
+
+    def test_search_available_spaces_uses_single_query(self):
+        """Kiểm tra API tìm phòng trống chỉ tốn một truy vấn dù có nhiều phòng"""
+        self.book(self.space_a, self.start, self.end)
+        self.client.force_authenticate(user=self.student)
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('search_available_spaces'), {
+                'space_type': 'INDIVIDUAL',
+                'start_time': self.start.isoformat(),
+                'end_time': self.end.isoformat(),
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([s['id'] for s in response.data], [self.space_b.id])
+
+    def test_with_current_status_matches_get_space_status(self):
+        """Kiểm tra trạng thái tính hàng loạt khớp với get_space_status từng phòng"""
+        now = timezone.now()
+        self.book(self.space_a, now - timedelta(minutes=30), now + timedelta(minutes=30), status='CHECK_IN')
+        self.book(self.space_b, now - timedelta(minutes=10), now + timedelta(minutes=50))
+        spaces = StudySpace.with_current_status(StudySpace.objects.all(), now)
+        for space in spaces:
+            self.assertEqual(space.current_status, space.get_space_status(now))
+        self.assertEqual({s.name: s.current_status for s in spaces},
+                         {'A-01': 'INUSE', 'A-02': 'BOOKED', 'G-01': 'EMPTY'})
+
+    def test_status_derived_from_bookings_without_space_writes(self):
+        """Kiểm tra hủy một booking không làm phòng EMPTY khi booking khác đang diễn ra, luồng booking không ghi dòng phòng"""
+        now = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            current = Booking.create_booking(self.student.id, self.space_a.id,
+                                             now - timedelta(minutes=10), now + timedelta(minutes=50))
+            later = Booking.create_booking(self.student.id, self.space_a.id,
+                                           now + timedelta(hours=1), now + timedelta(hours=2))
+            update_booking_status(later.id, 'CANCELLED')
+            self.assertEqual(self.space_a.get_space_status(now), 'BOOKED')
+            update_booking_status(current.id, 'CHECK_IN')
+            self.assertEqual(self.space_a.get_space_status(now), 'INUSE')
+        self.assertFalse([q for q in queries if q['sql'].startswith('UPDATE "resources_studyspace" SET "space_status"')])
+
+    def test_overlap_migration_cancels_later_bookings(self):
+        """Kiểm tra migration 0004 hủy booking tạo sau chồng lấn với booking tạo trước cùng phòng trước khi thêm ràng buộc"""
+        first = self.book(self.space_a, self.start, self.end)
+        overlapping = self.book(self.space_a, self.start + timedelta(hours=1), self.end + timedelta(hours=1))
+        # Giao với booking đã bị hủy ở trên, không giao với booking được giữ
+        after_cancelled = self.book(self.space_a, self.end, self.end + timedelta(hours=2))
+        adjacent = self.book(self.space_b, self.end, self.end + timedelta(hours=1))
+        other_space = self.book(self.space_b, self.start, self.end)
+        migration = import_module('apps.bookings.migrations.0004_booking_indexes')
+        self.assertEqual(migration.cancel_overlapping_bookings(Booking), [overlapping.id])
+        self.assertEqual(
+            dict(Booking.objects.values_list('id', 'status')),
+            {first.id: 'CONFIRMED', overlapping.id: 'CANCELLED', after_cancelled.id: 'CONFIRMED',
+             adjacent.id: 'CONFIRMED', other_space.id: 'CONFIRMED'},
+        )
+        self.assertEqual(migration.cancel_overlapping_bookings(Booking), [])
+
+    def race_with(self, start, end):
+        """Chèn một booking của người khác ngay sau lần kiểm tra phòng trống đầu tiên"""
+        rival = User.objects.create_user(username='student2', email='student2@hcmut.edu.vn', role='student')
+        check_room_availability = Booking.check_room_availability
+        calls = []
+
+        def racing_check(space, *args):
+            available = check_room_availability(space, *args)
+            calls.append(available)
+            if len(calls) == 1:
+                Booking.create_booking(rival.id, space.id, start, end)
+            return available
+
+        return mock.patch.object(Booking, 'check_room_availability', staticmethod(racing_check)), calls
+
+    def post_booking(self):
+        self.client.force_authenticate(user=self.student)
+        return self.client.post(reverse('booking_list'), {
+            'space_id': self.space_a.id,
+            'start_time': self.start.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'end_time': self.end.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        }, format='json')
+
+    def test_lost_race_returns_conflict(self):
+        """Kiểm tra khung giờ bị chiếm giữa lúc kiểm tra và lúc ghi thì trả 409, không đặt trùng"""
+        race, calls = self.race_with(self.start, self.end)
+        with race:
+            response = self.post_booking()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(calls[0], True)
+        self.assertEqual(Booking.objects.filter(space=self.space_a).count(), 1)
+
+    def test_retry_after_unrelated_booking(self):
+        """Kiểm tra booking khác khung giờ tạo chen vào chỉ làm thử lại, không báo lỗi"""
+        race, calls = self.race_with(self.end, self.end + timedelta(hours=1))
+        with race:
+            response = self.post_booking()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(calls), 3)  # lần đầu, booking chen vào, lần thử lại
+        self.space_a.refresh_from_db()
+        self.assertEqual(self.space_a.booking_version, 2)
+
+    def lose_cas(self, rival_on_last_attempt=False):
+        """
+        Sau mỗi lần kiểm tra phòng trống ngoài transaction, một booking khác của phòng được tạo
+        (tăng booking_version) nên mọi lần compare-and-swap đều thua; tùy chọn chèn booking
+        trùng khung giờ ngay trước lần thử cuối.
+        """
+        rival = User.objects.create_user(username='student2', email='student2@hcmut.edu.vn', role='student')
+        check_room_availability = Booking.check_room_availability
+        calls = []
+
+        def racing_check(space, *args):
+            available = check_room_availability(space, *args)
+            calls.append(available)
+            if len(calls) < BOOKING_CREATE_ATTEMPTS:
+                StudySpace.objects.filter(id=space.id).update(booking_version=F('booking_version') + 1)
+            if len(calls) == BOOKING_CREATE_ATTEMPTS and rival_on_last_attempt:
+                Booking.objects.bulk_create([Booking(user=rival, space=space, start_time=self.start, end_time=self.end)])
+            return available
+
+        return mock.patch.object(Booking, 'check_room_availability', staticmethod(racing_check)), calls
+
+    def test_lost_cas_retries_until_last_attempt(self):
+        """Kiểm tra thua compare-and-swap thì thử lại, lần cuối tăng version vô điều kiện và tạo được booking"""
+        race, calls = self.lose_cas()
+        with race:
+            booking = Booking.create_booking(self.student.id, self.space_a.id, self.start, self.end)
+        # Mỗi lần thử một lần kiểm tra, lần cuối kiểm tra thêm trong transaction
+        self.assertEqual(calls, [True] * (BOOKING_CREATE_ATTEMPTS + 1))
+        self.assertEqual(list(Booking.objects.filter(space=self.space_a)), [booking])
+        self.space_a.refresh_from_db()
+        self.assertEqual(self.space_a.booking_version, BOOKING_CREATE_ATTEMPTS)
+
+    def test_exhausted_attempts_raise_conflict(self):
+        """Kiểm tra hết số lần thử mà khung giờ đã bị chiếm thì báo BookingConflict, không đặt trùng"""
+        race, calls = self.lose_cas(rival_on_last_attempt=True)
+        with race, self.assertRaises(BookingConflict):
+            Booking.create_booking(self.student.id, self.space_a.id, self.start, self.end)
+        self.assertEqual(calls, [True] * BOOKING_CREATE_ATTEMPTS + [False])
+        self.assertEqual(Booking.objects.filter(space=self.space_a).exclude(user=self.student).count(), 1)
+        self.assertFalse(Booking.objects.filter(user=self.student).exists())
+
+    def test_only_overlap_constraint_maps_to_conflict(self):
+        """Kiểm tra chỉ vi phạm ràng buộc booking_no_overlap thành 409, lỗi toàn vẹn khác được ném lại"""
+        def integrity_error(message, constraint_name):
+            # Lỗi của driver PostgreSQL (nguyên nhân của IntegrityError) có diag.constraint_name
+            error, cause = IntegrityError(message), Exception(message)
+            cause.diag = mock.Mock(constraint_name=constraint_name)
+            error.__cause__ = cause
+            return error
+
+        overlap = integrity_error('conflicting key value violates exclusion constraint', 'booking_no_overlap')
+        not_null = integrity_error('null value in column "payload" violates not-null constraint', None)
+        with mock.patch.object(Booking, 'has_overlap_constraint', staticmethod(lambda: True)):
+            for error, raised in ((overlap, BookingConflict), (not_null, IntegrityError)):
+                with mock.patch.object(QRCode, 'generate_qr_code', side_effect=error), self.assertRaises(raised):
+                    Booking.create_booking(self.student.id, self.space_a.id, self.start, self.end)
+        self.assertFalse(Booking.objects.exists())
+
+class QRCodeTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(hours=2)
+
+    def test_create_booking_stores_payload_without_rendering(self):
+        """Kiểm tra tạo booking chỉ lưu payload QR, chưa render ảnh"""
+        booking = Booking.create_booking(self.student.id, self.space.id, self.start, self.end)
+        qr_code = QRCode.objects.get(booking=booking)
+        self.assertFalse(qr_code.image)
+        claims = QRCode.decode_payload(qr_code.payload)
+        self.assertEqual((claims.qr_id, claims.booking_id), (qr_code.id, booking.id))
+
+    def test_qr_image_rendered_on_first_fetch(self):
+        """Kiểm tra danh sách booking không render ảnh QR, ảnh được render ở lần lấy đầu tiên và dùng lại sau đó"""
+        booking = Booking.create_booking(self.student.id, self.space.id, self.start, self.end)
+        self.client.force_authenticate(user=self.student)
+        response = self.client.get(reverse('booking_list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        qr_code_url = response.data['results'][0]['qr_code_url']
+        self.assertTrue(qr_code_url.endswith(reverse('booking_qr_code_image', args=[booking.id])))
+        self.assertFalse(QRCode.objects.get(booking=booking).image)
+
+        response = self.client.get(qr_code_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'\x89PNG'))
+        qr_code = QRCode.objects.get(booking=booking)
+        self.assertTrue(qr_code.image.name.endswith(f'qr_code_{booking.id}.png'))
+        with self.assertNumQueries(0):
+            self.assertEqual(qr_code.ensure_image(), qr_code.image)
+
+        # Lần sau chỉ đọc: không UPDATE bản ghi QR
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(qr_code_url).status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE')])
+
+        other = User.objects.create_user(username='student2', email='student2@hcmut.edu.vn', role='student')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(qr_code_url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def current_booking(self, user=None):
+        now = timezone.now()
+        return Booking.create_booking((user or self.student).id, self.space.id,
+                                      now - timedelta(minutes=5), now + timedelta(hours=1))
+
+    def test_signed_payload_validated_without_queries(self):
+        """Kiểm tra payload có chữ ký được xác thực không cần truy vấn, payload bị sửa bị từ chối"""
+        qr_code = self.current_booking().qr_code
+        with self.assertNumQueries(0):
+            claims = validate_qr_data(qr_code.id, qr_code.payload)
+        self.assertEqual(claims.booking_id, qr_code.booking_id)
+        forged = qr_code.payload.replace(f'.{qr_code.booking_id}.', f'.{qr_code.booking_id + 1}.', 1)
+        self.assertIsNone(validate_qr_data(qr_code.id, forged))
+        self.assertIsNone(validate_qr_data(qr_code.id + 1, qr_code.payload))
+        self.assertIsNone(validate_qr_data(qr_code.id, qr_code.payload,
+                                           current_time=qr_code.booking.end_time + timedelta(minutes=1)))
+
+    def test_legacy_payload_still_accepted(self):
+        """Kiểm tra QR cũ dạng nhiều dòng vẫn quét được"""
+        booking = self.current_booking()
+        qr_code = booking.qr_code
+        legacy = (f"QR ID: {qr_code.id} \nBooking ID: {booking.id} \nUser: {self.student} \n"
+                  f"Space: {self.space} \nTime: {booking.start_time}--{booking.end_time}")
+        self.assertEqual(validate_qr_data(qr_code.id, legacy).booking_id, booking.id)
+        self.assertIsNone(validate_qr_data(qr_code.id, legacy.replace(f"Booking ID: {booking.id}", "Booking ID: 0")))
+
+    def test_scan_checks_in_then_out(self):
+        """Kiểm tra quét QR lần lượt check-in rồi check-out, người khác không quét được"""
+        qr_code = self.current_booking().qr_code
+        other = User.objects.create_user(username='student2', email='student2@hcmut.edu.vn', role='student')
+        self.client.force_authenticate(user=other)
+        data = {'qr_code_id': qr_code.id, 'qr_data': qr_code.payload}
+        self.assertEqual(self.client.post(reverse('scan_qr'), data, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.student)
+        for expected_status, space_status in (('CHECK_IN', 'INUSE'), ('CHECK_OUT', 'EMPTY')):
+            response = self.client.post(reverse('scan_qr'), data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['status'], expected_status)
+            self.assertEqual(self.space.get_space_status(timezone.now()), space_status)
+        self.assertEqual(self.client.post(reverse('scan_qr'), data, format='json').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_scan_applies_transitions_in_order(self):
+        """Kiểm tra quét hàng loạt: xử lý theo thứ tự, trả kết quả từng lượt, số truy vấn không đổi theo lô"""
+        manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        first = self.current_booking().qr_code
+        other_space = StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        now = timezone.now()
+        second = Booking.create_booking(self.student.id, other_space.id, now - timedelta(minutes=5),
+                                        now + timedelta(hours=1)).qr_code
+        scans = [
+            {'qr_code_id': first.id, 'qr_data': first.payload},
+            {'qr_code_id': second.id, 'qr_data': second.payload},
+            {'qr_code_id': first.id, 'qr_data': first.payload},
+            {'qr_code_id': second.id, 'qr_data': second.payload + 'x'},
+            # Quét khi mất mạng trước giờ bắt đầu, gửi lên sau
+            {'qr_code_id': second.id, 'qr_data': second.payload,
+             'scanned_at': (now - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%S%z')},
+        ]
+        self.client.force_authenticate(user=self.student)
+        self.assertEqual(self.client.post(reverse('scan_qr_batch'), {'scans': scans}, format='json').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=manager)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('scan_qr_batch'), {'scans': scans}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(r['ok'], r.get('status')) for r in response.data['results']],
+                         [(True, 'CHECK_IN'), (True, 'CHECK_IN'), (True, 'CHECK_OUT'), (False, None), (False, None)])
+        self.assertEqual(dict(Booking.objects.values_list('id', 'status')),
+                         {first.booking_id: 'CHECK_OUT', second.booking_id: 'CHECK_IN'})
+        self.assertEqual(dict(StudySpace.with_current_status(StudySpace.objects, timezone.now())
+                              .values_list('name', 'current_status')),
+                         {'A-01': 'EMPTY', 'A-02': 'INUSE'})
+        # Khóa booking + UPDATE mỗi trạng thái + trả thiết bị, không có truy vấn theo từng lượt
+        self.assertLessEqual(len(queries), 12)
+
+class FlakyEmailBackend(EmailBackend):
+    """Backend locmem lỗi ở lần gửi đầu tiên để kiểm tra retry"""
+    failures = 1
+
+    def send_messages(self, messages):
+        if FlakyEmailBackend.failures:
+            FlakyEmailBackend.failures -= 1
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        return super().send_messages(messages)
+
+
+class RefusingEmailBackend(EmailBackend):
+    """Backend locmem từ chối các địa chỉ trong refused để kiểm tra lỗi của riêng một email"""
+    refused = set()
+
+    def send_messages(self, messages):
+        for message in messages:
+            rejected = set(message.to) & RefusingEmailBackend.refused
+            if rejected:
+                raise SMTPRecipientsRefused({address: (550, b'User unknown') for address in rejected})
+        return super().send_messages(messages)
+
+
+@override_settings(LIVE_EVENTS_REDIS_URL=None)
+class ConfirmationEmailTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.start = timezone.now() + timedelta(days=1)
+        self.end = self.start + timedelta(hours=2)
+
+    def test_create_booking_enqueues_email_after_commit(self):
+        """Kiểm tra API đặt chỗ không gửi email trực tiếp mà đẩy task sau commit"""
+        self.client.force_authenticate(user=self.student)
+        with mock.patch('apps.bookings.views.send_booking_confirmation_emails') as task, \
+                mock.patch('apps.bookings.views.schedule_booking_deadlines'):
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.post(reverse('booking_list'), {
+                    'space_id': self.space.id,
+                    'start_time': self.start.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'end_time': self.end.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            task.delay.assert_not_called()
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len(mail.outbox), 0)
+        task.delay.assert_called_once_with()
+
+    def test_send_confirmation_emails_batch(self):
+        """Kiểm tra một lần chạy task gửi email cho mọi booking đang chờ qua một kết nối, mỗi email kèm ảnh QR"""
+        bookings = [
+            Booking.create_booking(self.student.id, self.space.id,
+                                   self.start + timedelta(hours=3 * i), self.end + timedelta(hours=3 * i))
+            for i in range(3)
+        ]
+        with mock.patch('apps.bookings.services.get_connection', wraps=get_connection) as connections:
+            self.assertEqual(send_booking_confirmation_emails(batch_size=5), 3)
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['student1@hcmut.edu.vn'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'qr_code.png')
+        self.assertFalse(Booking.objects.filter(id__in=[b.id for b in bookings], confirmation_sent_at__isnull=True))
+        # Các task đến sau (mỗi request đẩy một task) không gửi lại
+        self.assertEqual(send_booking_confirmation_emails(), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_BACKEND='apps.bookings.tests.FlakyEmailBackend')
+    def test_send_confirmation_emails_retries_on_smtp_error(self):
+        """Kiểm tra task thử lại khi SMTP lỗi và chỉ gửi mỗi email một lần"""
+        FlakyEmailBackend.failures = 1
+        Booking.create_booking(self.student.id, self.space.id, self.start, self.end)
+        result = send_booking_confirmation_emails.apply()
+        self.assertEqual(result.get(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_BACKEND='apps.bookings.tests.RefusingEmailBackend')
+    def test_refused_recipient_does_not_block_other_emails(self):
+        """Kiểm tra một người nhận bị từ chối không chặn email của các booking khác và chỉ được thử lại có giới hạn"""
+        bad = User.objects.create_user(username='bad', email='bad@hcmut.edu.vn', role='student')
+        RefusingEmailBackend.refused = {bad.email}
+        self.addCleanup(setattr, RefusingEmailBackend, 'refused', set())
+        failing = Booking.create_booking(bad.id, self.space.id, self.start, self.end)
+        others = [
+            Booking.create_booking(self.student.id, self.space.id,
+                                   self.start + timedelta(hours=3 * i), self.end + timedelta(hours=3 * i))
+            for i in range(1, 4)
+        ]
+        # Lô nhỏ: booking lỗi nằm đầu lần giành đầu tiên, các lô sau vẫn được gửi
+        with self.assertLogs('apps.bookings.services', 'WARNING'):
+            self.assertEqual(send_booking_confirmation_emails.apply(kwargs={'batch_size': 2}).get(), 3)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['student1@hcmut.edu.vn'] * 3)
+        self.assertFalse(Booking.objects.filter(id__in=[b.id for b in others], confirmation_sent_at__isnull=True))
+        failing.refresh_from_db()
+        self.assertIsNone(failing.confirmation_sent_at)
+        self.assertEqual(failing.email_failures, 1)
+        # Sau EMAIL_MAX_FAILURES lần lỗi, booking không còn được giành lại
+        with self.assertLogs('apps.bookings.services', 'ERROR'):
+            for _ in range(EMAIL_MAX_FAILURES - 1):
+                self.assertEqual(send_booking_confirmation_emails(), 0)
+        failing.refresh_from_db()
+        self.assertIsNotNone(failing.confirmation_sent_at)
+        self.assertEqual(failing.email_failures, EMAIL_MAX_FAILURES)
+        self.assertEqual(send_booking_confirmation_emails(), 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+
+class AutoUpdateBookingStatusTests(APITestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space_a = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.space_b = StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        self.projector = EquipmentType.objects.create(name='Máy chiếu', total_quantity=2)
+        self.now = timezone.now()
+
+    def book(self, space, start, end, status):
+        return Booking.objects.create(user=self.student, space=space, start_time=start, end_time=end, status=status)
+
+    def test_sweep_cancels_no_shows_and_checks_out_overstays(self):
+        """Kiểm tra booking quá hạn được hủy/check-out hàng loạt, booking khác giữ nguyên"""
+        no_show = self.book(self.space_a, self.now - timedelta(hours=1), self.now + timedelta(hours=1), 'CONFIRMED')
+        upcoming = self.book(self.space_a, self.now - timedelta(minutes=10), self.now + timedelta(hours=1), 'CONFIRMED')
+        overstay = self.book(self.space_b, self.now - timedelta(hours=3), self.now - timedelta(hours=1), 'CHECK_IN')
+        in_use = self.book(self.space_b, self.now - timedelta(hours=1), self.now + timedelta(hours=1), 'CHECK_IN')
+        Equipment.objects.create(equipment_type=self.projector, booking=no_show, status='BORROWED')
+        Equipment.objects.create(equipment_type=self.projector, booking=in_use, status='BORROWED')
+
+        result = auto_update_booking_status(chunk_size=1)
+
+        self.assertEqual(result, {'cancelled': 1, 'checked_out': 1})
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {
+            no_show.id: 'CANCELLED',
+            upcoming.id: 'CONFIRMED',
+            overstay.id: 'CHECK_OUT',
+            in_use.id: 'CHECK_IN',
+        })
+        self.assertEqual(Equipment.objects.filter(status='AVAILABLE', booking=None).count(), 1)
+        self.assertEqual(in_use.equipments.count(), 1)
+
+    def test_sweep_with_nothing_due(self):
+        """Kiểm tra lần quét không có booking quá hạn chỉ tốn hai câu SELECT"""
+        self.book(self.space_a, self.now + timedelta(hours=1), self.now + timedelta(hours=2), 'CONFIRMED')
+        with CaptureQueriesContext(connection) as ctx:
+            result = auto_update_booking_status()
+        self.assertEqual(result, {'cancelled': 0, 'checked_out': 0})
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        self.assertEqual(statements, ['SELECT', 'SELECT'])
+
+
+class EquipmentReservationTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.spaces = [StudySpace.objects.create(name=f'A-0{i}', capacity=1, space_type='INDIVIDUAL')
+                       for i in range(3)]
+        self.projector = EquipmentType.objects.create(name='Máy chiếu', total_quantity=2)
+        self.speaker = EquipmentType.objects.create(name='Loa', total_quantity=1)
+        Equipment.objects.bulk_create(Equipment(equipment_type=self.projector) for _ in range(2))
+        self.start = timezone.now() + timedelta(days=1)
+
+    def book(self, space_index, hours_from_start, hours, **counts):
+        start = self.start + timedelta(hours=hours_from_start)
+        equipment_requests = [{'equipment_type_id': getattr(self, name).id, 'count': count}
+                              for name, count in counts.items()]
+        return Booking.create_booking(self.student.id, self.spaces[space_index].id,
+                                      start, start + timedelta(hours=hours), equipment_requests)
+
+    def test_reservations_are_time_aware(self):
+        """Kiểm tra giữ chỗ chỉ chặn khung giờ giao nhau, booking hủy trả lại số lượng"""
+        first = self.book(0, 0, 2, projector=2)
+        with self.assertRaises(ValidationError):
+            self.book(1, 1, 2, projector=1)
+        self.book(1, 2, 2, projector=2)
+        update_booking_status(first.id, 'CANCELLED')
+        self.book(2, 1, 1, projector=2)
+        # Thiết bị cụ thể chưa được giao trước khi check-in
+        self.assertEqual(Equipment.objects.filter(status='AVAILABLE').count(), 2)
+
+    def test_multi_type_reservation_is_atomic(self):
+        """Kiểm tra thiếu một loại thiết bị thì không tạo booking và không giữ loại nào"""
+        with self.assertRaises(ValidationError):
+            self.book(0, 0, 2, projector=1, speaker=2)
+        self.assertFalse(Booking.objects.exists())
+        self.assertFalse(EquipmentReservation.objects.exists())
+
+    def test_malformed_requests_rejected_before_writing(self):
+        """Kiểm tra yêu cầu thiết bị thiếu khóa hoặc số lượng không hợp lệ báo lỗi 400, số dạng chuỗi được gộp đúng"""
+        start = self.start
+        projector = self.projector.id
+        for requests in ([{'equipment_type_id': projector}], [{'equipment_type_id': projector, 'count': 'x'}],
+                         [{'equipment_type_id': projector, 'count': 0}]):
+            with self.assertRaises(ValidationError):
+                Booking.create_booking(self.student.id, self.spaces[0].id, start, start + timedelta(hours=1), requests)
+        self.assertFalse(Booking.objects.exists())
+        booking = Booking.create_booking(self.student.id, self.spaces[0].id, start, start + timedelta(hours=1), [
+            {'equipment_type_id': str(projector), 'count': '1'}, {'equipment_type_id': projector, 'count': 1},
+        ])
+        self.assertEqual(booking.equipment_count, 2)
+        self.assertEqual(list(booking.equipment_reservations.values_list('quantity', flat=True)), [2])
+
+    def test_bulk_availability_in_one_query(self):
+        """Kiểm tra số lượng còn trống của nhiều loại và khung giờ tính bằng một truy vấn"""
+        self.book(0, 0, 2, projector=1, speaker=1)
+        self.book(1, 1, 2, projector=1)
+        windows = [(equipment_type.id, self.start + timedelta(hours=offset), self.start + timedelta(hours=offset + 1))
+                   for equipment_type in (self.projector, self.speaker) for offset in (0, 1, 2, 3)]
+        with self.assertNumQueries(2):
+            available = EquipmentReservation.available_quantities(windows)
+        self.assertEqual([available[window] for window in windows], [1, 0, 1, 2, 0, 0, 1, 1])
+
+    def test_units_handed_out_at_check_in(self):
+        """Kiểm tra thiết bị cụ thể được giao khi check-in và trả lại khi check-out"""
+        booking = self.book(0, 0, 2, projector=2)
+        update_booking_status(booking.id, 'CHECK_IN')
+        self.assertEqual(booking.equipments.filter(status='BORROWED').count(), 2)
+        update_booking_status(booking.id, 'CHECK_OUT')
+        self.assertEqual(Equipment.objects.filter(status='AVAILABLE', booking=None).count(), 2)
+
+    def test_check_in_reports_equipment_shortfall(self):
+        """Kiểm tra check-in khi thiếu thiết bị rảnh vẫn thành công, giao phần còn lại và báo phần thiếu"""
+        manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        booking = self.book(0, 0, 2, projector=2, speaker=1)
+        # Một máy chiếu hỏng sau khi đã giữ chỗ, loa chưa có thiết bị cụ thể nào
+        Equipment.objects.filter(id=Equipment.objects.filter(equipment_type=self.projector).earliest('id').id) \
+            .update(status='BROKEN')
+        self.client.force_authenticate(user=manager)
+        with self.assertLogs('apps.bookings.services', 'WARNING'):
+            response = self.client.post(reverse('update_booking_status'),
+                                        {'booking_id': booking.id, 'status': 'CHECK_IN'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 'CHECK_IN')
+        self.assertEqual(response.data['equipment_shortfall'], [
+            {'equipment_type_id': self.projector.id, 'missing': 1},
+            {'equipment_type_id': self.speaker.id, 'missing': 1},
+        ])
+        self.assertEqual(booking.equipments.filter(status='BORROWED').count(), 1)
+        # Thêm thiết bị rảnh thì lần giao sau chỉ còn thiếu máy chiếu
+        Equipment.objects.create(equipment_type=self.speaker)
+        with self.assertLogs('apps.bookings.services', 'WARNING'):
+            self.assertEqual(allocate_equipment([booking]), (1, {booking.id: {self.projector.id: 1}}))
+
+    def connect_receiver(self, signal):
+        receiver = mock.Mock()
+        signal.connect(receiver, weak=False)
+        self.addCleanup(signal.disconnect, receiver)
+        return receiver
+
+    def test_batch_allocate_and_release_signal_once(self):
+        """Kiểm tra giao/trả thiết bị cho cả lô bằng UPDATE hàng loạt, signal phát một lần cho cả lô"""
+        tablet = EquipmentType.objects.create(name='Máy tính bảng', total_quantity=6)
+        Equipment.objects.bulk_create(Equipment(equipment_type=tablet) for _ in range(7))
+        self.tablet = tablet
+        bookings = [self.book(i, 0, 2, tablet=2) for i in range(3)]
+        allocated = self.connect_receiver(equipment_allocated)
+        released = self.connect_receiver(equipment_released)
+
+        self.assertEqual(allocate_equipment(bookings), (6, {}))
+        self.assertEqual(allocate_equipment(bookings), (0, {}))
+        allocated.assert_called_once()
+        self.assertEqual(len(allocated.call_args.kwargs['equipment_ids']), 6)
+        self.assertEqual(allocated.call_args.kwargs['booking_ids'], [booking.id for booking in bookings])
+
+        with self.assertNumQueries(2):
+            self.assertEqual(return_equipment(bookings), 6)
+        released.assert_called_once()
+        self.assertEqual(sorted(released.call_args.kwargs['equipment_ids']),
+                         sorted(allocated.call_args.kwargs['equipment_ids']))
+        self.assertEqual(Equipment.objects.filter(equipment_type=tablet, status='AVAILABLE', booking=None).count(), 7)
+        self.assertEqual(return_equipment(bookings), 0)
+        released.assert_called_once()
+
+    def test_sweeper_releases_equipment_per_chunk(self):
+        """Kiểm tra bộ quét trả thiết bị theo từng lô và số thiết bị được trả khớp số đã giao"""
+        start = timezone.now() - timedelta(hours=5)
+        bookings = [Booking.objects.create(user=self.student, space=space, start_time=start,
+                                           end_time=start + timedelta(hours=2), status='CHECK_IN')
+                    for space in self.spaces]
+        units = list(Equipment.objects.filter(equipment_type=self.projector))
+        for equipment, booking in zip(units, bookings):
+            equipment.status = 'BORROWED'
+            equipment.booking = booking
+        Equipment.objects.bulk_update(units, ['status', 'booking'])
+        released = self.connect_receiver(equipment_released)
+
+        auto_update_booking_status(chunk_size=1)
+
+        self.assertEqual(released.call_count, 2)
+        self.assertEqual(sum(len(call.kwargs['equipment_ids']) for call in released.call_args_list), len(units))
+        self.assertFalse(Equipment.objects.filter(status='BORROWED').exists())
+
+class BookingListTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        self.students = [User.objects.create_user(username=f'student{i}', email=f'student{i}@hcmut.edu.vn',
+                                                  role='student') for i in range(2)]
+        self.space = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.equipment_type = EquipmentType.objects.create(name='Máy chiếu', total_quantity=100)
+        start = timezone.now() + timedelta(days=1)
+        Booking.objects.bulk_create(
+            Booking(user=self.students[i % 2], space=self.space, start_time=start + timedelta(hours=i),
+                    end_time=start + timedelta(hours=i + 1))
+            for i in range(9)
+        )
+        # Một nửa booking tạo cùng lúc để kiểm tra thứ tự theo id
+        created_at = timezone.now()
+        Booking.objects.filter(id__in=Booking.objects.order_by('id').values('id')[:5]).update(created_at=created_at)
+        for booking in Booking.objects.all():
+            QRCode.objects.create(booking=booking, image='qrcodes/test.png')
+            Equipment.objects.create(equipment_type=self.equipment_type, booking=booking, status='BORROWED')
+        self.client.force_authenticate(user=self.manager)
+
+    def test_cursor_pagination_walks_all_bookings(self):
+        """Kiểm tra ?pagination=cursor trả đủ booking theo (created_at, id) giảm dần, không COUNT(*)"""
+        url = reverse('booking_list') + '?pagination=cursor&page_size=4'
+        ids = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+            ids.extend(booking['id'] for booking in response.data['results'])
+            url = response.data['next']
+        expected = Booking.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        """Kiểm tra số truy vấn của một trang không phụ thuộc số booking trong trang"""
+        url = reverse('booking_list')
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url, {'page_size': 2})
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url, {'page_size': 9})
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(response.data['count'], 9)
+        self.assertEqual(len(response.data['results'][0]['equipments']), 1)
+
+
+@override_settings(LIVE_EVENTS_REDIS_URL=None)
+class BookingDeadlineTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.now = timezone.now()
+
+    def book(self, start, end, status):
+        return Booking.objects.create(user=self.student, space=self.space, start_time=start, end_time=end, status=status)
+
+    def test_create_booking_schedules_reminder_and_auto_cancel(self):
+        """Kiểm tra tạo booking đăng ký nhắc check-in và tự hủy đúng mốc sau commit"""
+        start = self.now + timedelta(days=1)
+        self.client.force_authenticate(user=self.student)
+        with mock.patch('apps.bookings.views.send_booking_confirmation_emails'), \
+                mock.patch('apps.bookings.services.refresh_usage_rollups_task'), \
+                mock.patch('apps.bookings.services.send_booking_reminder') as reminder, \
+                mock.patch('apps.bookings.services.expire_booking') as expire:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('booking_list'), {
+                    'space_id': self.space.id,
+                    'start_time': start.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                    'end_time': (start + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+                }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        booking = Booking.objects.get(id=response.data['data']['id'])
+        reminder.apply_async.assert_called_once_with(
+            (booking.id, 'checkin'), eta=booking.start_time - timedelta(minutes=15))
+        expire.apply_async.assert_called_once_with((booking.id,), eta=booking.start_time + timedelta(minutes=30))
+
+    def test_check_in_schedules_checkout_deadlines(self):
+        """Kiểm tra chuyển sang CHECK_IN đăng ký nhắc check-out và tự check-out"""
+        booking = self.book(self.now - timedelta(minutes=5), self.now + timedelta(hours=1), 'CONFIRMED')
+        with mock.patch('apps.bookings.services.refresh_usage_rollups_task'), \
+                mock.patch('apps.bookings.services.send_booking_reminder') as reminder, \
+                mock.patch('apps.bookings.services.expire_booking') as expire:
+            with self.captureOnCommitCallbacks(execute=True):
+                update_booking_status(booking.id, 'CHECK_IN')
+        reminder.apply_async.assert_called_once_with(
+            (booking.id, 'checkout'), eta=booking.end_time - timedelta(minutes=10))
+        expire.apply_async.assert_called_once_with((booking.id,), eta=booking.end_time + timedelta(minutes=30))
+
+    def test_expire_booking_only_acts_when_due(self):
+        """Kiểm tra task tự hủy bỏ qua booking đã đổi trạng thái hoặc chưa tới hạn"""
+        due = self.book(self.now - timedelta(hours=1), self.now + timedelta(hours=1), 'CONFIRMED')
+        checked_in = self.book(self.now - timedelta(hours=3), self.now - timedelta(hours=2), 'CHECK_IN')
+        not_due = self.book(self.now + timedelta(hours=2), self.now + timedelta(hours=3), 'CONFIRMED')
+        self.assertEqual(expire_booking(due.id), {'cancelled': 1, 'checked_out': 0})
+        self.assertEqual(expire_booking(due.id), {'cancelled': 0, 'checked_out': 0})
+        self.assertEqual(expire_booking(checked_in.id), {'cancelled': 0, 'checked_out': 1})
+        self.assertEqual(expire_booking(not_due.id), {'cancelled': 0, 'checked_out': 0})
+        statuses = dict(Booking.objects.values_list('id', 'status'))
+        self.assertEqual(statuses, {due.id: 'CANCELLED', checked_in.id: 'CHECK_OUT', not_due.id: 'CONFIRMED'})
+
+    def test_reminder_skipped_after_status_change(self):
+        """Kiểm tra nhắc nhở không gửi nếu booking đã bị hủy trước giờ hẹn"""
+        booking = self.book(self.now + timedelta(minutes=10), self.now + timedelta(hours=1), 'CONFIRMED')
+        self.assertEqual(send_booking_reminder(booking.id, 'checkin'), 1)
+        self.assertEqual(mail.outbox[0].subject, 'Nhắc nhở Check-in Đặt phòng')
+        Booking.objects.filter(id=booking.id).update(status='CANCELLED')
+        self.assertEqual(send_booking_reminder(booking.id, 'checkin'), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class ReminderTests(APITestCase):
+    def setUp(self):
+        self.students = [
+            User.objects.create_user(username=f'student{i}', email=f'student{i}@hcmut.edu.vn', role='student')
+            for i in range(3)
+        ]
+        self.spaces = [
+            StudySpace.objects.create(name=f'A-0{i}', capacity=1, space_type='INDIVIDUAL') for i in range(3)
+        ]
+        NotificationConfig.get_config()
+        self.now = timezone.now()
+
+    def book(self, i, start, end, status):
+        return Booking.objects.create(user=self.students[i], space=self.spaces[i],
+                                      start_time=start, end_time=end, status=status)
+
+    def test_each_booking_reminded_once(self):
+        """Kiểm tra các lần quét chồng lấn và task theo booking chỉ gửi mỗi nhắc nhở một lần"""
+        for i in range(3):
+            self.book(i, self.now + timedelta(minutes=5 + i), self.now + timedelta(hours=1), 'CONFIRMED')
+        self.assertEqual(send_checkin_reminder(), 3)
+        self.assertEqual(send_checkin_reminder(), 0)
+        self.assertEqual(send_booking_reminder(Booking.objects.first().id, 'checkin'), 0)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         [f'student{i}@hcmut.edu.vn' for i in range(3)])
+
+    def test_checkout_reminder_batches_share_queries(self):
+        """Kiểm tra nhắc check-out gửi theo lô, số truy vấn không tăng theo số booking"""
+        for i in range(3):
+            self.book(i, self.now - timedelta(hours=1), self.now + timedelta(minutes=5), 'CHECK_IN')
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(send_checkout_reminder(), 3)
+        statements = [q['sql'].split()[0] for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]
+        # config, giành lô, đánh dấu, đọc lô (kèm user/space), giành lô tiếp (rỗng)
+        self.assertEqual(statements, ['SELECT', 'SELECT', 'UPDATE', 'SELECT', 'SELECT'])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].subject, 'Nhắc nhở Check-out Đặt phòng')
+
+    @override_settings(EMAIL_BACKEND='apps.bookings.tests.FlakyEmailBackend')
+    def test_failed_reminder_released_for_retry(self):
+        """Kiểm tra nhắc nhở gửi lỗi được trả lại để lần quét sau gửi lại"""
+        FlakyEmailBackend.failures = 1
+        booking = self.book(0, self.now + timedelta(minutes=5), self.now + timedelta(hours=1), 'CONFIRMED')
+        with self.assertRaises(SMTPServerDisconnected):
+            send_checkin_reminder()
+        booking.refresh_from_db()
+        self.assertIsNone(booking.checkin_reminder_sent_at)
+        self.assertEqual(send_checkin_reminder(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_BACKEND='apps.bookings.tests.RefusingEmailBackend')
+    def test_refused_reminder_does_not_block_others(self):
+        """Kiểm tra một nhắc nhở bị từ chối không chặn nhắc check-in/check-out của các booking khác"""
+        RefusingEmailBackend.refused = {self.students[0].email}
+        self.addCleanup(setattr, RefusingEmailBackend, 'refused', set())
+        for i in range(3):
+            self.book(i, self.now + timedelta(minutes=5 + i), self.now + timedelta(hours=1), 'CONFIRMED')
+        with self.assertLogs('apps.bookings.services', 'WARNING'):
+            self.assertEqual(deliver_reminders('checkin', Booking.objects.all(), batch_size=1), 2)
+        Booking.objects.update(status='CHECK_IN', end_time=self.now + timedelta(minutes=5))
+        with self.assertLogs('apps.bookings.services', 'WARNING'):
+            self.assertEqual(send_checkout_reminder(), 2)
+        self.assertEqual(sorted((m.subject, m.to[0]) for m in mail.outbox), sorted(
+            (subject, f'student{i}@hcmut.edu.vn')
+            for subject in ('Nhắc nhở Check-in Đặt phòng', 'Nhắc nhở Check-out Đặt phòng') for i in (1, 2)
+        ))
+        refused = Booking.objects.get(user=self.students[0])
+        self.assertIsNone(refused.checkin_reminder_sent_at)
+        self.assertIsNone(refused.checkout_reminder_sent_at)
+        self.assertEqual(refused.email_failures, 2)
+
+
+@override_settings(LIVE_EVENTS_REDIS_URL=None)
+class UsageRollupTests(APITestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space_a = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.space_b = StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        self.space_g = StudySpace.objects.create(name='G-01', capacity=6, space_type='GROUP')
+        self.day = timezone.localdate() - timedelta(days=1)
+        self.morning = timezone.make_aware(datetime.combine(self.day, time(9)))
+        # Không có broker: chạy task tính lại ngay khi được đẩy, bỏ qua countdown
+        cache.clear()
+        self.addCleanup(cache.clear)
+        enqueue = mock.patch.object(refresh_usage_rollups_task, 'apply_async',
+                                    side_effect=lambda args, countdown: refresh_usage_rollups_task.apply(args))
+        self.enqueue = enqueue.start()
+        self.addCleanup(enqueue.stop)
+
+    def book(self, space, hours_from_nine, hours, status='CONFIRMED', **fields):
+        start = self.morning + timedelta(hours=hours_from_nine)
+        return Booking.objects.create(user=self.student, space=space, start_time=start,
+                                      end_time=start + timedelta(hours=hours), status=status, **fields)
+
+    def rollups(self):
+        fields = ('bookings', 'booked_hours', 'used_hours', 'cancellations', 'no_shows', 'equipment_borrowed')
+        return {
+            'space': {row[0]: row[1:] for row in SpaceUsageDaily.objects.values_list('space__name', *fields)},
+            'space_type': {row[0]: row[1:] for row in SpaceTypeUsageDaily.objects.values_list('space_type', *fields)},
+            'day': {row[0]: row[1:] for row in UsageDaily.objects.values_list('day', *fields)},
+        }
+
+    def test_rollups_follow_booking_changes(self):
+        """Kiểm tra bảng tổng hợp được cập nhật sau commit khi booking được tạo/đổi trạng thái"""
+        with self.captureOnCommitCallbacks(execute=True):
+            used = self.book(self.space_a, 0, 2, equipment_count=2)
+            self.book(self.space_b, 1, 1)
+            self.book(self.space_g, 0, 3, status='CANCELLED')
+        with mock.patch('apps.bookings.services.schedule_booking_deadlines'), \
+                self.captureOnCommitCallbacks(execute=True):
+            update_booking_status(used.id, 'CHECK_IN')
+        self.assertEqual(self.rollups(), {
+            'space': {'A-01': (1, 2.0, 2.0, 0, 0, 2), 'A-02': (1, 1.0, 0.0, 0, 0, 0), 'G-01': (1, 0.0, 0.0, 1, 0, 0)},
+            'space_type': {'INDIVIDUAL': (2, 3.0, 2.0, 0, 0, 2), 'GROUP': (1, 0.0, 0.0, 1, 0, 0)},
+            'day': {self.day: (3, 3.0, 2.0, 1, 0, 2)},
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            Booking.objects.filter(space=self.space_g).get().delete()
+        self.assertNotIn('GROUP', self.rollups()['space_type'])
+
+    def test_auto_cancel_counts_no_show(self):
+        """Kiểm tra booking bị tự hủy được tính là no-show trong bảng tổng hợp"""
+        self.book(self.space_a, 0, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            auto_update_booking_status()
+        self.assertEqual(self.rollups()['day'], {self.day: (1, 0.0, 0.0, 1, 1, 0)})
+
+    def test_backfill_matches_incremental(self):
+        """Kiểm tra lệnh backfill theo từng đợt cho kết quả giống cập nhật tăng dần"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.space_a, 0, 2, status='CHECK_OUT', equipment_count=1)
+            self.book(self.space_b, 24, 1)
+            self.book(self.space_g, -48, 3, status='CANCELLED', is_no_show=True)
+        incremental = self.rollups()
+        SpaceUsageDaily.objects.all().delete()
+        SpaceTypeUsageDaily.objects.all().delete()
+        UsageDaily.objects.all().delete()
+        call_command('backfill_usage_rollups', chunk_days=2, stdout=StringIO())
+        self.assertEqual(self.rollups(), incremental)
+        self.assertEqual(len(incremental['day']), 3)
+
+    def test_hours_split_at_midnight(self):
+        """Kiểm tra booking qua nửa đêm chia giờ đặt/giờ dùng cho từng ngày nó đi qua"""
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.space_a, 13, 4, status='CHECK_OUT')
+            self.book(self.space_b, 14, 1)
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(self.rollups()['day'], {
+            self.day: (2, 3.0, 2.0, 0, 0, 0),
+            next_day: (0, 2.0, 2.0, 0, 0, 0),
+        })
+        incremental = sorted(SpaceUsageDaily.objects.values_list('day', 'space_id', 'bookings', 'booked_hours'))
+        call_command('backfill_usage_rollups', chunk_days=1, stdout=StringIO())
+        self.assertEqual(
+            sorted(SpaceUsageDaily.objects.values_list('day', 'space_id', 'bookings', 'booked_hours')), incremental)
+
+    def test_refresh_debounced_per_key(self):
+        """Kiểm tra các thay đổi của cùng (ngày, phòng) khi task chưa chạy chỉ đẩy một task tính lại"""
+        self.enqueue.side_effect = None
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.book(self.space_a, 0, 2)
+        with mock.patch('apps.bookings.services.schedule_booking_deadlines'), \
+                self.captureOnCommitCallbacks(execute=True):
+            update_booking_status(booking.id, 'CANCELLED')
+        self.enqueue.assert_called_once_with(([[self.day.isoformat(), self.space_a.id]],), countdown=30)
+        refresh_usage_rollups_task.apply(*self.enqueue.call_args.args)
+        self.assertEqual(self.rollups()['day'], {self.day: (1, 0.0, 0.0, 1, 0, 0)})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book(self.space_a, 3, 1)
+        self.assertEqual(self.enqueue.call_count, 2)
@@ -5,6 +5,8 @@ urlpatterns = [
     path('bookings/', views.BookingListCreateAPIView.as_view(), name='booking_list'),
     path('equipment-types/', views.EquipmentTypeListCreateAPIView.as_view(), name='equipment_type_list'),
     path('scan-qr/', views.scan_qr_code, name='scan_qr'),
+    path('scan-qr/batch/', views.scan_qr_code_batch, name='scan_qr_batch'),
     path('update-booking-status/', views.update_booking_status_view, name='update_booking_status'),
+    path('<int:booking_id>/qr-code/', views.booking_qr_code_image, name='booking_qr_code_image'),
     path('<int:booking_id>/cancel/', views.cancel_booking, name='cancel-booking'),
 ]
\ No newline at end of file
@@ -1,21 +1,22 @@
 from rest_framework import generics
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Equipment, Booking, QRCode, EquipmentType
-from apps.resources.models import StudySpace
-from .serializers import BookingSerializer, EquipmentSerializer, EquipmentTypeSerializer
-from .services import process_qr_scan, update_booking_status
+from rest_framework.exceptions import PermissionDenied
+from .models import Equipment, Booking, EquipmentType, QRCode
+from .serializers import BookingSerializer, EquipmentSerializer, EquipmentTypeSerializer, QRScanBatchSerializer
+from .services import (
+    equipment_shortfall_payload, process_qr_scan, process_qr_scans, update_booking_status,
+    send_booking_confirmation_emails, schedule_booking_deadlines,
+)
 from .permissions import IsStudentOrTeacher, IsManager, IsBookingOwner, CanCancelBooking
 from django.utils import timezone
 from django.core.exceptions import ValidationError
-from django.core.mail import EmailMessage
-from django.conf import settings
-from io import BytesIO
-from django.core.files.base import ContentFile
 from django.db import transaction
+from django.http import FileResponse
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 class StandardResultsSetPagination(PageNumberPagination):
     page_size = 10
@@ -23,11 +24,29 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+class BookingCursorPagination(CursorPagination):
+    """
+    Phân trang theo con trỏ (created_at, id): không COUNT(*) và không OFFSET,
+    trang sâu nhanh như trang đầu. Dùng với ?pagination=cursor.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
 class BookingListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = BookingSerializer
     permission_classes = [IsStudentOrTeacher | IsManager]
     pagination_class = StandardResultsSetPagination
 
+    @property
+    def paginator(self):
+        # Mặc định phân trang theo số trang như trước, ?pagination=cursor để dùng con trỏ
+        if not hasattr(self, '_paginator') and self.request.query_params.get('pagination') == 'cursor':
+            self._paginator = BookingCursorPagination()
+        return super().paginator
+
     def get_queryset(self):
         # Lấy tham số status từ query string
         status_filter = self.request.query_params.get('status', None)
@@ -44,51 +63,31 @@ class BookingListCreateAPIView(generics.ListCreateAPIView):
                 raise ValidationError("Trạng thái không hợp lệ.")
             queryset = queryset.filter(status=status_filter)
 
-        # Sắp xếp theo thời gian tạo
-        return queryset.order_by('-created_at')
+        # Sắp xếp theo thời gian tạo (id phân định các booking tạo cùng lúc),
+        # nạp sẵn các quan hệ mà BookingSerializer cần cho cả trang
+        return BookingSerializer.setup_queryset(queryset.order_by('-created_at', '-id'))
 
     def perform_create(self, serializer):
+        # create_booking tự quản lý transaction và thử lại khi đụng độ, không khóa dòng phòng
         equipment_requests = serializer.validated_data.pop('equipment_requests', None)
-        with transaction.atomic():
-            space = StudySpace.objects.select_for_update().get(id=serializer.validated_data['space'].id)
-            booking = Booking.create_booking(
-                user_id=self.request.user.id,
-                space_id=space.id,
-                start_time=serializer.validated_data['start_time'],
-                end_time=serializer.validated_data['end_time'],
-                equipment_requests=equipment_requests
-            )
-            serializer.instance = booking
+        booking = Booking.create_booking(
+            user_id=self.request.user.id,
+            space_id=serializer.validated_data['space'].id,
+            start_time=serializer.validated_data['start_time'],
+            end_time=serializer.validated_data['end_time'],
+            equipment_requests=equipment_requests
+        )
+        schedule_booking_deadlines(booking)
+        serializer.instance = booking
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
         booking_data = serializer.data
-        user_email = request.user.email
-        qr_code = serializer.instance.qr_code  # Lấy QRCode từ Booking vừa tạo
-        if user_email and qr_code and qr_code.image:
-            # Đọc hình ảnh mã QR
-            image_file = qr_code.image
-            with image_file.open('rb') as f:
-                image_data = f.read()
-            # Tạo nội dung HTML với ảnh nhúng
-            cid = "qr_code_image"  # Content-ID cho ảnh
-            html_content = (
-                f"Chào bạn,<br><br>Đặt chỗ của bạn đã thành công!<br><br>"
-                f'<img src="cid:{cid}" alt="QR Code"><br><br>'
-                f"Trân trọng,<br>Hệ thống"
-            )
-            # Tạo email
-            email = EmailMessage(
-                'Đặt chỗ thành công',
-                html_content,
-                settings.EMAIL_HOST_USER,
-                [user_email],
-            )
-            email.content_subtype = "html"  # Đặt nội dung là HTML
-            email.attach('qr_code.png', image_data, 'image/png')  # Gắn ảnh
-            email.send()
+        if request.user.email:
+            # Celery worker gửi email xác nhận cho mọi booking đang chờ (theo lô) sau khi transaction commit
+            transaction.on_commit(send_booking_confirmation_emails.delay, robust=True)
         return Response({
             'message': 'Đặt chỗ thành công',
             'data': booking_data
@@ -104,6 +103,13 @@ class EquipmentTypeListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = EquipmentTypeSerializer
     permission_classes = [IsManager]
 
+def _booking_with_shortfall(booking, request):
+    """Dữ liệu booking, kèm equipment_shortfall nếu check-in không giao đủ thiết bị đã giữ chỗ"""
+    data = BookingSerializer(booking, context={'request': request}).data
+    if getattr(booking, 'equipment_shortfall', None):
+        data['equipment_shortfall'] = equipment_shortfall_payload(booking.equipment_shortfall)
+    return data
+
 @extend_schema(
     operation_id="scan_qr_code",
     summary="Quét mã QR để xác thực thông tin đặt chỗ",
@@ -113,7 +119,7 @@ class EquipmentTypeListCreateAPIView(generics.ListCreateAPIView):
             'type': 'object',
             'properties': {
                 'qr_code_id': {'type': 'integer', 'example': 3},
-                'qr_data': {'type': 'string', 'example': 'QR ID: 3\nBooking ID: 3\nUser: khiem\nSpace: Inv-01\nTime: 2025-05-05 14:08:00+00:00--2025-05-05 16:08:00+00:00'},
+                'qr_data': {'type': 'string', 'example': 'SSB1.3.3.1746454080.1746461280.3q2-7wAAAAAAAAAA'},
             },
             'required': ['qr_code_id', 'qr_data'],
         }
@@ -138,19 +144,64 @@ def scan_qr_code(request):
         return Response({'error': 'Dữ liệu QR không được cung cấp'}, status=400)
 
     try:
-        qr_code = QRCode.objects.get(id=qr_code_id)
-        # Kiểm tra quyền
-        if request.user.role != 'manager' and qr_code.booking.user != request.user:
-            return Response({'error': 'Bạn không có quyền thực hiện hành động này'}, status=403)
-
-        with transaction.atomic():
-            space = StudySpace.objects.select_for_update().get(id=qr_code.booking.space.id)
-            booking = process_qr_scan(qr_code_id, qr_data)
-            return Response(BookingSerializer(booking, context={'request': request}).data)
+        # Quản lý quét được mọi booking, người dùng khác chỉ quét booking của mình
+        owner = None if request.user.role == 'manager' else request.user
+        booking = process_qr_scan(qr_code_id, qr_data, user=owner)
+        return Response(_booking_with_shortfall(booking, request))
+    except PermissionDenied as e:
+        return Response({'error': str(e)}, status=403)
     except ValidationError as e:
         return Response({'error': str(e)}, status=400)
-    except QRCode.DoesNotExist:
-        return Response({'error': 'Mã QR không tồn tại'}, status=404)
+
+@extend_schema(
+    operation_id="scan_qr_code_batch",
+    summary="Quét hàng loạt mã QR từ máy quét ở cửa",
+    description=(
+        "Dành cho quản lý/máy quét: nhận một lô lượt quét (có thể được lưu tạm khi mất mạng), "
+        "xử lý check-in/check-out theo thứ tự trong một transaction và trả về kết quả từng lượt."
+    ),
+    request=QRScanBatchSerializer,
+    responses={
+        200: {
+            'type': 'object',
+            'properties': {
+                'results': {
+                    'type': 'array',
+                    'items': {
+                        'type': 'object',
+                        'properties': {
+                            'qr_code_id': {'type': 'integer', 'example': 3},
+                            'ok': {'type': 'boolean'},
+                            'booking_id': {'type': 'integer', 'example': 3},
+                            'status': {'type': 'string', 'example': 'CHECK_IN'},
+                            'error': {'type': 'string', 'example': 'Dữ liệu QR không hợp lệ.'},
+                            'equipment_shortfall': {
+                                'type': 'array',
+                                'items': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'equipment_type_id': {'type': 'integer', 'example': 1},
+                                        'missing': {'type': 'integer', 'example': 1},
+                                    },
+                                },
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+)
+@api_view(['POST'])
+@permission_classes([IsManager])
+def scan_qr_code_batch(request):
+    serializer = QRScanBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    results = process_qr_scans([
+        (scan['qr_code_id'], scan['qr_data'], scan.get('scanned_at'))
+        for scan in serializer.validated_data['scans']
+    ])
+    return Response({'results': results})
 
 @api_view(['POST'])
 def update_booking_status_view(request):
@@ -163,10 +214,8 @@ def update_booking_status_view(request):
         if request.user.role != 'manager' and booking.user != request.user:
             return Response({'error': 'Bạn không có quyền thực hiện hành động này'}, status=403)
 
-        with transaction.atomic():
-            space = StudySpace.objects.select_for_update().get(id=booking.space.id)
-            booking = update_booking_status(booking_id, new_status)
-            return Response(BookingSerializer(booking, context={'request': request}).data)
+        booking = update_booking_status(booking_id, new_status)
+        return Response(_booking_with_shortfall(booking, request))
     except Booking.DoesNotExist:
         return Response({'error': 'Booking không tồn tại'}, status=404)
     except ValidationError as e:
@@ -215,11 +264,29 @@ def cancel_booking(request, booking_id):
         if request.user.role != 'manager' and (booking.user != request.user or booking.status != 'CONFIRMED'):
             return Response({'error': 'Bạn không có quyền hủy đặt phòng này'}, status=403)
 
-        with transaction.atomic():
-            space = StudySpace.objects.select_for_update().get(id=booking.space.id)
-            booking = update_booking_status(booking_id, 'CANCELLED')
-            return Response(BookingSerializer(booking, context={'request': request}).data)
+        booking = update_booking_status(booking_id, 'CANCELLED')
+        return Response(BookingSerializer(booking, context={'request': request}).data)
     except Booking.DoesNotExist:
         return Response({'error': 'Booking không tồn tại'}, status=404)
     except ValidationError as e:
-        return Response({'error': str(e)}, status=400)
\ No newline at end of file
+        return Response({'error': str(e)}, status=400)
+
+
+@extend_schema(
+    operation_id="booking_qr_code_image",
+    summary="Ảnh mã QR của một booking",
+    description="Trả về ảnh PNG của mã QR. Ảnh được render ở lần lấy đầu tiên (hoặc sẵn từ email xác nhận), "
+                "các lần sau đọc file đã lưu. Chỉ chủ booking và ban quản lý được xem.",
+    responses={(200, 'image/png'): OpenApiTypes.BINARY},
+)
+@api_view(['GET'])
+def booking_qr_code_image(request, booking_id):
+    try:
+        qr_code = QRCode.objects.select_related('booking').get(booking_id=booking_id)
+    except QRCode.DoesNotExist:
+        return Response({'error': 'Booking không tồn tại'}, status=404)
+    if request.user.role != 'manager' and qr_code.booking.user_id != request.user.id:
+        return Response({'error': 'Bạn không có quyền xem mã QR này'}, status=403)
+    response = FileResponse(qr_code.ensure_image().open('rb'), content_type='image/png')
+    response['Cache-Control'] = 'private, max-age=86400'
+    return response
@@ -1,8 +1,31 @@
 from django.contrib import admin
-from .models import Feedback, Notification, NotificationReadStatus, Comment
+from django.db.models import Q
+from apps.users.models import User
+from .search import match_expression, matching_ids, search_available
+from .models import Feedback, Notification, NotificationReadStatus, NotificationReadWatermark, Comment
+
+class FullTextSearchMixin:
+    """
+    Ô tìm kiếm dùng chỉ mục toàn văn (message_search) thay cho icontains trên các cột nội dung.
+    Chỉ mục khớp theo từ, nên khi không có kết quả (ví dụ gõ một phần của từ) thì quay về
+    icontains trên search_fields như cũ.
+    """
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_available() or not match_expression(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        results = queryset.filter(
+            Q(pk__in=matching_ids(self.search_kind, search_term)) |
+            Q(sender__in=User.objects.filter(username=search_term))
+        )
+        if not results.exists():
+            return super().get_search_results(request, queryset, search_term)
+        return results, False
 
 @admin.register(Feedback)
-class FeedbackAdmin(admin.ModelAdmin):
+class FeedbackAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'feedback'
     list_display = ('sender', 'content', 'status', 'responded_by', 'is_read', 'created_at')
     search_fields = ('sender__username', 'content', 'response')
     list_filter = ('status', 'sender__role', 'is_read')
@@ -15,7 +38,8 @@ class FeedbackAdmin(admin.ModelAdmin):
         return qs.none()
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'comment'
     list_display = ('sender', 'feedback', 'content', 'created_at')
     search_fields = ('sender__username', 'content')
     list_filter = ('sender__role',)
@@ -28,7 +52,8 @@ class CommentAdmin(admin.ModelAdmin):
         return qs.filter(sender=request.user)
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(FullTextSearchMixin, admin.ModelAdmin):
+    search_kind = 'notification'
     list_display = ('sender', 'target_type', 'target_user', 'content', 'created_at')
     search_fields = ('sender__username', 'content')
     list_filter = ('target_type',)
@@ -44,4 +69,9 @@ class NotificationAdmin(admin.ModelAdmin):
 class NotificationReadStatusAdmin(admin.ModelAdmin):
     list_display = ('user', 'notification', 'is_read')
     search_fields = ('user__username', 'notification__content')
-    list_filter = ('is_read',)
\ No newline at end of file
+    list_filter = ('is_read',)
+
+@admin.register(NotificationReadWatermark)
+class NotificationReadWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('user', 'read_until')
+    search_fields = ('user__username',)
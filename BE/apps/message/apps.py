@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MessageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.message'
+
+    def ready(self):
+        """
+        Được gọi khi ứng dụng khởi động.
+        - Import signals để cập nhật bộ đếm chưa đọc khi thông báo/phản hồi thay đổi.
+        """
+        import apps.message.signals
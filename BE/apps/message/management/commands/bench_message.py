@@ -0,0 +1,303 @@
+import random
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.db import models, transaction
+from django.urls import reverse
+from rest_framework.generics import ListAPIView
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+
+from apps.bookings.management.benchmark import BenchmarkCommand, seed_users
+from apps.message.models import Comment, Feedback, Notification, NotificationReadStatus
+from apps.message.serializers import FeedbackSerializer, NotificationCreateSerializer, NotificationSerializer
+from apps.message import admin, search
+from apps.message.services import rebuild_unread_counters
+from apps.message.views import FeedbackListView, NotificationListView
+from apps.users.models import User
+
+
+class Command(BenchmarkCommand):
+    help = "Benchmark các API của ứng dụng message (phản hồi, thông báo)."
+    scenarios = ('send', 'count', 'list', 'clear', 'feedbacks', 'search')
+
+    def bench_send(self):
+        """Gửi thông báo cho tất cả: tạo trạng thái đọc cho từng người (cũ) so với fan-out khi đọc."""
+        seed_users(self.scaled(40_000))
+        seed_users(self.scaled(9_000), role='teacher')
+        manager = seed_users(self.scaled(1_000), role='manager')[0]
+        client = APIClient()
+        client.force_authenticate(user=manager)
+
+        class LegacyNotificationCreateSerializer(NotificationCreateSerializer):
+            # Hành vi cũ: một câu INSERT NotificationReadStatus cho mỗi người nhận
+            def create(self, validated_data):
+                notification = super().create(validated_data)
+                users = User.objects.filter(is_superuser=False)
+                if validated_data['target_type'] != 'all':
+                    users = users.filter(role=validated_data['target_type'])
+                for user in users:
+                    NotificationReadStatus.objects.create(user=user, notification=notification)
+                return notification
+
+        def send():
+            with transaction.atomic():
+                response = client.post(reverse('notification-create'), {'target_type': 'all', 'content': 'Bảo trì.'})
+                assert response.status_code == 201
+                transaction.set_rollback(True)
+
+        def legacy_send():
+            serializer = LegacyNotificationCreateSerializer(data={'target_type': 'all', 'content': 'Bảo trì.'})
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                serializer.save(sender=manager)
+                transaction.set_rollback(True)
+
+        self.section(f"Gửi thông báo 'all' cho {User.objects.count()} người dùng")
+        self.measure('một INSERT trạng thái đọc mỗi người (cũ)', legacy_send, repeat=1)
+        self.measure('fan-out khi đọc (POST /notifications/)', send)
+
+    def bench_count(self):
+        """GET /api/messages/new-count/ với 10k thông báo mỗi người: lặp từng thông báo (cũ) so với bộ đếm."""
+        student = seed_users(1)[0]
+        manager = seed_users(1, role='manager')[0]
+        targets = [{'target_type': 'all'}, {'target_type': 'student'},
+                   {'target_type': 'specific_user', 'target_user': student}]
+        total = self.scaled(10_000)
+        Notification.objects.bulk_create(
+            (Notification(sender=manager, content=f'Thông báo {i}', **targets[i % 3]) for i in range(total)),
+            batch_size=5000,
+        )
+        # Một nửa số thông báo đã đọc
+        NotificationReadStatus.objects.bulk_create(
+            (NotificationReadStatus(user=student, notification_id=notification_id, is_read=True)
+             for notification_id in Notification.objects.values_list('id', flat=True)[::2]),
+            batch_size=5000,
+        )
+        client = APIClient()
+        client.force_authenticate(user=student)
+
+        def legacy_count():
+            # Bản sao vòng lặp cũ của NewFeedbackNotificationCountView
+            notifications = Notification.objects.filter(
+                models.Q(target_type='all') |
+                models.Q(target_type=student.role) |
+                models.Q(target_type='specific_user', target_user=student)
+            ).distinct()
+            count = 0
+            for notification in notifications:
+                read_status = notification.read_statuses.filter(user=student).first()
+                if not read_status or not read_status.is_read:
+                    count += 1
+            return count
+
+        def get_count():
+            response = client.get(reverse('new-feedback-notification-count'))
+            assert response.data['new_notifications'] == expected
+
+        self.section(f"{total} thông báo gửi tới một sinh viên")
+        self.measure('rebuild_unread_counters', rebuild_unread_counters, repeat=1)
+        expected = legacy_count()
+        self.measure('lặp từng thông báo (cũ)', legacy_count, repeat=min(self.options['repeat'], 3))
+        self.measure('bộ đếm UnreadCounter', get_count)
+
+    def bench_list(self):
+        """GET /api/messages/notifications/list/ với 100k thông báo: is_read từng dòng (cũ) so với phân trang theo id + Exists."""
+        students = seed_users(self.scaled(1000))
+        student = students[0]
+        manager = seed_users(1, role='manager')[0]
+        total = self.scaled(100_000)
+        targets = [{'target_type': 'all'}, {'target_type': 'student'}, {'target_type': 'teacher'},
+                   {'target_type': 'manager'}]
+        Notification.objects.bulk_create((
+            Notification(sender=manager, content=f'Thông báo {i}', **targets[i % 4]) if i % 5 else
+            Notification(sender=manager, content=f'Thông báo {i}', target_type='specific_user',
+                         target_user=students[i % len(students)])
+            for i in range(total)
+        ), batch_size=5000)
+        NotificationReadStatus.objects.bulk_create(
+            (NotificationReadStatus(user=student, notification_id=notification_id, is_read=True)
+             for notification_id in Notification.objects.values_list('id', flat=True)[::3]),
+            batch_size=5000,
+        )
+        client = APIClient()
+        client.force_authenticate(user=student)
+
+        def legacy_get_queryset(self):
+            # Hành vi cũ: OR của ba điều kiện + distinct(), phân trang trên cả dòng, is_read truy vấn riêng từng dòng
+            user = self.request.user
+            return Notification.objects.filter(
+                models.Q(target_type='all') |
+                models.Q(target_type=user.role) |
+                models.Q(target_type='specific_user', target_user=user)
+            ).distinct()
+
+        def legacy_is_read(self, obj):
+            read_status = obj.read_statuses.filter(user=self.context['request'].user).first()
+            return read_status.is_read if read_status else False
+
+        def get(page):
+            def run():
+                response = client.get(reverse('notification-list'), {'page': page})
+                assert response.status_code == 200 and len(response.data['results']) == 10
+            return run
+
+        self.section(f"{Notification.objects.count()} thông báo, "
+                     f"{Notification.visible_to(student).count()} thông báo của một sinh viên")
+        for page in (1, 100):
+            with mock.patch.object(NotificationListView, 'get_queryset', legacy_get_queryset), \
+                    mock.patch.object(NotificationListView, 'paginate_queryset', ListAPIView.paginate_queryset), \
+                    mock.patch.object(NotificationSerializer, 'get_is_read', legacy_is_read):
+                self.measure(f'trang {page}: is_read từng dòng (cũ)', get(page))
+            self.measure(f'trang {page}: phân trang theo id + Exists', get(page))
+
+    def bench_clear(self):
+        """Dọn hộp thư 5k thông báo chưa đọc: từng request (cũ) so với đánh dấu hàng loạt."""
+        student = seed_users(1)[0]
+        manager = seed_users(1, role='manager')[0]
+        total = self.scaled(5000)
+        Notification.objects.bulk_create(
+            (Notification(sender=manager, target_type='student', content=f'Thông báo {i}') for i in range(total)),
+            batch_size=5000,
+        )
+        rebuild_unread_counters()
+        ids = list(Notification.objects.values_list('id', flat=True))
+        client = APIClient()
+        client.force_authenticate(user=student)
+
+        def per_notification():
+            for notification_id in ids:
+                client.post(reverse('notification-mark-read', args=[notification_id]))
+
+        def by_ids():
+            for offset in range(0, len(ids), 1000):
+                response = client.post(reverse('notification-mark-read-bulk'), {'ids': ids[offset:offset + 1000]},
+                                       format='json')
+            assert response.data['new_notifications'] == 0
+
+        def mark_all():
+            response = client.post(reverse('notification-mark-read-bulk'), {'all': True}, format='json')
+            assert response.data['new_notifications'] == 0
+
+        self.section(f"{total} thông báo chưa đọc")
+        for label, clear, repeat in (('từng thông báo (POST /<id>/mark-read/)', per_notification, 1),
+                                     ('theo danh sách id (1000 id mỗi request)', by_ids, None),
+                                     ('tất cả (mốc đã đọc)', mark_all, None)):
+            def run():
+                with transaction.atomic():
+                    clear()
+                    transaction.set_rollback(True)
+            self.measure(label, run, repeat=repeat)
+
+    def bench_feedbacks(self):
+        """GET /api/messages/feedbacks/list/ với 50k phản hồi: toàn bộ kèm bình luận (cũ) so với trang rút gọn."""
+        students = seed_users(self.scaled(1000))
+        manager = seed_users(1, role='manager')[0]
+        total = self.scaled(50_000)
+        Feedback.objects.bulk_create((
+            Feedback(sender=students[i % len(students)], content=f'Phản hồi {i}',
+                     **({'status': 'responded', 'response': 'Đã xử lý.', 'responded_by': manager} if i % 2 else {}))
+            for i in range(total)
+        ), batch_size=5000)
+        # 0-3 bình luận mỗi phản hồi, xen kẽ người gửi và ban quản lý
+        Comment.objects.bulk_create((
+            Comment(feedback_id=feedback_id, sender_id=sender_id if j % 2 else manager.id, content=f'Bình luận {j}')
+            for feedback_id, sender_id in Feedback.objects.values_list('id', 'sender_id')
+            for j in range(feedback_id % 4)
+        ), batch_size=5000)
+        student = students[0]
+
+        def legacy_get(self, request):
+            # Hành vi cũ: toàn bộ phản hồi, không phân trang, người gửi và bình luận truy vấn riêng từng dòng
+            if request.user.role == 'manager':
+                feedbacks = Feedback.objects.all()
+            else:
+                feedbacks = Feedback.objects.filter(sender=request.user)
+            return Response(FeedbackSerializer(feedbacks, many=True).data)
+
+        def get(user, expected, follow=0):
+            client = APIClient()
+            client.force_authenticate(user=user)
+            url = reverse('feedback-list')
+            for _ in range(follow):
+                url = client.get(url).data['next']
+
+            def run():
+                response = client.get(url)
+                assert response.status_code == 200
+                assert len(response.data if isinstance(response.data, list) else response.data['results']) == expected
+            return run
+
+        self.section(f"{Feedback.objects.count()} phản hồi, {Comment.objects.count()} bình luận, "
+                     f"{Feedback.objects.filter(sender=student).count()} phản hồi của một sinh viên")
+        with mock.patch.object(FeedbackListView, 'get', legacy_get):
+            self.measure('quản lý: toàn bộ kèm bình luận (cũ)', get(manager, total), repeat=1)
+            self.measure('sinh viên: toàn bộ kèm bình luận (cũ)', get(student, total // len(students)))
+        self.measure('quản lý: trang 1 rút gọn', get(manager, 10))
+        self.measure('quản lý: trang 100 rút gọn (theo next)', get(manager, 10, follow=99))
+        self.measure('sinh viên: trang 1 rút gọn', get(student, 10))
+
+    def bench_search(self):
+        """Tìm kiếm trên 1M phản hồi/bình luận/thông báo: icontains (cũ) so với chỉ mục FTS5."""
+        students = seed_users(self.scaled(1000))
+        teachers = seed_users(self.scaled(200), role='teacher')
+        manager = seed_users(1, role='manager')[0]
+        total = self.scaled(1_000_000)
+        words = ('phòng', 'học', 'wifi', 'máy', 'chiếu', 'điều', 'hòa', 'bàn', 'ghế', 'ồn', 'chậm', 'hỏng', 'sạch',
+                 'đèn', 'sáng', 'tối', 'ổ', 'cắm', 'điện', 'nóng', 'lạnh', 'đặt', 'chỗ', 'hủy', 'lịch', 'bảo', 'trì',
+                 'thư', 'viện', 'nhóm', 'cá', 'nhân', 'giờ', 'mở', 'cửa', 'đóng', 'mạng', 'yếu', 'tốt', 'cảm', 'ơn')
+        generator = random.Random(0)
+
+        def text(i):
+            # Từ phổ biến lặp nhiều hơn (xấp xỉ Zipf); "tivi" chỉ xuất hiện ở 1/10.000 tài liệu
+            sentence = ' '.join(words[min(int(generator.paretovariate(0.7)) - 1, len(words) - 1)] for _ in range(12))
+            return sentence + (' tivi' if i % 10_000 == 0 else '')
+
+        authors = students + teachers
+        Feedback.objects.bulk_create((
+            Feedback(sender=authors[i % len(authors)], content=text(i), status='responded' if i % 5 else 'pending',
+                     response=text(i + 1) if i % 5 else None)
+            for i in range(total * 6 // 10)
+        ), batch_size=5000)
+        feedback_ids = list(Feedback.objects.values_list('id', flat=True))
+        Comment.objects.bulk_create((
+            Comment(feedback_id=feedback_ids[i % len(feedback_ids)], sender=manager if i % 2 else authors[i % len(authors)],
+                    content=text(i))
+            for i in range(total * 25 // 100)
+        ), batch_size=5000)
+        Notification.objects.bulk_create((
+            Notification(sender=manager, target_type='all', content=text(i)) for i in range(total * 15 // 100)
+        ), batch_size=5000)
+        documents = search.rebuild_search_index()
+        client = APIClient()
+        client.force_authenticate(user=manager)
+
+        def get(params):
+            def run():
+                response = client.get(reverse('message-search'), params)
+                assert response.status_code == 200 and response.data['results']
+            return run
+
+        queries = (('từ hiếm "tivi"', {'q': 'tivi'}),
+                   ('hai từ phổ biến', {'q': 'wifi chậm'}),
+                   ('chờ xử lý + giảng viên', {'q': 'máy chiếu', 'kind': 'feedback', 'status': 'pending',
+                                                         'role': 'teacher'}))
+        self.section(f"{documents} tài liệu (phản hồi, bình luận, thông báo), 20 kết quả mỗi trang")
+        for label, params in queries:
+            with mock.patch.object(search, 'search_available', lambda using=None: False):
+                self.measure(f'{label}: icontains (cũ)', get(params), repeat=1)
+            self.measure(f'{label}: FTS5 + bm25', get(params))
+
+        feedback_admin = admin.FeedbackAdmin(Feedback, site)
+
+        def admin_search(term):
+            def run():
+                # Trang đầu của changelist admin: COUNT(*) và 100 dòng
+                queryset, _ = feedback_admin.get_search_results(None, Feedback.objects.all(), term)
+                assert queryset.count() and len(queryset[:100])
+            return run
+
+        self.section(f"Ô tìm kiếm admin phản hồi ({Feedback.objects.count()} phản hồi)")
+        with mock.patch.object(admin, 'search_available', lambda using=None: False):
+            self.measure('"tivi": search_fields icontains (cũ)', admin_search('tivi'), repeat=1)
+        self.measure('"tivi": chỉ mục toàn văn', admin_search('tivi'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.message.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Dựng lại chỉ mục tìm kiếm toàn văn (message_search) từ phản hồi, bình luận và thông báo."
+
+    def handle(self, *args, **options):
+        documents = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Hoàn tất: {documents} tài liệu."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from apps.message.services import rebuild_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Tính lại bộ đếm thông báo/phản hồi chưa đọc (UnreadCounter) từ database."
+
+    def handle(self, *args, **options):
+        counters = rebuild_unread_counters()
+        self.stdout.write(self.style.SUCCESS(f"Hoàn tất: {counters} bộ đếm."))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 02:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def delete_unread_statuses(apps, schema_editor):
+    # Trước đây mỗi người nhận có một dòng is_read=False từ lúc gửi; giờ thiếu dấu đã đọc
+    # nghĩa là chưa đọc nên chỉ giữ lại các dòng đã đọc
+    NotificationReadStatus = apps.get_model('message', 'NotificationReadStatus')
+    NotificationReadStatus.objects.filter(is_read=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0002_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationReadWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_until', models.DateTimeField()),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='notification_read_watermark', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(delete_unread_statuses, migrations.RunPython.noop),
+    ]
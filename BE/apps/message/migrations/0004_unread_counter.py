@@ -0,0 +1,68 @@
+# Generated by Django 5.2 on 2026-10-18 02:43
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, F, Q
+
+
+# Bản chụp khóa bộ đếm và rebuild_unread_counters tại thời điểm migration, không dùng
+# apps.message.services để thay đổi sau này của mã bộ đếm không làm đổi migration cũ
+def sent_key(target_type, target_user_id):
+    if target_type == 'specific_user':
+        return f'notifications:user:{target_user_id}'
+    if target_type == 'all':
+        return 'notifications:all'
+    return f'notifications:role:{target_type}'
+
+
+def build_unread_counters(apps, schema_editor):
+    # Database đã có dữ liệu cần bộ đếm đúng ngay sau migrate: signal chỉ cộng/trừ
+    # chênh lệch trên giá trị sẵn có
+    Notification = apps.get_model('message', 'Notification')
+    NotificationReadStatus = apps.get_model('message', 'NotificationReadStatus')
+    NotificationReadWatermark = apps.get_model('message', 'NotificationReadWatermark')
+    Feedback = apps.get_model('message', 'Feedback')
+    UnreadCounter = apps.get_model('message', 'UnreadCounter')
+    counters = defaultdict(int)
+    for target_type, target_user_id, total in Notification.objects.values_list(
+        'target_type', 'target_user'
+    ).annotate(total=Count('id')).order_by():
+        counters[sent_key(target_type, target_user_id)] += total
+    for user_id, total in NotificationReadStatus.objects.filter(is_read=True).filter(
+        Q(user__notification_read_watermark__isnull=True) |
+        Q(notification__created_at__gt=F('user__notification_read_watermark__read_until'))
+    ).values_list('user').annotate(total=Count('id')).order_by():
+        counters[f'notifications_read:user:{user_id}'] += total
+    for watermark in NotificationReadWatermark.objects.select_related('user'):
+        user = watermark.user
+        counters[f'notifications_read:user:{user.id}'] += Notification.objects.filter(
+            Q(target_type='all') | Q(target_type=user.role) | Q(target_type='specific_user', target_user=user),
+            created_at__lte=watermark.read_until,
+        ).count()
+    for sender_id, total in Feedback.objects.filter(is_read=False).values_list('sender').annotate(
+        total=Count('id')
+    ).order_by():
+        counters[f'feedbacks_unread:user:{sender_id}'] += total
+    UnreadCounter.objects.bulk_create(
+        (UnreadCounter(key=key, value=value) for key, value in counters.items() if value), batch_size=5000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0003_notification_read_watermark'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_unread_counters, migrations.RunPython.noop),
+    ]
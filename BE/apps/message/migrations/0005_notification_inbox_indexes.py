@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 02:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0004_unread_counter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['target_type', '-created_at'], name='notif_target_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['target_user', '-created_at'], name='notif_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 02:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0005_notification_inbox_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['feedback', 'created_at'], name='comment_feedback_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['-created_at', '-id'], name='feedback_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['sender', '-created_at', '-id'], name='feedback_sender_created_idx'),
+        ),
+    ]
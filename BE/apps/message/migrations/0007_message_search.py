@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# Bản chụp cấu trúc chỉ mục tại thời điểm migration, không dùng apps.message.search
+# để thay đổi sau này của mã tìm kiếm không làm đổi migration cũ
+SEARCH_TABLE = 'message_search'
+KIND_CODES = {'feedback': 1, 'comment': 2, 'notification': 3}
+
+
+def create_search_index(apps, schema_editor):
+    # Bảng ảo FTS5 chỉ có trên SQLite; database khác tìm kiếm bằng icontains
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    quote = connection.ops.quote_name
+    users = quote(apps.get_model('users', 'User')._meta.db_table)
+    schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        "body, tags, kind UNINDEXED, object_id UNINDEXED, status UNINDEXED, role UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+    sources = [
+        ('Feedback', 'feedback', "COALESCE(t.content, '') || ' ' || COALESCE(t.response, '')", 't.status',
+         "' status' || t.status"),
+        ('Comment', 'comment', 't.content', 'NULL', "''"),
+        ('Notification', 'notification', 't.content', 'NULL', "''"),
+    ]
+    for model_name, kind, body, status, status_tag in sources:
+        table = quote(apps.get_model('message', model_name)._meta.db_table)
+        schema_editor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, body, tags, kind, object_id, status, role) "
+            f"SELECT t.id * 4 + %s, {body}, %s || {status_tag} || ' role' || u.role, %s, t.id, {status}, u.role "
+            f"FROM {table} t JOIN {users} u ON u.id = t.sender_id",
+            [KIND_CODES[kind], f'kind{kind}', kind],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0006_feedback_list_indexes'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
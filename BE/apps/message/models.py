@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import Count, Exists, ExpressionWrapper, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from apps.users.models import User
 
 class Feedback(models.Model):
@@ -30,6 +32,23 @@ class Feedback(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Danh sách phản hồi của quản lý (tất cả) và của người gửi, phân trang theo con trỏ
+            models.Index(fields=['-created_at', '-id'], name='feedback_created_id_idx'),
+            models.Index(fields=['sender', '-created_at', '-id'], name='feedback_sender_created_idx'),
+        ]
+
+    @staticmethod
+    def with_comment_stats(feedbacks):
+        """
+        Gắn comment_count và last_comment_at bằng truy vấn con tương quan (chỉ tính cho các dòng
+        của trang), nạp sẵn người gửi và người trả lời.
+        """
+        comments = Comment.objects.filter(feedback=OuterRef('pk')).order_by().values('feedback')
+        return feedbacks.select_related('sender', 'responded_by').annotate(
+            comment_count=Coalesce(Subquery(comments.annotate(total=Count('id')).values('total')), 0),
+            last_comment_at=Subquery(comments.annotate(last=Max('created_at')).values('last')),
+        )
 
     def __str__(self):
         return f"Feedback from {self.sender.username} - {self.status}"
@@ -51,6 +70,9 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['created_at']  # Sắp xếp bình luận theo thời gian tạo
+        indexes = [
+            models.Index(fields=['feedback', 'created_at'], name='comment_feedback_created_idx'),
+        ]
 
     def __str__(self):
         return f"Comment by {self.sender.username} on Feedback {self.feedback.id}"
@@ -84,11 +106,62 @@ class Notification(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Ba nhánh OR của Notification.visible_to: theo đối tượng nhận và theo người nhận cụ thể
+            models.Index(fields=['target_type', '-created_at'], name='notif_target_created_idx'),
+            models.Index(fields=['target_user', '-created_at'], name='notif_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Notification from {self.sender.username} to {self.target_type}"
 
+    @staticmethod
+    def visible_to(user):
+        """Các thông báo người dùng nhận được: gửi tất cả, gửi theo vai trò hoặc gửi riêng"""
+        return Notification.objects.filter(
+            models.Q(target_type='all') |
+            models.Q(target_type=user.role) |
+            models.Q(target_type='specific_user', target_user=user)
+        )
+
+    @staticmethod
+    def with_read_state(notifications, user):
+        """
+        Gắn is_read của user (dấu đã đọc riêng hoặc mốc đã đọc) bằng Exists trong cùng truy vấn,
+        nạp sẵn người gửi và người nhận để serializer không truy vấn theo từng dòng.
+        """
+        is_read = Exists(NotificationReadStatus.objects.filter(notification=OuterRef('pk'), user=user, is_read=True))
+        watermark = NotificationReadWatermark.objects.filter(user=user).values_list('read_until', flat=True).first()
+        if watermark is not None:
+            is_read = is_read | Q(created_at__lte=watermark)
+        return notifications.select_related('sender', 'target_user').annotate(
+            is_read=ExpressionWrapper(is_read, output_field=models.BooleanField())
+        )
+
+    @staticmethod
+    def unread_for(user):
+        """
+        Thông báo chưa đọc: không có dấu đã đọc riêng và tạo sau mốc đã đọc của người dùng.
+        Trạng thái đọc chỉ được ghi khi người dùng đánh dấu (fan-out khi đọc).
+        """
+        unread = Notification.visible_to(user).exclude(Exists(NotificationReadStatus.objects.filter(
+            notification=OuterRef('pk'), user=user, is_read=True,
+        )))
+        watermark = NotificationReadWatermark.objects.filter(user=user).values_list('read_until', flat=True).first()
+        if watermark is not None:
+            unread = unread.filter(created_at__gt=watermark)
+        return unread
+
+    def is_read_by(self, user, watermark=None):
+        """watermark: mốc đã đọc của user nếu đã lấy sẵn"""
+        if watermark is None:
+            watermark = NotificationReadWatermark.objects.filter(user=user).values_list('read_until', flat=True).first()
+        if watermark is not None and self.created_at <= watermark:
+            return True
+        return self.read_statuses.filter(user=user, is_read=True).exists()
+
 class NotificationReadStatus(models.Model):
+    """Dấu đã đọc riêng cho một thông báo, chỉ tạo khi người dùng đánh dấu đã đọc"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notification_read_statuses')
     notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='read_statuses')
     is_read = models.BooleanField(default=False)
@@ -97,4 +170,23 @@ class NotificationReadStatus(models.Model):
         unique_together = ('user', 'notification')
 
     def __str__(self):
-        return f"{self.user.username} - {self.notification.content} - {'Read' if self.is_read else 'Unread'}"
\ No newline at end of file
+        return f"{self.user.username} - {self.notification.content} - {'Read' if self.is_read else 'Unread'}"
+
+class NotificationReadWatermark(models.Model):
+    """Mốc đã đọc của người dùng: mọi thông báo tạo từ read_until trở về trước coi như đã đọc"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='notification_read_watermark')
+    read_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user.username} - read until {self.read_until}"
+
+class UnreadCounter(models.Model):
+    """
+    Bộ đếm theo khóa cho API đếm chưa đọc (xem apps/message/services.py):
+    tổng thông báo đã gửi theo đối tượng nhận, số thông báo đã đọc và số phản hồi chưa đọc của từng người.
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
@@ -0,0 +1,191 @@
+"""
+TÌM KIẾM TOÀN VĂN (phản hồi, bình luận, thông báo)
+- Trên SQLite: bảng ảo FTS5 message_search (tokenizer unicode61 bỏ dấu, nên "phan hoi"
+  khớp "phản hồi"), xếp hạng bằng bm25. Mỗi dòng có rowid = id * 4 + mã loại nên cập
+  nhật/xóa một tài liệu đi thẳng theo rowid.
+- Signal giữ chỉ mục đồng bộ trong cùng transaction với thay đổi dữ liệu; bulk_create/update
+  không gửi signal, khi đó chạy manage.py rebuild_search_index.
+- status là trạng thái phản hồi (chỉ có ở phản hồi), role là vai trò người viết; bộ lọc theo
+  loại/status/role là các từ trong cột tags nên được giao ngay trong chỉ mục. Người viết đổi
+  vai trò thì reindex_sender cập nhật role/tags các tài liệu của họ.
+- Giới hạn: chỉ mục chỉ được dựng trên SQLite. Database khác (kể cả PostgreSQL) chưa có chỉ mục
+  tương ứng (SearchVector + GIN), search() quét icontains, không xếp hạng, không bỏ dấu.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from apps.users.models import User
+from .models import Comment, Feedback, Notification
+
+SEARCH_TABLE = 'message_search'
+KIND_CODES = {'feedback': 1, 'comment': 2, 'notification': 3}
+SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS = '[', ']', '…'
+SNIPPET_TOKENS = 16
+
+
+def search_available(using=None):
+    return (using or connection).vendor == 'sqlite'
+
+
+def create_search_table(using=None):
+    """
+    body là nội dung được tìm; tags chứa các từ lọc (kindfeedback, statuspending, roleteacher) để
+    bộ lọc giao danh sách trong chỉ mục thay vì lọc sau khi xếp hạng; bm25 chỉ tính trên body.
+    """
+    with (using or connection).cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+            "body, tags, kind UNINDEXED, object_id UNINDEXED, status UNINDEXED, role UNINDEXED, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', 'bm25(1.0, 0.0)')")
+
+
+def tags(kind, status, role):
+    return ' '.join(f'{name}{value}' for name, value in (('kind', kind), ('status', status), ('role', role)) if value)
+
+
+def match_expression(query, kinds=None, status=None, role=None):
+    """Chuỗi người dùng nhập -> biểu thức MATCH: mọi từ đều phải có trong body (không lộ cú pháp FTS5)"""
+    words = ' '.join(f'"{word}"' for word in re.findall(r'\w+', query))
+    if not words:
+        return ''
+    expression = f'body : ({words})'
+    if kinds:
+        expression += ' AND tags : (' + ' OR '.join(f'"kind{kind}"' for kind in kinds) + ')'
+    for name, value in (('status', status), ('role', role)):
+        if value:
+            expression += f' AND tags : "{name}{value}"'
+    return expression
+
+
+def feedback_document(feedback):
+    return ('feedback', feedback.id, ' '.join(filter(None, [feedback.content, feedback.response])),
+            feedback.status, feedback.sender.role)
+
+
+def comment_document(comment):
+    return ('comment', comment.id, comment.content, None, comment.sender.role)
+
+
+def notification_document(notification):
+    return ('notification', notification.id, notification.content, None, notification.sender.role)
+
+
+def index_documents(documents, replace=True):
+    """Thêm các tài liệu (kind, id, body, status, role); replace=False khi chắc chắn chúng chưa có trong chỉ mục"""
+    if not search_available() or not documents:
+        return
+    rows = [(object_id * 4 + KIND_CODES[kind], body, tags(kind, status, role), kind, object_id, status, role)
+            for kind, object_id, body, status, role in documents]
+    with connection.cursor() as cursor:
+        if replace:
+            cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [row[:1] for row in rows])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, body, tags, kind, object_id, status, role) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)", rows
+        )
+
+
+def remove_documents(kind, ids):
+    if not search_available() or not ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+                           [(object_id * 4 + KIND_CODES[kind],) for object_id in ids])
+
+
+def reindex_sender(user):
+    """Cập nhật role và tags của mọi tài liệu do user viết sau khi vai trò của họ đổi"""
+    if not search_available():
+        return
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model, kind in ((Feedback, 'feedback'), (Comment, 'comment'), (Notification, 'notification')):
+            cursor.execute(
+                f"UPDATE {SEARCH_TABLE} SET role = %s, tags = %s || COALESCE(' status' || status, '') || %s "
+                f"WHERE rowid IN (SELECT id * 4 + %s FROM {quote(model._meta.db_table)} WHERE sender_id = %s)",
+                [user.role, f'kind{kind}', f' role{user.role}', KIND_CODES[kind], user.id],
+            )
+
+
+def rebuild_search_index(using=None):
+    """Dựng lại toàn bộ chỉ mục bằng INSERT ... SELECT, trả về số tài liệu"""
+    using = using or connection
+    if not search_available(using):
+        return 0
+    quote = using.ops.quote_name
+    users = quote(User._meta.db_table)
+    sources = [
+        (Feedback, 'feedback', "COALESCE(t.content, '') || ' ' || COALESCE(t.response, '')", 't.status',
+         "' status' || t.status"),
+        (Comment, 'comment', 't.content', 'NULL', "''"),
+        (Notification, 'notification', 't.content', 'NULL', "''"),
+    ]
+    create_search_table(using)
+    with using.cursor() as cursor:
+        for model, kind, body, status, status_tag in sources:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, body, tags, kind, object_id, status, role) "
+                f"SELECT t.id * 4 + %s, {body}, %s || {status_tag} || ' role' || u.role, %s, t.id, {status}, u.role "
+                f"FROM {quote(model._meta.db_table)} t JOIN {users} u ON u.id = t.sender_id",
+                [KIND_CODES[kind], f'kind{kind}', kind],
+            )
+        cursor.execute(f"SELECT count(*) FROM {SEARCH_TABLE}")
+        return cursor.fetchone()[0]
+
+
+def matching_ids(kind, query):
+    """Truy vấn con id các đối tượng loại kind khớp query, dùng trong filter(pk__in=...)"""
+    return RawSQL(f"SELECT object_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s",
+                  (match_expression(query, kinds=[kind]),))
+
+
+def search(query, kinds=None, status=None, role=None, limit=20, offset=0):
+    """
+    Tìm trên phản hồi, bình luận và thông báo, kết quả liên quan nhất trước.
+    Trả về danh sách dict kind, id, status, role, snippet (từ khớp nằm trong [ ]), rank.
+    """
+    expression = match_expression(query, kinds, status, role)
+    if not expression:
+        return []
+    if not search_available():
+        return _search_without_index(query, kinds, status, role, limit, offset)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT kind, object_id, status, role, snippet({SEARCH_TABLE}, 0, %s, %s, %s, %s), rank "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+            [SNIPPET_START, SNIPPET_END, SNIPPET_ELLIPSIS, SNIPPET_TOKENS, expression, limit, offset],
+        )
+        return [
+            {'kind': kind, 'id': object_id, 'status': row_status, 'role': row_role, 'snippet': snippet, 'rank': rank}
+            for kind, object_id, row_status, row_role, snippet, rank in cursor.fetchall()
+        ]
+
+
+def _search_without_index(query, kinds, status, role, limit, offset):
+    words = re.findall(r'\w+', query)
+    results = []
+    for kind, model, fields in (('feedback', Feedback, ('content', 'response')),
+                                ('comment', Comment, ('content',)),
+                                ('notification', Notification, ('content',))):
+        if (kinds and kind not in kinds) or (status and kind != 'feedback'):
+            continue
+        objects = model.objects.select_related('sender')
+        for word in words:
+            match = Q()
+            for field in fields:
+                match |= Q(**{f'{field}__icontains': word})
+            objects = objects.filter(match)
+        if status:
+            objects = objects.filter(status=status)
+        if role:
+            objects = objects.filter(sender__role=role)
+        for obj in objects.order_by('-created_at')[:offset + limit]:
+            results.append({'kind': kind, 'id': obj.id, 'status': getattr(obj, 'status', None),
+                            'role': obj.sender.role, 'snippet': obj.content[:200], 'rank': 0.0})
+    return results[offset:offset + limit]
@@ -1,7 +1,8 @@
 from rest_framework import serializers
-from .models import Feedback, Notification, NotificationReadStatus, Comment
-from apps.users.serializers import UserSerializer
+from .models import Feedback, Notification, Comment
 from apps.users.models import User
+from apps.users.serializers import UserSerializer
+from .search import KIND_CODES
 
 class CommentSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
@@ -21,6 +22,18 @@ class FeedbackSerializer(serializers.ModelSerializer):
         fields = ['id', 'sender', 'content', 'status', 'response', 'responded_by', 'is_read', 'created_at', 'updated_at', 'comments']
         read_only_fields = ['id', 'sender', 'status', 'responded_by', 'created_at', 'updated_at']
 
+class FeedbackListSerializer(serializers.ModelSerializer):
+    """Bản rút gọn cho danh sách: số bình luận và thời điểm bình luận cuối thay cho toàn bộ bình luận"""
+    sender = UserSerializer(read_only=True)
+    responded_by = UserSerializer(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    last_comment_at = serializers.DateTimeField(read_only=True)
+
+    class Meta:
+        model = Feedback
+        fields = ['id', 'sender', 'content', 'status', 'response', 'responded_by', 'is_read', 'created_at', 'updated_at',
+                  'comment_count', 'last_comment_at']
+
 class FeedbackCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Feedback
@@ -40,10 +53,14 @@ class NotificationSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if not user.is_authenticated:
             return False
-        read_status = obj.read_statuses.filter(user=user).first()
-        return read_status.is_read if read_status else False
+        # Danh sách thông báo đã tính sẵn is_read (Notification.with_read_state)
+        if hasattr(obj, 'is_read'):
+            return obj.is_read
+        return obj.is_read_by(user)
 
 class NotificationCreateSerializer(serializers.ModelSerializer):
+    # Gửi thông báo chỉ ghi một dòng Notification, không tạo trạng thái đọc cho từng người nhận:
+    # thông báo chưa có dấu đã đọc (NotificationReadStatus/NotificationReadWatermark) là chưa đọc
     class Meta:
         model = Notification
         fields = ['target_type', 'target_user', 'content']
@@ -58,18 +75,22 @@ class NotificationCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Target user should only be set for 'specific_user' target type.")
         return data
 
-    def create(self, validated_data):
-        notification = super().create(validated_data)
-        target_type = validated_data.get('target_type')
-        target_user = validated_data.get('target_user')
-
-        if target_type == 'specific_user':
-            NotificationReadStatus.objects.create(user=target_user, notification=notification)
-        else:
-            users = User.objects.filter(is_superuser=False)
-            if target_type != 'all':
-                users = users.filter(role=target_type)
-            for user in users:
-                NotificationReadStatus.objects.create(user=user, notification=notification)
-
-        return notification
\ No newline at end of file
+class NotificationBulkMarkReadSerializer(serializers.Serializer):
+    """Đánh dấu đã đọc hàng loạt: tất cả, theo danh sách id hoặc mọi thông báo tới thời điểm until"""
+    all = serializers.BooleanField(required=False, default=False)
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False, max_length=1000)
+    until = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        if sum([data['all'], 'ids' in data, 'until' in data]) != 1:
+            raise serializers.ValidationError("Chỉ định đúng một trong all, ids hoặc until.")
+        return data
+
+class MessageSearchSerializer(serializers.Serializer):
+    """Tham số tìm kiếm toàn văn (query string)"""
+    q = serializers.CharField(max_length=200)
+    kind = serializers.MultipleChoiceField(choices=list(KIND_CODES), required=False)
+    status = serializers.ChoiceField(choices=Feedback.STATUS_CHOICES, required=False)
+    role = serializers.ChoiceField(choices=User.ROLE_CHOICES, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+    offset = serializers.IntegerField(min_value=0, max_value=10000, default=0)
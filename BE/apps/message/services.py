@@ -0,0 +1,189 @@
+"""
+BỘ ĐẾM CHƯA ĐỌC
+- Bảng UnreadCounter giữ các bộ đếm theo khóa, được signal cập nhật bằng
+  UPDATE value = value + delta trong cùng transaction với thay đổi dữ liệu.
+- Số thông báo chưa đọc = tổng thông báo đã gửi tới người dùng (tất cả + vai trò + riêng)
+  trừ số thông báo người dùng đã đọc; số phản hồi chưa đọc đếm trực tiếp theo người gửi.
+- Đánh dấu đã đọc và dời mốc đã đọc cộng đúng số thông báo vừa chuyển sang đã đọc, chỉ đếm
+  trên các dòng bị ảnh hưởng. Đổi vai trò người dùng tính lại bộ đếm đã đọc của người đó;
+  đổi đối tượng nhận của thông báo chuyển bộ đếm đã gửi và chỉnh bộ đếm của người đã đọc nó.
+- API đếm chỉ đọc vài khóa bằng một truy vấn; rebuild_unread_counters tính lại từ database
+  (manage.py rebuild_unread_counters). Migration tạo bảng điền sẵn bộ đếm từ dữ liệu hiện có.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from apps.users.models import User
+from .models import Feedback, Notification, NotificationReadStatus, NotificationReadWatermark, UnreadCounter
+
+
+def sent_key(target_type, target_user_id=None):
+    """Khóa tổng số thông báo đã gửi tới một đối tượng nhận"""
+    if target_type == 'specific_user':
+        return f'notifications:user:{target_user_id}'
+    if target_type == 'all':
+        return 'notifications:all'
+    return f'notifications:role:{target_type}'
+
+
+def read_key(user_id):
+    return f'notifications_read:user:{user_id}'
+
+
+def feedback_key(user_id):
+    return f'feedbacks_unread:user:{user_id}'
+
+
+def add_to_counters(deltas):
+    """Cộng deltas ({khóa: số}) vào các bộ đếm, tạo bộ đếm nếu chưa có"""
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        if UnreadCounter.objects.filter(key=key).update(value=F('value') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                UnreadCounter.objects.create(key=key, value=delta)
+        except IntegrityError:
+            # Giao dịch khác vừa tạo bộ đếm
+            UnreadCounter.objects.filter(key=key).update(value=F('value') + delta)
+
+
+def count_read_notifications(user):
+    """Số thông báo người dùng đã đọc (dấu đã đọc riêng hoặc nằm dưới mốc đã đọc)"""
+    visible = Notification.visible_to(user)
+    return visible.count() - Notification.unread_for(user).count()
+
+
+def reset_read_counter(user):
+    """Tính lại số thông báo đã đọc của một người dùng trên toàn bộ lịch sử, dùng khi vai trò đổi"""
+    UnreadCounter.objects.update_or_create(key=read_key(user.id), defaults={'value': count_read_notifications(user)})
+
+
+def watermark_read_delta(user, before, after):
+    """
+    Số thông báo chuyển sang đã đọc (dương) hoặc chưa đọc (âm) khi mốc đã đọc dời từ before
+    tới after (None: không có mốc). Chỉ đếm trong khoảng giữa hai mốc, bỏ các thông báo đã có dấu đã đọc.
+    """
+    if before == after:
+        return 0
+    sign = 1 if before is None or (after is not None and after > before) else -1
+    low, high = (before, after) if sign > 0 else (after, before)
+    window = Notification.visible_to(user).filter(created_at__lte=high)
+    if low is not None:
+        window = window.filter(created_at__gt=low)
+    return sign * window.exclude(Exists(NotificationReadStatus.objects.filter(
+        notification=OuterRef('pk'), user=user, is_read=True,
+    ))).count()
+
+
+def audience(target_type, target_user_id=None):
+    """Điều kiện trên User: những người nhận được thông báo gửi tới đối tượng này"""
+    if target_type == 'all':
+        # Không dùng Q() rỗng: exclude(Q()) không loại gì
+        return Q(pk__isnull=False)
+    if target_type == 'specific_user':
+        return Q(id=target_user_id)
+    return Q(role=target_type)
+
+
+def retarget_notification_counters(notification, old_target_type, old_target_user_id):
+    """
+    Thông báo đổi đối tượng nhận: chuyển 1 từ bộ đếm đã gửi cũ sang mới, và với người đã đọc
+    nó (dấu đã đọc hoặc mốc đã đọc) trừ 1 nếu mất quyền xem, cộng 1 nếu mới nhận được.
+    """
+    old, new = audience(old_target_type, old_target_user_id), audience(notification.target_type, notification.target_user_id)
+    readers = User.objects.filter(
+        Q(notification_read_statuses__notification=notification, notification_read_statuses__is_read=True) |
+        Q(notification_read_watermark__read_until__gte=notification.created_at)
+    ).distinct()
+    deltas = defaultdict(int, {
+        sent_key(old_target_type, old_target_user_id): -1,
+    })
+    deltas[sent_key(notification.target_type, notification.target_user_id)] += 1
+    for user_id in readers.filter(old).exclude(new).values_list('id', flat=True):
+        deltas[read_key(user_id)] -= 1
+    for user_id in readers.filter(new).exclude(old).values_list('id', flat=True):
+        deltas[read_key(user_id)] += 1
+    add_to_counters(deltas)
+
+
+def mark_notifications_read(user, ids=None, until=None):
+    """
+    Đánh dấu đã đọc hàng loạt trong một transaction, trả về số thông báo còn chưa đọc.
+    - until: dời mốc đã đọc tới until (không lùi mốc, không vượt quá hiện tại).
+    - ids: một câu UPDATE cho các dấu chưa đọc sẵn có và một bulk_create(ignore_conflicts=True)
+      cho phần còn lại, chỉ với các thông báo người dùng nhận được.
+    Bộ đếm đã đọc của người dùng được cộng số thông báo vừa chuyển sang đã đọc trong cùng transaction.
+    """
+    with transaction.atomic():
+        if until is not None:
+            until = min(until, timezone.now())
+            watermark, created = NotificationReadWatermark.objects.select_for_update().get_or_create(
+                user=user, defaults={'read_until': until}
+            )
+            if not created and watermark.read_until < until:
+                # Signal post_save của mốc đã đọc cộng số thông báo trong khoảng vừa dời
+                watermark.read_until = until
+                watermark.save(update_fields=['read_until'])
+        if ids:
+            # Khóa bộ đếm đã đọc của người dùng: các lần đánh dấu song song của cùng người lần lượt
+            # chạy nên không đếm trùng một thông báo
+            UnreadCounter.objects.select_for_update().get_or_create(key=read_key(user.id))
+            newly_read = Notification.unread_for(user).filter(id__in=ids).count()
+            ids = list(Notification.visible_to(user).filter(id__in=ids).values_list('id', flat=True))
+            NotificationReadStatus.objects.filter(user=user, notification_id__in=ids, is_read=False).update(is_read=True)
+            NotificationReadStatus.objects.bulk_create(
+                (NotificationReadStatus(user=user, notification_id=notification_id, is_read=True) for notification_id in ids),
+                ignore_conflicts=True,
+            )
+            # UPDATE/bulk_create không phát signal
+            add_to_counters({read_key(user.id): newly_read})
+        return unread_counts(user)['new_notifications']
+
+
+def unread_counts(user):
+    """Số phản hồi và thông báo chưa đọc của người dùng, một truy vấn vào bảng bộ đếm"""
+    notification_keys = [sent_key('all'), sent_key(user.role), sent_key('specific_user', user.id)]
+    values = dict(UnreadCounter.objects.filter(
+        key__in=notification_keys + [read_key(user.id), feedback_key(user.id)]
+    ).values_list('key', 'value'))
+    sent = sum(values.get(key, 0) for key in notification_keys)
+    return {
+        # Không để số âm lọt ra API nếu bộ đếm lệch (sửa bằng rebuild_unread_counters)
+        'new_feedbacks': max(0, values.get(feedback_key(user.id), 0)) if user.role in ['student', 'teacher'] else 0,
+        'new_notifications': max(0, sent - values.get(read_key(user.id), 0)),
+    }
+
+
+def rebuild_unread_counters():
+    """Tính lại toàn bộ bộ đếm từ database, trả về số bộ đếm khác 0"""
+    counters = defaultdict(int)
+    with transaction.atomic():
+        for target_type, target_user_id, total in Notification.objects.values_list(
+            'target_type', 'target_user'
+        ).annotate(total=Count('id')).order_by():
+            counters[sent_key(target_type, target_user_id)] += total
+        # Dấu đã đọc của các thông báo mới hơn mốc đã đọc (nếu có) của người dùng
+        for user_id, total in NotificationReadStatus.objects.filter(is_read=True).filter(
+            Q(user__notification_read_watermark__isnull=True) |
+            Q(notification__created_at__gt=F('user__notification_read_watermark__read_until'))
+        ).values_list('user').annotate(total=Count('id')).order_by():
+            counters[read_key(user_id)] += total
+        for watermark in NotificationReadWatermark.objects.select_related('user'):
+            counters[read_key(watermark.user_id)] += Notification.visible_to(watermark.user).filter(
+                created_at__lte=watermark.read_until
+            ).count()
+        for sender_id, total in Feedback.objects.filter(is_read=False).values_list('sender').annotate(
+            total=Count('id')
+        ).order_by():
+            counters[feedback_key(sender_id)] += total
+
+        UnreadCounter.objects.all().delete()
+        UnreadCounter.objects.bulk_create(
+            (UnreadCounter(key=key, value=value) for key, value in counters.items() if value), batch_size=5000
+        )
+    return sum(1 for value in counters.values() if value)
@@ -0,0 +1,132 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from apps.users.models import User
+from .models import Comment, Feedback, Notification, NotificationReadStatus, NotificationReadWatermark
+from .search import (
+    comment_document, feedback_document, index_documents, notification_document, reindex_sender, remove_documents,
+)
+from .services import (
+    add_to_counters, feedback_key, read_key, reset_read_counter, retarget_notification_counters, sent_key,
+    watermark_read_delta,
+)
+
+
+@receiver(post_init, sender=Feedback)
+@receiver(post_init, sender=NotificationReadStatus)
+def remember_is_read(sender, instance, **kwargs):
+    """Giữ giá trị is_read lúc nạp để biết lần lưu có đổi trạng thái đọc hay không"""
+    # Đọc từ __dict__ để không nạp trường bị defer
+    instance._loaded_is_read = instance.__dict__.get('is_read')
+
+
+def is_read_delta(instance, created):
+    """+1 nếu lần lưu chuyển sang đã đọc, -1 nếu chuyển sang chưa đọc"""
+    before = False if created else getattr(instance, '_loaded_is_read', None)
+    instance._loaded_is_read = instance.is_read
+    return int(instance.is_read) - int(bool(before))
+
+
+@receiver(post_init, sender=Notification)
+def remember_target(sender, instance, **kwargs):
+    instance._loaded_target = (instance.__dict__.get('target_type'), instance.__dict__.get('target_user_id'))
+
+
+@receiver(post_save, sender=Notification)
+def count_sent_notification(sender, instance, created, **kwargs):
+    target = (instance.target_type, instance.target_user_id)
+    before, instance._loaded_target = instance._loaded_target, target
+    if created:
+        add_to_counters({sent_key(*target): 1})
+    elif before != target and before[0] is not None:
+        retarget_notification_counters(instance, *before)
+
+
+@receiver(post_delete, sender=Notification)
+def uncount_deleted_notification(sender, instance, **kwargs):
+    # Dấu đã đọc bị xóa theo (CASCADE) tự trừ bộ đếm đã đọc qua post_delete của chúng
+    add_to_counters({sent_key(instance.target_type, instance.target_user_id): -1})
+
+
+def under_watermark(read_status):
+    """Thông báo nằm dưới mốc đã đọc đã được tính là đã đọc"""
+    return NotificationReadWatermark.objects.filter(
+        user_id=read_status.user_id, read_until__gte=read_status.notification.created_at
+    ).exists()
+
+
+@receiver(post_save, sender=NotificationReadStatus)
+def count_read_notification(sender, instance, created, **kwargs):
+    delta = is_read_delta(instance, created)
+    if delta and not under_watermark(instance):
+        add_to_counters({read_key(instance.user_id): delta})
+
+
+@receiver(post_delete, sender=NotificationReadStatus)
+def uncount_deleted_read_status(sender, instance, **kwargs):
+    if instance.is_read and not under_watermark(instance):
+        add_to_counters({read_key(instance.user_id): -1})
+
+
+@receiver(post_init, sender=NotificationReadWatermark)
+def remember_read_until(sender, instance, **kwargs):
+    instance._loaded_read_until = instance.__dict__.get('read_until')
+
+
+@receiver(post_save, sender=NotificationReadWatermark)
+def count_watermark_move(sender, instance, created, **kwargs):
+    before = None if created else instance._loaded_read_until
+    instance._loaded_read_until = instance.read_until
+    add_to_counters({read_key(instance.user_id): watermark_read_delta(instance.user, before, instance.read_until)})
+
+
+@receiver(post_delete, sender=NotificationReadWatermark)
+def uncount_deleted_watermark(sender, instance, **kwargs):
+    add_to_counters({read_key(instance.user_id): watermark_read_delta(instance.user, instance.read_until, None)})
+
+
+@receiver(post_init, sender=User)
+def remember_role(sender, instance, **kwargs):
+    instance._loaded_role = instance.__dict__.get('role')
+
+
+@receiver(post_save, sender=User)
+def follow_role_change(sender, instance, created, **kwargs):
+    # Thông báo gửi theo vai trò mà người dùng nhận được đổi theo, bộ đếm đã đọc phải tính lại;
+    # vai trò người viết nằm trong chỉ mục tìm kiếm
+    before, instance._loaded_role = instance._loaded_role, instance.role
+    if not created and before is not None and before != instance.role:
+        reset_read_counter(instance)
+        reindex_sender(instance)
+
+
+@receiver(post_save, sender=Feedback)
+def count_unread_feedback(sender, instance, created, **kwargs):
+    # Phản hồi chưa đọc là tin mới với người gửi
+    delta = is_read_delta(instance, created)
+    if created:
+        delta = 0 if instance.is_read else -1
+    add_to_counters({feedback_key(instance.sender_id): -delta})
+
+
+@receiver(post_delete, sender=Feedback)
+def uncount_deleted_feedback(sender, instance, **kwargs):
+    if not instance.is_read:
+        add_to_counters({feedback_key(instance.sender_id): -1})
+
+
+@receiver(post_save, sender=Feedback)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Notification)
+def index_for_search(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields and not {'content', 'response', 'status'} & set(update_fields):
+        return
+    documents = {Feedback: feedback_document, Comment: comment_document, Notification: notification_document}
+    index_documents([documents[sender](instance)], replace=not created)
+
+
+@receiver(post_delete, sender=Feedback)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Notification)
+def remove_from_search(sender, instance, **kwargs):
+    remove_documents(sender._meta.model_name, [instance.id])
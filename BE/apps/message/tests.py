@@ -4,7 +4,17 @@ from rest_framework import status
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 from django.contrib.admin.sites import AdminSite
-from .models import Feedback, Comment, Notification, NotificationReadStatus
+from django.core.management import call_command
+from django.apps import apps as django_apps
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from importlib import import_module
+from io import StringIO
+from datetime import timedelta
+from django.utils import timezone
+from .models import Feedback, Comment, Notification, NotificationReadStatus, NotificationReadWatermark, UnreadCounter
+from .search import SEARCH_TABLE, rebuild_search_index, search
+from .services import feedback_key, mark_notifications_read, read_key, rebuild_unread_counters, unread_counts
 from .admin import FeedbackAdmin, CommentAdmin, NotificationAdmin, NotificationReadStatusAdmin
 from apps.users.models import StudentProfile, TeacherProfile, ManagerProfile
 
@@ -100,8 +110,8 @@ class FeedbackTests(APITestCase):
         self.authenticate(self.student)
         response = self.client.get(reverse('feedback-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['sender']['username'], 'student1')
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['sender']['username'], 'student1')
 
     def test_manager_can_view_all_feedbacks(self):
         """Kiểm tra ban quản lý thấy tất cả phản hồi"""
@@ -110,7 +120,41 @@ class FeedbackTests(APITestCase):
         self.authenticate(self.manager1)
         response = self.client.get(reverse('feedback-list'))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_feedback_list_comment_stats_with_constant_queries(self):
+        """Kiểm tra danh sách phản hồi kèm số bình luận, phân trang theo con trỏ và số truy vấn không đổi"""
+        feedbacks = [Feedback.objects.create(sender=self.student, content=f'Phản hồi {i}') for i in range(3)]
+        Comment.objects.create(feedback=feedbacks[0], sender=self.student, content='Bình luận 1')
+        last = Comment.objects.create(feedback=feedbacks[0], sender=self.manager1, content='Bình luận 2')
+        self.authenticate(self.manager1)
+
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(reverse('feedback-list'), {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = {item['id']: item for item in response.data['results']}
+        self.assertEqual(list(results), [feedbacks[2].id, feedbacks[1].id])
+        self.assertEqual(results[feedbacks[1].id]['comment_count'], 0)
+        self.assertIsNone(results[feedbacks[1].id]['last_comment_at'])
+        self.assertNotIn('comments', results[feedbacks[1].id])
+
+        response = self.client.get(response.data['next'])
+        item = response.data['results'][0]
+        self.assertEqual(item['id'], feedbacks[0].id)
+        self.assertEqual(item['comment_count'], 2)
+        self.assertEqual(item['last_comment_at'], last.created_at.astimezone(timezone.get_current_timezone()).isoformat())
+        self.assertIsNone(response.data['next'])
+
+        for i in range(10):
+            feedback = Feedback.objects.create(sender=self.teacher, content=f'Thêm {i}')
+            Comment.objects.create(feedback=feedback, sender=self.teacher, content='Bình luận')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('feedback-list'), {'page_size': 10})
+        self.assertEqual(len(response.data['results']), 10)
+        self.assertEqual(len(large), len(small))
+
+        response = self.client.get(reverse('feedback-comments', args=[feedbacks[0].id]))
+        self.assertEqual([c['content'] for c in response.data], ['Bình luận 1', 'Bình luận 2'])
 
     def test_manager_can_respond_to_feedback(self):
         """Kiểm tra ban quản lý có thể trả lời phản hồi"""
@@ -250,7 +294,10 @@ class NotificationTests(APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Notification.objects.count(), 1)
-        self.assertEqual(NotificationReadStatus.objects.count(), 3)  # student, teacher, manager
+        # Không tạo trạng thái đọc cho từng người nhận
+        self.assertEqual(NotificationReadStatus.objects.count(), 0)
+        for user in (self.student, self.teacher, self.manager1):
+            self.assertEqual(Notification.unread_for(user).count(), 1)
 
     def test_manager_can_send_notification_to_role(self):
         """Kiểm tra ban quản lý có thể gửi thông báo đến một nhóm"""
@@ -261,7 +308,9 @@ class NotificationTests(APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Notification.objects.count(), 1)
-        self.assertEqual(NotificationReadStatus.objects.count(), 1)  # Chỉ student
+        self.assertEqual(NotificationReadStatus.objects.count(), 0)
+        self.assertEqual(Notification.unread_for(self.student).count(), 1)
+        self.assertEqual(Notification.unread_for(self.teacher).count(), 0)  # Chỉ student
 
     def test_manager_can_send_notification_to_specific_user(self):
         """Kiểm tra ban quản lý có thể gửi thông báo đến một người dùng cụ thể"""
@@ -273,8 +322,9 @@ class NotificationTests(APITestCase):
         })
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Notification.objects.count(), 1)
-        self.assertEqual(NotificationReadStatus.objects.count(), 1)
-        self.assertEqual(NotificationReadStatus.objects.first().user, self.student)
+        self.assertEqual(NotificationReadStatus.objects.count(), 0)
+        self.assertEqual(Notification.unread_for(self.student).count(), 1)
+        self.assertEqual(Notification.unread_for(self.teacher).count(), 0)
 
     def test_student_cannot_send_notification(self):
         """Kiểm tra sinh viên không thể gửi thông báo"""
@@ -332,6 +382,57 @@ class NotificationTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['new_notifications'], 1)
 
+    def test_send_to_all_is_constant_queries(self):
+        """Kiểm tra gửi thông báo cho tất cả có số truy vấn không phụ thuộc số người dùng"""
+        self.authenticate(self.manager1)
+        self.client.post(reverse('notification-create'), {'target_type': 'all', 'content': 'Bảo trì.'})
+        # INSERT thông báo, cập nhật bộ đếm, thêm vào chỉ mục tìm kiếm (trong savepoint),
+        # hai truy vấn is_read của người gửi trong response
+        with self.assertNumQueries(7):
+            self.client.post(reverse('notification-create'), {'target_type': 'all', 'content': 'Bảo trì lần 2.'})
+        User.objects.bulk_create(User(username=f'student_extra{i}', email=f'student_extra{i}@hcmut.edu.vn',
+                                      role='student') for i in range(20))
+        with self.assertNumQueries(7):
+            self.client.post(reverse('notification-create'), {'target_type': 'all', 'content': 'Bảo trì lần 3.'})
+
+    def test_watermark_marks_older_notifications_read(self):
+        """Kiểm tra mốc đã đọc áp dụng cho thông báo cũ, thông báo mới hơn vẫn chưa đọc"""
+        old = Notification.objects.create(sender=self.manager1, target_type='all', content='Thông báo cũ')
+        NotificationReadWatermark.objects.create(user=self.student, read_until=old.created_at)
+        new = Notification.objects.create(sender=self.manager1, target_type='student', content='Thông báo mới')
+        self.assertTrue(old.is_read_by(self.student))
+        self.assertFalse(new.is_read_by(self.student))
+        self.assertFalse(old.is_read_by(self.teacher))
+        self.assertEqual(list(Notification.unread_for(self.student)), [new])
+        self.authenticate(self.student)
+        response = self.client.get(reverse('new-feedback-notification-count'))
+        self.assertEqual(response.data['new_notifications'], 1)
+
+    def test_notification_list_annotates_is_read_with_constant_queries(self):
+        """Kiểm tra danh sách thông báo tính is_read trong truy vấn, số truy vấn mỗi trang không đổi"""
+        self.authenticate(self.student)
+        Notification.objects.create(sender=self.manager1, target_type='all', content='Thông báo 0')
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('notification-list'))
+        notifications = [Notification.objects.create(sender=self.manager1, content=f'Thông báo {i}', **target)
+                         for i, target in enumerate([{'target_type': 'all'}, {'target_type': 'student'},
+                                                     {'target_type': 'teacher'},
+                                                     {'target_type': 'specific_user', 'target_user': self.student},
+                                                     {'target_type': 'specific_user', 'target_user': self.teacher}] * 3)]
+        NotificationReadStatus.objects.create(user=self.student, notification=notifications[1], is_read=True)
+        NotificationReadStatus.objects.create(user=self.teacher, notification=notifications[3], is_read=True)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('notification-list'))
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(response.data['count'], 10)
+        expected = Notification.visible_to(self.student).order_by('-created_at', '-id')[:10]
+        self.assertEqual([row['id'] for row in response.data['results']], [n.id for n in expected])
+        self.assertEqual([row['is_read'] for row in response.data['results']],
+                         [n.is_read_by(self.student) for n in expected])
+        specific = [row for row in response.data['results'] if row['target_type'] == 'specific_user']
+        self.assertTrue(specific)
+        self.assertTrue(all(row['target_user']['id'] == self.student.id for row in specific))
+
     def test_notification_pagination(self):
         """Kiểm tra phân trang cho danh sách thông báo"""
         for i in range(15):
@@ -347,6 +448,234 @@ class NotificationTests(APITestCase):
         self.assertEqual(len(response.data['results']), 10)  # Mặc định page_size=10
         self.assertIsNotNone(response.data['next'])
 
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.student = User.objects.create_user(username='student1', email='student1@hcmut.edu.vn', role='student')
+        self.teacher = User.objects.create_user(username='teacher1', email='teacher1@hcmut.edu.vn', role='teacher')
+        self.manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        self.users = [self.student, self.teacher, self.manager]
+
+    def assertCountersMatchDatabase(self):
+        for user in self.users:
+            expected_feedbacks = Feedback.objects.filter(sender=user, is_read=False).count()
+            self.assertEqual(unread_counts(user), {
+                'new_feedbacks': expected_feedbacks if user.role in ['student', 'teacher'] else 0,
+                'new_notifications': Notification.unread_for(user).count(),
+            }, user.username)
+
+    def test_counters_follow_changes_and_rebuild(self):
+        """Kiểm tra bộ đếm khớp với database sau các thao tác và sau khi tính lại bằng lệnh quản lý"""
+        self.client.force_authenticate(user=self.manager)
+        for target in ({'target_type': 'all'}, {'target_type': 'student'}, {'target_type': 'teacher'},
+                       {'target_type': 'specific_user', 'target_user': self.student.id}):
+            self.client.post(reverse('notification-create'), {**target, 'content': 'Thông báo'})
+        self.client.force_authenticate(user=self.student)
+        feedback_id = self.client.post(reverse('feedback-create'), {'content': 'Phản hồi 1'}).data['id']
+        self.client.post(reverse('feedback-create'), {'content': 'Phản hồi 2'})
+        self.client.post(reverse('feedback-mark-read', args=[feedback_id]))
+        self.client.post(reverse('feedback-mark-read', args=[feedback_id]))
+        for notification in Notification.visible_to(self.student)[:2]:
+            self.client.post(reverse('notification-mark-read', args=[notification.id]))
+            self.client.post(reverse('notification-mark-read', args=[notification.id]))
+        self.assertCountersMatchDatabase()
+        self.assertEqual(unread_counts(self.student), {'new_feedbacks': 1, 'new_notifications': 1})
+
+        # Trả lời phản hồi không đổi trạng thái đọc; mốc đã đọc; xóa thông báo
+        self.client.force_authenticate(user=self.manager)
+        self.client.put(reverse('feedback-respond', args=[feedback_id]), {'response': 'Đã xử lý.'})
+        self.assertTrue(Feedback.objects.get(id=feedback_id).is_read)
+        NotificationReadWatermark.objects.create(
+            user=self.teacher, read_until=Notification.objects.get(target_type='all').created_at
+        )
+        Notification.objects.filter(target_type='specific_user').delete()
+        self.assertCountersMatchDatabase()
+        self.assertEqual(unread_counts(self.student)['new_feedbacks'], 1)
+
+        UnreadCounter.objects.all().delete()
+        call_command('rebuild_unread_counters', stdout=StringIO())
+        self.assertCountersMatchDatabase()
+
+        # Migration tạo bảng bộ đếm điền sẵn từ dữ liệu hiện có
+        UnreadCounter.objects.all().delete()
+        migration = import_module('apps.message.migrations.0004_unread_counter')
+        migration.build_unread_counters(django_apps, None)
+        self.assertCountersMatchDatabase()
+
+    def test_negative_feedback_counter_clamped(self):
+        """Kiểm tra bộ đếm phản hồi bị lệch âm không trả số âm ra API"""
+        UnreadCounter.objects.create(key=feedback_key(self.student.id), value=-1)
+        self.assertEqual(unread_counts(self.student)['new_feedbacks'], 0)
+
+    def test_bulk_mark_read(self):
+        """Kiểm tra đánh dấu đã đọc theo danh sách id, tới một thời điểm và tất cả, bộ đếm luôn khớp"""
+        now = timezone.now()
+        notifications = []
+        for i in range(6):
+            notification = Notification.objects.create(sender=self.manager, target_type='student', content=f'TB {i}')
+            Notification.objects.filter(id=notification.id).update(created_at=now - timedelta(hours=10 - i))
+            notifications.append(notification)
+        teacher_only = Notification.objects.create(sender=self.manager, target_type='teacher', content='Giảng viên')
+        url = reverse('notification-mark-read-bulk')
+        self.client.force_authenticate(user=self.student)
+
+        ids = [notifications[0].id, notifications[1].id, teacher_only.id]
+        for _ in range(2):
+            response = self.client.post(url, {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['new_notifications'], 4)
+        self.assertEqual(NotificationReadStatus.objects.filter(user=self.student).count(), 2)
+        self.assertCountersMatchDatabase()
+
+        until = (now - timedelta(hours=6, minutes=30)).strftime('%Y-%m-%dT%H:%M:%S%z')
+        response = self.client.post(url, {'until': until}, format='json')
+        self.assertEqual(response.data['new_notifications'], 2)
+        self.assertCountersMatchDatabase()
+
+        response = self.client.post(url, {'all': True}, format='json')
+        self.assertEqual(response.data['new_notifications'], 0)
+        self.assertCountersMatchDatabase()
+        Notification.objects.create(sender=self.manager, target_type='all', content='Mới')
+        self.assertEqual(unread_counts(self.student)['new_notifications'], 1)
+
+        response = self.client.post(url, {'all': True, 'ids': ids}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_mark_read_adds_to_counter_without_recount(self):
+        """Kiểm tra đánh dấu đã đọc và dời mốc chỉ cộng số thông báo vừa đọc vào bộ đếm, không đếm lại lịch sử"""
+        now = timezone.now()
+        notifications = Notification.objects.bulk_create(
+            Notification(sender=self.manager, target_type='all', content=f'TB {i}') for i in range(6)
+        )
+        for i, notification in enumerate(notifications):
+            Notification.objects.filter(id=notification.id).update(created_at=now - timedelta(hours=10 - i))
+        rebuild_unread_counters()
+        # Bộ đếm lệch có chủ đích: được cộng thêm thì độ lệch giữ nguyên, tính lại thì mất
+        UnreadCounter.objects.create(key=read_key(self.student.id), value=-100)
+        mark_notifications_read(self.student, ids=[notifications[0].id, notifications[1].id])
+        mark_notifications_read(self.student, ids=[notifications[1].id, notifications[2].id])
+        self.assertEqual(UnreadCounter.objects.get(key=read_key(self.student.id)).value, -100 + 3)
+        mark_notifications_read(self.student, until=now - timedelta(hours=6, minutes=30))
+        self.assertEqual(UnreadCounter.objects.get(key=read_key(self.student.id)).value, -100 + 4)
+        mark_notifications_read(self.student, until=now)
+        self.assertEqual(UnreadCounter.objects.get(key=read_key(self.student.id)).value, -100 + 6)
+
+    def test_counters_follow_role_and_target_changes(self):
+        """Kiểm tra bộ đếm khớp database khi người dùng đổi vai trò và khi thông báo đổi đối tượng nhận"""
+        to_students = Notification.objects.create(sender=self.manager, target_type='student', content='Sinh viên')
+        to_all = Notification.objects.create(sender=self.manager, target_type='all', content='Tất cả')
+        mark_notifications_read(self.student, ids=[to_students.id, to_all.id])
+        mark_notifications_read(self.teacher, until=timezone.now())
+        self.assertCountersMatchDatabase()
+
+        self.student.role = 'teacher'
+        self.student.save()
+        self.assertCountersMatchDatabase()
+        self.student.role = 'student'
+        self.student.save()
+        self.assertCountersMatchDatabase()
+
+        for target in ({'target_type': 'teacher'}, {'target_type': 'specific_user', 'target_user': self.manager},
+                       {'target_type': 'student', 'target_user': None}, {'target_type': 'all'}):
+            for field, value in target.items():
+                setattr(to_all, field, value)
+            to_all.save()
+            self.assertCountersMatchDatabase()
+
+    def test_count_endpoint_is_one_query(self):
+        """Kiểm tra API đếm chưa đọc chỉ đọc bộ đếm, không phụ thuộc số thông báo"""
+        Notification.objects.bulk_create(
+            Notification(sender=self.manager, target_type='all', content=f'Thông báo {i}') for i in range(50)
+        )
+        rebuild_unread_counters()
+        self.client.force_authenticate(user=self.student)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('new-feedback-notification-count'))
+        self.assertEqual(response.data, {'new_feedbacks': 0, 'new_notifications': 50})
+
+class MessageSearchTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.student = User.objects.create_user(username='student1', email='student1@hcmut.edu.vn', role='student')
+        self.teacher = User.objects.create_user(username='teacher1', email='teacher1@hcmut.edu.vn', role='teacher')
+        self.manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+
+    def search_ids(self, **params):
+        response = self.client.get(reverse('message-search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [(item['kind'], item['id']) for item in response.data['results']]
+
+    def test_search_ranks_and_filters(self):
+        """Kiểm tra tìm kiếm toàn văn xếp hạng, không phân biệt dấu và lọc theo loại, trạng thái, vai trò"""
+        wifi = Feedback.objects.create(sender=self.student, content='Wifi phòng tự học rất chậm, wifi hay mất.')
+        projector = Feedback.objects.create(sender=self.teacher, content='Máy chiếu phòng học hỏng.')
+        comment = Comment.objects.create(feedback=wifi, sender=self.manager, content='Đã báo bộ phận wifi.')
+        notification = Notification.objects.create(sender=self.manager, target_type='all',
+                                                   content='Bảo trì wifi toàn bộ phòng tự học.')
+        self.client.force_authenticate(user=self.manager)
+
+        self.assertEqual(self.search_ids(q='WIFI')[0], ('feedback', wifi.id))
+        self.assertCountEqual(self.search_ids(q='wifi'),
+                              [('feedback', wifi.id), ('comment', comment.id), ('notification', notification.id)])
+        self.assertEqual(self.search_ids(q='phong tu hoc', kind='notification'), [('notification', notification.id)])
+        self.assertEqual(self.search_ids(q='phòng', role='teacher'), [('feedback', projector.id)])
+        self.assertEqual(self.search_ids(q='wifi', role='manager', kind=['comment', 'feedback']),
+                         [('comment', comment.id)])
+
+        # Chỉ mục theo kịp khi trả lời, sửa và xóa
+        self.client.put(reverse('feedback-respond', args=[projector.id]), {'response': 'Đã thay bóng đèn.'})
+        self.assertEqual(self.search_ids(q='bóng đèn', status='responded'), [('feedback', projector.id)])
+        self.assertEqual(self.search_ids(q='phòng', status='pending'), [('feedback', wifi.id)])
+        notification.content = 'Lịch bảo trì điều hòa.'
+        notification.save()
+        wifi.delete()
+        self.assertEqual(self.search_ids(q='wifi'), [])
+        self.assertEqual(self.search_ids(q='điều hòa'), [('notification', notification.id)])
+        self.assertEqual(self.search_ids(q='"*()'), [])
+        self.assertEqual(rebuild_search_index(), 2)
+        self.assertEqual(search('may chieu')[0]['snippet'], '[Máy] [chiếu] phòng học hỏng. Đã thay bóng đèn.')
+
+    def test_role_change_reindexes_sender(self):
+        """Kiểm tra người viết đổi vai trò thì bộ lọc role trong chỉ mục theo vai trò mới"""
+        feedback = Feedback.objects.create(sender=self.student, content='Wifi phòng tự học rất chậm.')
+        comment = Comment.objects.create(feedback=feedback, sender=self.student, content='Wifi vẫn chậm.')
+        self.client.force_authenticate(user=self.manager)
+        self.student.role = 'teacher'
+        self.student.save()
+        self.assertEqual(self.search_ids(q='wifi', role='student'), [])
+        self.assertCountEqual(self.search_ids(q='wifi', role='teacher'), [('feedback', feedback.id), ('comment', comment.id)])
+        self.assertEqual(self.search_ids(q='wifi', role='teacher', status='pending'), [('feedback', feedback.id)])
+
+    def test_migration_builds_same_index_as_rebuild(self):
+        """Kiểm tra migration 0007 (bản chụp độc lập với mã hiện tại) dựng chỉ mục giống rebuild_search_index"""
+        feedback = Feedback.objects.create(sender=self.student, content='Wifi chậm.', response='Đã sửa.',
+                                           status='responded')
+        Comment.objects.create(feedback=feedback, sender=self.manager, content='Đã báo bộ phận wifi.')
+        Notification.objects.create(sender=self.manager, target_type='all', content='Bảo trì wifi.')
+
+        def index_rows():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT rowid, body, tags, kind, object_id, status, role FROM {SEARCH_TABLE} ORDER BY rowid")
+                return cursor.fetchall()
+
+        rebuild_search_index()
+        expected = index_rows()
+        migration = import_module('apps.message.migrations.0007_message_search')
+        # Không vào context của schema editor: SQLite không cho dùng nó trong transaction của test
+        migration.create_search_index(django_apps, connection.schema_editor(atomic=False))
+        self.assertEqual(index_rows(), expected)
+        self.assertEqual(len(expected), 3)
+
+    def test_search_requires_manager(self):
+        """Kiểm tra chỉ ban quản lý được tìm kiếm và tham số không hợp lệ bị từ chối"""
+        self.client.force_authenticate(user=self.student)
+        self.assertEqual(self.client.get(reverse('message-search'), {'q': 'wifi'}).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.manager)
+        for params in ({}, {'q': 'wifi', 'kind': 'booking'}, {'q': 'wifi', 'limit': 1000}):
+            self.assertEqual(self.client.get(reverse('message-search'), params).status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
 class AdminTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -382,6 +711,18 @@ class AdminTests(TestCase):
             last_name='User'
         )
 
+    def test_admin_search_falls_back_to_substring(self):
+        """Kiểm tra ô tìm kiếm admin dùng chỉ mục theo từ, không khớp từ nào thì tìm chuỗi con như cũ"""
+        wifi = Feedback.objects.create(sender=self.student, content='Wifi phòng tự học rất chậm.')
+        projector = Feedback.objects.create(sender=self.student, content='Máy chiếu hỏng.')
+        feedback_admin = FeedbackAdmin(Feedback, self.admin_site)
+        request = self.client.request().wsgi_request
+        request.user = self.superuser
+        queryset = feedback_admin.get_queryset(request)
+        for term, expected in (('phong tu hoc', [wifi]), ('Wif', [wifi]), ('chiế', [projector]), ('student1', [wifi, projector])):
+            results, _ = feedback_admin.get_search_results(request, queryset, term)
+            self.assertCountEqual(list(results), expected, term)
+
     def test_feedback_admin_queryset_superuser(self):
         """Kiểm tra superuser thấy tất cả phản hồi trong admin"""
         Feedback.objects.create(sender=self.student, content='Phản hồi 1')
@@ -436,4 +777,20 @@ class AdminTests(TestCase):
         request = self.client.request().wsgi_request
         request.user = self.superuser
         qs = notification_admin.get_queryset(request)
-        self.assertEqual(qs.count(), 1)
\ No newline at end of file
+        self.assertEqual(qs.count(), 1)
+
+    def test_feedback_admin_search_uses_full_text_index(self):
+        """Kiểm tra ô tìm kiếm admin dùng chỉ mục toàn văn và tên đăng nhập người gửi"""
+        wifi = Feedback.objects.create(sender=self.student, content='Wifi rất chậm')
+        Feedback.objects.create(sender=self.student, content='Máy chiếu hỏng', response='Đã sửa wifi')
+        Comment.objects.create(feedback=wifi, sender=self.manager1, content='Máy chiếu')
+        feedback_admin = FeedbackAdmin(Feedback, self.admin_site)
+        request = self.client.request().wsgi_request
+        request.user = self.superuser
+        qs, may_have_duplicates = feedback_admin.get_search_results(request, Feedback.objects.all(), 'wifi')
+        self.assertEqual(qs.count(), 2)
+        self.assertFalse(may_have_duplicates)
+        qs, _ = feedback_admin.get_search_results(request, Feedback.objects.all(), 'may chieu')
+        self.assertEqual([feedback.content for feedback in qs], ['Máy chiếu hỏng'])
+        qs, _ = feedback_admin.get_search_results(request, Feedback.objects.all(), 'student1')
+        self.assertEqual(qs.count(), 2)
@@ -1,8 +1,9 @@
 from django.urls import path
 from .views import (
     FeedbackCreateView, FeedbackListView, FeedbackRespondView, FeedbackMarkReadView,
-    CommentCreateView,
-    NotificationCreateView, NotificationListView, NotificationMarkReadView, NewFeedbackNotificationCountView
+    CommentCreateView, FeedbackCommentsList,
+    NotificationCreateView, NotificationListView, NotificationMarkReadView, NotificationBulkMarkReadView,
+    MessageSearchView, NewFeedbackNotificationCountView
 )
 
 urlpatterns = [
@@ -11,9 +12,12 @@ urlpatterns = [
     path('feedbacks/<int:pk>/respond/', FeedbackRespondView.as_view(), name='feedback-respond'),
     path('feedbacks/<int:pk>/mark-read/', FeedbackMarkReadView.as_view(), name='feedback-mark-read'),
     path('feedbacks/<int:pk>/comments/', CommentCreateView.as_view(), name='comment-create'),
+    path('feedbacks/<int:pk>/all-comments/', FeedbackCommentsList.as_view(), name='feedback-comments'),
     
     path('notifications/', NotificationCreateView.as_view(), name='notification-create'),
     path('notifications/list/', NotificationListView.as_view(), name='notification-list'),
     path('notifications/<int:pk>/mark-read/', NotificationMarkReadView.as_view(), name='notification-mark-read'),
+    path('notifications/mark-read/', NotificationBulkMarkReadView.as_view(), name='notification-mark-read-bulk'),
+    path('search/', MessageSearchView.as_view(), name='message-search'),
     path('new-count/', NewFeedbackNotificationCountView.as_view(), name='new-feedback-notification-count'),
 ]
\ No newline at end of file
@@ -2,11 +2,17 @@ from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 from .models import Feedback, Notification , NotificationReadStatus, Comment
-from .serializers import FeedbackSerializer, FeedbackCreateSerializer, NotificationSerializer, NotificationCreateSerializer, CommentSerializer
+from .serializers import (
+    FeedbackSerializer, FeedbackListSerializer, FeedbackCreateSerializer, NotificationSerializer, NotificationCreateSerializer,
+    NotificationBulkMarkReadSerializer, CommentSerializer, MessageSearchSerializer,
+)
 from .permissions import IsStudentOrTeacher, IsManager, IsSenderOrManager, IsManagerForNotification, CanCommentOnFeedback
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from .search import search
+from .services import mark_notifications_read, unread_counts
 
 class FeedbackCreateView(APIView):
     """
@@ -18,26 +24,38 @@ class FeedbackCreateView(APIView):
     def post(self, request):
         serializer = FeedbackCreateSerializer(data=request.data)
         if serializer.is_valid():
-            feedback = serializer.save(sender=request.user)
+            # Bộ đếm chưa đọc được cập nhật (qua signal) trong cùng transaction
+            with transaction.atomic():
+                feedback = serializer.save(sender=request.user)
             return Response(FeedbackSerializer(feedback).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class FeedbackListView(APIView):
+class FeedbackCursorPagination(CursorPagination):
+    """Phân trang theo con trỏ (created_at, id): không COUNT(*) và không OFFSET"""
+    ordering = ('-created_at', '-id')
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class FeedbackListView(ListAPIView):
     """
     API để xem danh sách phản hồi.
     - GET /api/messages/feedbacks/list/
     - Sinh viên/Giảng viên: Xem phản hồi của chính họ.
     - Ban quản lý: Xem tất cả phản hồi.
+    - Mỗi phản hồi chỉ kèm comment_count và last_comment_at; toàn bộ bình luận
+      lấy qua GET /api/messages/feedbacks/<id>/all-comments/.
     """
     permission_classes = [IsSenderOrManager]
+    serializer_class = FeedbackListSerializer
+    pagination_class = FeedbackCursorPagination
 
-    def get(self, request):
-        if request.user.role == 'manager':
+    def get_queryset(self):
+        if self.request.user.role == 'manager':
             feedbacks = Feedback.objects.all()
         else:
-            feedbacks = Feedback.objects.filter(sender=request.user)
-        serializer = FeedbackSerializer(feedbacks, many=True)
-        return Response(serializer.data)
+            feedbacks = Feedback.objects.filter(sender=self.request.user)
+        return Feedback.with_comment_stats(feedbacks)
 
 class FeedbackRespondView(APIView):
     """
@@ -47,19 +65,22 @@ class FeedbackRespondView(APIView):
     permission_classes = [IsManager]
 
     def put(self, request, pk):
-        try:
-            feedback = Feedback.objects.get(pk=pk)
-        except Feedback.DoesNotExist:
-            return Response({'error': 'Feedback not found'}, status=status.HTTP_404_NOT_FOUND)
-
         response_text = request.data.get('response')
-        if not response_text:
-            return Response({'error': 'Response text is required'}, status=status.HTTP_400_BAD_REQUEST)
-
-        feedback.response = response_text
-        feedback.status = 'responded'
-        feedback.responded_by = request.user
-        feedback.save()
+        with transaction.atomic():
+            # Khóa dòng: save() ghi lại cả is_read, lượt đánh dấu đã đọc đồng thời không bị ghi đè
+            # làm lệch bộ đếm chưa đọc
+            try:
+                feedback = Feedback.objects.select_for_update().get(pk=pk)
+            except Feedback.DoesNotExist:
+                return Response({'error': 'Feedback not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if not response_text:
+                return Response({'error': 'Response text is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+            feedback.response = response_text
+            feedback.status = 'responded'
+            feedback.responded_by = request.user
+            feedback.save()
 
         return Response(FeedbackSerializer(feedback).data)
 
@@ -71,16 +92,18 @@ class FeedbackMarkReadView(APIView):
     permission_classes = [IsSenderOrManager]
 
     def post(self, request, pk):
-        try:
-            feedback = Feedback.objects.get(pk=pk)
-        except Feedback.DoesNotExist:
-            return Response({'error': 'Feedback not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        if request.user.role != 'manager' and feedback.sender != request.user:
-            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
-
-        feedback.is_read = True
-        feedback.save()
+        with transaction.atomic():
+            # Khóa dòng để hai lượt đánh dấu đồng thời không cùng trừ bộ đếm chưa đọc
+            try:
+                feedback = Feedback.objects.select_for_update().get(pk=pk)
+            except Feedback.DoesNotExist:
+                return Response({'error': 'Feedback not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            if request.user.role != 'manager' and feedback.sender != request.user:
+                return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+
+            feedback.is_read = True
+            feedback.save()
         return Response({'message': 'Feedback marked as read'})
 
 class CommentCreateView(APIView):
@@ -115,7 +138,7 @@ class FeedbackCommentsList(APIView):
     """
     API endpoint để hiển thị tất cả bình luận của một phản hồi cụ thể
     cho người gửi phản hồi và quản trị viên.
-    - GET /api/feedback/<int:feedback_pk>/all-comments/
+    - GET /api/messages/feedbacks/<id>/all-comments/
     """
     permission_classes = [CanCommentOnFeedback]
 
@@ -130,7 +153,7 @@ class FeedbackCommentsList(APIView):
         is_manager = (request.user.role == 'manager') 
 
         if is_sender or is_manager:
-            comments = Comment.objects.filter(feedback=feedback).order_by('created_at')
+            comments = Comment.objects.filter(feedback=feedback).select_related('sender').order_by('created_at')
             serializer = CommentSerializer(comments, many=True)
             return Response(serializer.data)
         else:
@@ -149,7 +172,8 @@ class NotificationCreateView(APIView):
     def post(self, request):
         serializer = NotificationCreateSerializer(data=request.data)
         if serializer.is_valid():
-            notification = serializer.save(sender=request.user)
+            with transaction.atomic():
+                notification = serializer.save(sender=request.user)
             # Truyền context khi khởi tạo NotificationSerializer
             return Response(NotificationSerializer(notification, context={'request': request}).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -193,11 +217,16 @@ class NotificationListView(ListAPIView):
             # (sẽ được xử lý trong get())
             return Notification.objects.none()
 
-        return Notification.objects.filter(
-            models.Q(target_type='all') |
-            models.Q(target_type=user.role) |
-            models.Q(target_type='specific_user', target_user=user)
-        ).distinct()
+        # OR của các nhánh không cần distinct() (không join), mỗi nhánh dùng một chỉ mục
+        return Notification.visible_to(user).order_by('-created_at', '-id')
+
+    def paginate_queryset(self, queryset):
+        # Phân trang trên id trước, chỉ nạp quan hệ và is_read cho các dòng của trang
+        page = super().paginate_queryset(queryset.values_list('id', flat=True))
+        if page is None:
+            return None
+        rows = Notification.with_read_state(Notification.objects.filter(id__in=page), self.request.user).in_bulk()
+        return [rows[notification_id] for notification_id in page]
 
     def get(self, request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -225,11 +254,47 @@ class NotificationMarkReadView(APIView):
                 (notification.target_type == 'specific_user' and notification.target_user == user)):
             return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
-        read_status, created = NotificationReadStatus.objects.get_or_create(user=user, notification=notification)
-        read_status.is_read = True
-        read_status.save()
+        # Dấu đã đọc chỉ được tạo tại đây, khi người dùng đánh dấu
+        NotificationReadStatus.objects.update_or_create(user=user, notification=notification, defaults={'is_read': True})
         return Response({'message': 'Notification marked as read'})
 
+class NotificationBulkMarkReadView(APIView):
+    """
+    API để đánh dấu nhiều thông báo là đã đọc trong một request.
+    - POST /api/messages/notifications/mark-read/
+    - {"all": true}: tất cả; {"ids": [...]}: theo danh sách; {"until": "..."}: mọi thông báo tới thời điểm until.
+    """
+    def post(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        serializer = NotificationBulkMarkReadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        new_notifications = mark_notifications_read(
+            user, ids=data.get('ids'), until=timezone.now() if data['all'] else data.get('until'),
+        )
+        return Response({'message': 'Notifications marked as read', 'new_notifications': new_notifications})
+
+class MessageSearchView(APIView):
+    """
+    API để ban quản lý tìm kiếm toàn văn trên phản hồi, bình luận và thông báo.
+    - GET /api/messages/search/?q=...&kind=feedback&kind=comment&status=pending&role=student&limit=20&offset=0
+    - Kết quả liên quan nhất trước; status lọc trạng thái phản hồi, role lọc vai trò người viết.
+    """
+    permission_classes = [IsManager]
+
+    def get(self, request):
+        serializer = MessageSearchSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        results = search(data['q'], kinds=sorted(data.get('kind', [])), status=data.get('status'),
+                         role=data.get('role'), limit=data['limit'], offset=data['offset'])
+        return Response({'results': results})
+
 class NewFeedbackNotificationCountView(APIView):
     """
     API để kiểm tra số lượng phản hồi và thông báo mới chưa đọc.
@@ -240,24 +305,5 @@ class NewFeedbackNotificationCountView(APIView):
         if not user.is_authenticated:
             return Response({'error': 'Authentication required'}, status=status.HTTP_401_UNAUTHORIZED)
 
-        # Số lượng phản hồi chưa đọc
-        feedback_count = 0
-        if user.role in ['student', 'teacher']:
-            feedback_count = Feedback.objects.filter(sender=user, is_read=False).count()
-
-        # Số lượng thông báo chưa đọc
-        notifications = Notification.objects.filter(
-            models.Q(target_type='all') |
-            models.Q(target_type=user.role) |
-            models.Q(target_type='specific_user', target_user=user)
-        ).distinct()
-        notification_count = 0
-        for notification in notifications:
-            read_status = notification.read_statuses.filter(user=user).first()
-            if not read_status or not read_status.is_read:
-                notification_count += 1
-
-        return Response({
-            'new_feedbacks': feedback_count,
-            'new_notifications': notification_count
-        })
\ No newline at end of file
+        # Đọc bộ đếm chưa đọc (một truy vấn), không đếm lại lịch sử thông báo
+        return Response(unread_counts(user))
\ No newline at end of file
@@ -0,0 +1,158 @@
+import asyncio
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.asgi import get_asgi_application
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.bookings.management.benchmark import BenchmarkCommand, seed_bookings, seed_spaces, seed_users
+from apps.bookings.models import Booking, Equipment, EquipmentType, QRCode
+from apps.bookings.serializers import BookingSerializer
+from apps.resources.models import StudySpace
+from apps.resources.serializers import StudySpaceUsageSerializer
+from apps.resources.services import _publish
+
+
+class Command(BenchmarkCommand):
+    help = "Benchmark các API của ứng dụng resources (tìm phòng trống, trạng thái phòng)."
+    scenarios = ('search', 'usage', 'stream')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--subscribers', type=int, default=5000, help='Số client SSE giữ kết nối.')
+
+    def bench_search(self):
+        """Tìm phòng trống: vòng lặp check_room_availability cũ so với truy vấn tập hợp."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(1000))
+        seed_bookings(self.scaled(1_000_000), spaces, users)
+        # Khung giờ trùng với một phần các booking tương lai
+        start_time = timezone.now() + timedelta(days=10)
+        end_time = start_time + timedelta(hours=3)
+        candidates = StudySpace.objects.filter(space_type='INDIVIDUAL')
+
+        self.section(f"{len(spaces)} phòng, {Booking.objects.count()} booking")
+
+        def per_space_loop():
+            return [space for space in candidates.all()
+                    if Booking.check_room_availability(space, start_time, end_time)]
+
+        def set_based():
+            return list(Booking.available_spaces(candidates.all(), start_time, end_time))
+
+        assert {s.id for s in per_space_loop()} == {s.id for s in set_based()}
+        self.measure('vòng lặp từng phòng (cũ)', per_space_loop)
+        self.measure('available_spaces (một truy vấn)', set_based)
+
+    def bench_usage(self):
+        """GET /api/spaces-usage/: truy vấn theo từng phòng/booking (cũ) so với prefetch."""
+        spaces = seed_spaces(self.scaled(2000))
+        users = seed_users(self.scaled(500))
+        # 3 booking sắp tới cho mỗi phòng, cách nhau 1 phút để luôn nằm trong ngày
+        seed_bookings(3 * len(spaces), spaces, users, start=timezone.now() + timedelta(minutes=1),
+                      slot=timedelta(minutes=1), status_cycle=('CONFIRMED',))
+        # Ảnh QR đã render sẵn để chỉ đo phần truy vấn
+        QRCode.objects.bulk_create(
+            QRCode(booking_id=booking_id, image='qrcodes/bench.png')
+            for booking_id in Booking.objects.values_list('id', flat=True)
+        )
+        equipment_type = EquipmentType.objects.create(name='bench', total_quantity=len(spaces))
+        Equipment.objects.bulk_create(
+            Equipment(equipment_type=equipment_type, booking_id=booking_id, status='BORROWED')
+            for booking_id in Booking.objects.order_by('id').values_list('id', flat=True)[::3]
+        )
+        client = APIClient()
+        client.force_authenticate(user=users[0])
+
+        class LegacyUsageSerializer(StudySpaceUsageSerializer):
+            # Hành vi cũ: get_space_status và truy vấn booking riêng cho từng phòng
+            def get_current_status(self, obj):
+                return obj.get_space_status(self.context['current_time'])
+
+            def get_bookings_today(self, obj):
+                bookings = self.upcoming_bookings(self.context['current_time']).filter(space=obj)
+                return BookingSerializer(bookings, many=True, context={'request': self.context['request']}).data
+
+        def get_usage():
+            response = client.get(reverse('spaces-usage'))
+            assert response.status_code == 200
+            assert len(response.data['spaces']) == len(spaces)
+
+        self.section(f"{len(spaces)} phòng, {Booking.objects.count()} booking trong ngày")
+        with mock.patch('apps.resources.views.StudySpaceUsageSerializer', LegacyUsageSerializer), \
+                mock.patch.object(StudySpaceUsageSerializer, 'setup_queryset', lambda spaces, _: spaces):
+            self.measure('truy vấn theo từng phòng/booking (cũ)', get_usage, repeat=min(self.options['repeat'], 3))
+        self.measure('with_current_status + Prefetch', get_usage)
+
+    def bench_stream(self):
+        """Một tiến trình ASGI giữ nhiều client SSE nhàn rỗi, đo bộ nhớ và thời gian phát một sự kiện."""
+        spaces = seed_spaces(self.scaled(100))
+        user = seed_users(1)[0]
+        token = str(AccessToken.for_user(user))
+        total = self.options['subscribers']
+        application = get_asgi_application()
+
+        def rss_mb():
+            with open('/proc/self/status') as status:
+                return next(int(line.split()[1]) for line in status if line.startswith('VmRSS')) / 1024
+
+        async def run():
+            disconnect = asyncio.Event()
+            snapshots, statuses = asyncio.Semaphore(0), asyncio.Semaphore(0)
+
+            async def subscriber():
+                requested = False
+
+                async def receive():
+                    nonlocal requested
+                    if not requested:
+                        requested = True
+                        return {'type': 'http.request', 'body': b'', 'more_body': False}
+                    await disconnect.wait()
+                    return {'type': 'http.disconnect'}
+
+                async def send(message):
+                    body = message.get('body', b'')
+                    if body.startswith(b'event: snapshot'):
+                        snapshots.release()
+                    elif body.startswith(b'event: status'):
+                        statuses.release()
+
+                await application({
+                    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                    'scheme': 'http', 'path': reverse('spaces-usage-stream'), 'raw_path': b'',
+                    'query_string': b'', 'root_path': '',
+                    'headers': [(b'authorization', f'Bearer {token}'.encode())],
+                    'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+                }, receive, send)
+
+            async def wait_all(semaphore):
+                for _ in range(total):
+                    await semaphore.acquire()
+
+            rss_before = rss_mb()
+            started = time.perf_counter()
+            tasks = [asyncio.create_task(subscriber()) for _ in range(total)]
+            await wait_all(snapshots)
+            connected = time.perf_counter() - started
+            self.stdout.write(
+                f"{total} client đã nhận snapshot sau {connected:.2f}s, "
+                f"RSS +{rss_mb() - rss_before:.1f}MB ({(rss_mb() - rss_before) * 1024 / total:.1f}KB/client)"
+            )
+            for label in ('sự kiện 1', 'sự kiện 2', 'sự kiện 3'):
+                started = time.perf_counter()
+                await sync_to_async(_publish)({spaces[0].id})
+                await wait_all(statuses)
+                self.stdout.write(f"{label}: tới đủ {total} client sau {(time.perf_counter() - started) * 1000:.1f}ms")
+            disconnect.set()
+            await asyncio.gather(*tasks)
+
+        self.section(f"{total} client SSE nhàn rỗi trong một tiến trình, {len(spaces)} phòng")
+        with override_settings(LIVE_EVENTS_REDIS_URL=None):
+            asyncio.run(run())
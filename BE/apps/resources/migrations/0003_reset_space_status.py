@@ -0,0 +1,33 @@
+from django.db import migrations
+from django.db.models import Exists, OuterRef
+
+
+# Giá trị luồng booking cũ ghi vào space_status theo trạng thái booking vừa chuyển tới
+# (CHECK_OUT/CANCELLED ghi EMPTY nên không để lại gì)
+WRITTEN_BY_BOOKING_FLOW = {
+    'BOOKED': 'CONFIRMED',
+    'INUSE': 'CHECK_IN',
+}
+
+
+def reset_space_status(apps, schema_editor):
+    # Chỉ trả về EMPTY các phòng có booking ở đúng trạng thái đã ghi ra giá trị đang lưu;
+    # INUSE do quản lý đặt để khóa phòng (không có booking đang check-in) được giữ nguyên
+    StudySpace = apps.get_model('resources', 'StudySpace')
+    Booking = apps.get_model('bookings', 'Booking')
+    for space_status, booking_status in WRITTEN_BY_BOOKING_FLOW.items():
+        StudySpace.objects.filter(space_status=space_status).filter(
+            Exists(Booking.objects.filter(space=OuterRef('pk'), status=booking_status))
+        ).update(space_status='EMPTY')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0002_studyspace_name'),
+        ('bookings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_space_status, migrations.RunPython.noop),
+    ]
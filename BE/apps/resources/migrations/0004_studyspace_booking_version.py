@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0003_reset_space_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studyspace',
+            name='booking_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,5 +1,6 @@
 #romms/models.py
 from django.db import models
+from django.db.models import Case, CharField, F, OuterRef, Subquery, Value, When
 from django.utils import timezone
 
 # Định nghĩa choices cho space_type
@@ -24,23 +25,51 @@ class StudySpace(models.Model):
         choices=SPACE_TYPE_CHOICES,  # Sử dụng danh sách tuple
         default='INDIVIDUAL'
     )
+    # Trạng thái khi không có booking đang diễn ra (quản lý đặt, ví dụ INUSE để khóa phòng).
+    # Luồng booking không ghi trường này: trạng thái thực tế suy ra từ booking (get_space_status)
     space_status = models.CharField(
         max_length=20,
         choices=SPACE_STATUS_CHOICES,  # Sử dụng danh sách tuple
         default='EMPTY'
     )
 
+    # Tăng mỗi khi có booking mới của phòng, dùng cho compare-and-swap trong Booking.create_booking
+    booking_version = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return f"{self.name}"
 
     def get_space_status(self, at_time):
+        """Trạng thái phòng tại at_time theo booking đang diễn ra (dùng chỉ mục booking_space_time_idx)"""
         from apps.bookings.models import Booking, SPACE_STATUS_MAPPING
-        current_bookings = Booking.objects.filter(
+        booking = Booking.objects.filter(
             space=self,
             start_time__lte=at_time,
             end_time__gt=at_time,
-        ).exclude(status='CANCELLED')
-        if current_bookings.exists():
-            booking = current_bookings.first()
+        ).exclude(status='CANCELLED').order_by('pk').first()
+        if booking:
             return SPACE_STATUS_MAPPING.get(booking.status, 'EMPTY')
-        return self.space_status
\ No newline at end of file
+        return self.space_status
+
+    @staticmethod
+    def with_current_status(queryset, at_time):
+        """
+        Gắn trường current_status (giống get_space_status) cho cả queryset
+        bằng một subquery, tránh truy vấn riêng cho từng không gian.
+        """
+        from apps.bookings.models import Booking, SPACE_STATUS_MAPPING
+        current_booking = Booking.objects.filter(
+            space=OuterRef('pk'),
+            start_time__lte=at_time,
+            end_time__gt=at_time,
+        ).exclude(status='CANCELLED').order_by('pk').values('status')[:1]
+        return queryset.annotate(
+            current_booking_status=Subquery(current_booking)
+        ).annotate(
+            current_status=Case(
+                *[When(current_booking_status=booking_status, then=Value(space_status))
+                  for booking_status, space_status in SPACE_STATUS_MAPPING.items()],
+                default=F('space_status'),
+                output_field=CharField(),
+            )
+        )
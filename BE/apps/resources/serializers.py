@@ -1,3 +1,6 @@
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from .models import StudySpace
 from apps.bookings.models import Booking
@@ -14,6 +17,22 @@ class StudySpaceSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Sức chứa phải lớn hơn 0.")
         return data
 
+    def to_representation(self, instance):
+        # space_status lưu trong bảng chỉ là trạng thái quản lý đặt khi không có booking đang diễn ra;
+        # trả về trạng thái thực tế suy ra từ booking (gắn sẵn bởi StudySpace.with_current_status nếu có)
+        data = super().to_representation(instance)
+        if hasattr(instance, 'current_status'):
+            data['space_status'] = instance.current_status
+        else:
+            data['space_status'] = instance.get_space_status(timezone.now())
+        return data
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # current_status gắn lúc đọc đã cũ nếu quản lý vừa đổi space_status
+        vars(instance).pop('current_status', None)
+        return instance
+
 class StudySpaceUsageSerializer(serializers.ModelSerializer):
     current_status = serializers.SerializerMethodField()
     bookings_today = serializers.SerializerMethodField()
@@ -23,16 +42,42 @@ class StudySpaceUsageSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'capacity', 'space_type', 'current_status', 'bookings_today']
 
     def get_current_status(self, obj):
+        # Dùng trạng thái đã gắn sẵn bởi StudySpace.with_current_status nếu có
+        if hasattr(obj, 'current_status'):
+            return obj.current_status
         current_time = self.context['current_time']
         return obj.get_space_status(current_time)
 
     def get_bookings_today(self, obj):
-        current_time = self.context['current_time']
+        # Dùng danh sách đã prefetch bởi StudySpaceUsageSerializer.setup_queryset nếu có
+        if hasattr(obj, 'bookings_today'):
+            bookings = obj.bookings_today
+        else:
+            bookings = self.upcoming_bookings(self.context['current_time']).filter(space=obj)
+        return [self.booking_serializer.to_representation(booking) for booking in bookings]
+
+    @cached_property
+    def booking_serializer(self):
+        # Dùng chung một BookingSerializer cho mọi phòng thay vì dựng lại các field cho từng phòng
+        return BookingSerializer(context={'request': self.context['request']})
+
+    @staticmethod
+    def upcoming_bookings(current_time):
+        """Các booking chưa kết thúc bắt đầu từ current_time đến hết ngày"""
         end_of_day = current_time.replace(hour=23, minute=59, second=59, microsecond=999999)
-        bookings = Booking.objects.filter(
-            space=obj,
+        return Booking.objects.filter(
             start_time__gte=current_time,
             start_time__lte=end_of_day,
             status__in=['CONFIRMED', 'CHECK_IN']  # Chỉ lấy các đặt phòng chưa kết thúc
         ).order_by('start_time')
-        return BookingSerializer(bookings, many=True, context={'request': self.context['request']}).data
+
+    @staticmethod
+    def setup_queryset(spaces, current_time):
+        """
+        Gắn trạng thái hiện tại và prefetch booking trong ngày (kèm user, space, QR,
+        thiết bị) cho cả danh sách, số truy vấn không phụ thuộc số không gian.
+        """
+        bookings = BookingSerializer.setup_queryset(StudySpaceUsageSerializer.upcoming_bookings(current_time))
+        return StudySpace.with_current_status(spaces, current_time).prefetch_related(
+            Prefetch('booking_set', queryset=bookings, to_attr='bookings_today')
+        )
@@ -0,0 +1,215 @@
+"""
+LUỒNG TRẠNG THÁI PHÒNG TRỰC TIẾP (SSE)
+- Khi booking thay đổi, publish_space_status đẩy task publish_space_status_task sau khi
+  transaction commit; Celery worker truy vấn trạng thái mới của các phòng liên quan và
+  gửi qua Redis pub/sub (LIVE_EVENTS_REDIS_URL), không chiếm thời gian của request.
+- Mỗi event loop (mỗi tiến trình ASGI) có một SpaceStatusBroadcaster: một kết nối
+  pub/sub duy nhất tới Redis, chia sự kiện vào hàng đợi asyncio của từng client.
+- Không cấu hình Redis (LIVE_EVENTS_REDIS_URL = None) thì sự kiện chỉ được chia
+  cho các client trong cùng tiến trình, ngay sau commit và chỉ khi tiến trình có client.
+- EventSource của trình duyệt không gửi được header Authorization, nên client đổi JWT lấy
+  một vé (issue_stream_ticket) rồi mở luồng với ?ticket=: vé dùng một lần và hết hạn sau
+  STREAM_TICKET_TTL_SECONDS, JWT không xuất hiện trong URL và access log.
+"""
+import asyncio
+import json
+import logging
+import secrets
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import StudySpace
+
+logger = logging.getLogger(__name__)
+
+SPACE_STATUS_CHANNEL = 'spaces:status'
+# Client không đọc kịp quá số sự kiện này sẽ nhận RESYNC và được gửi lại ảnh chụp toàn bộ
+SUBSCRIBER_QUEUE_SIZE = 100
+RESYNC = object()
+REDIS_RECONNECT_SECONDS = 1
+
+_broadcasters = {}
+_redis_client = None
+
+
+def space_status_events(spaces, at_time=None):
+    """Trạng thái hiện tại của các phòng, tính bằng một truy vấn"""
+    at_time = at_time or timezone.now()
+    rows = StudySpace.with_current_status(spaces, at_time).values('id', 'name', 'current_status').order_by('id')
+    return [
+        {'space_id': row['id'], 'name': row['name'], 'status': row['current_status'], 'at': at_time.isoformat()}
+        for row in rows
+    ]
+
+
+def publish_space_status(space_ids):
+    """Gửi trạng thái mới của các phòng tới các client đang theo dõi, sau khi transaction commit"""
+    space_ids = set(space_ids)
+    if space_ids:
+        transaction.on_commit(lambda: _enqueue_publish(space_ids), robust=True)
+
+
+def _enqueue_publish(space_ids):
+    if settings.LIVE_EVENTS_REDIS_URL:
+        publish_space_status_task.delay(sorted(space_ids))
+    else:
+        # Client chỉ nằm trong tiến trình này nên phải gửi từ đây
+        _publish(space_ids)
+
+
+@shared_task
+def publish_space_status_task(space_ids):
+    """Task truy vấn trạng thái các phòng và gửi lên Redis pub/sub"""
+    _publish(space_ids)
+
+
+def _publish(space_ids):
+    if not settings.LIVE_EVENTS_REDIS_URL and not _broadcasters:
+        return
+    messages = [json.dumps(event) for event in space_status_events(StudySpace.objects.filter(id__in=space_ids))]
+    if not settings.LIVE_EVENTS_REDIS_URL:
+        for broadcaster in list(_broadcasters.values()):
+            for message in messages:
+                broadcaster.dispatch_threadsafe(message)
+        return
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(
+            settings.LIVE_EVENTS_REDIS_URL, socket_connect_timeout=1, socket_timeout=1
+        )
+    pipeline = _redis_client.pipeline(transaction=False)
+    for message in messages:
+        pipeline.publish(SPACE_STATUS_CHANNEL, message)
+    pipeline.execute()
+
+
+class SpaceStatusBroadcaster:
+    """Chia sự kiện trạng thái phòng cho các client SSE trong một event loop"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.subscribers = set()
+        self.listener = None
+        self.snapshot_waiters = []
+        self.snapshotter = None
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        if settings.LIVE_EVENTS_REDIS_URL and self.listener is None:
+            self.listener = self.loop.create_task(self._listen())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        if not self.subscribers:
+            if self.listener is not None:
+                self.listener.cancel()
+                self.listener = None
+            _broadcasters.pop(self.loop, None)
+
+    def dispatch(self, message):
+        """Đưa sự kiện vào hàng đợi của mọi client (chạy trong event loop)"""
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Client chậm: bỏ các sự kiện đang chờ, yêu cầu gửi lại ảnh chụp
+                while not queue.empty():
+                    queue.get_nowait()
+                message_or_resync = RESYNC
+            else:
+                message_or_resync = message
+            queue.put_nowait(message_or_resync)
+
+    async def snapshot(self):
+        """
+        Ảnh chụp trạng thái toàn bộ phòng (JSON). Các client xin ảnh chụp trong lúc một
+        truy vấn đang chạy sẽ chờ và dùng chung truy vấn kế tiếp, nên khi nhiều client
+        kết nối lại cùng lúc thì số truy vấn không tăng theo số client.
+        """
+        future = self.loop.create_future()
+        self.snapshot_waiters.append(future)
+        if self.snapshotter is None:
+            self.snapshotter = self.loop.create_task(self._take_snapshots())
+        return await future
+
+    async def _take_snapshots(self):
+        try:
+            while self.snapshot_waiters:
+                # Chỉ gom các client đã đăng ký trước khi truy vấn bắt đầu để không lỡ sự kiện
+                waiters, self.snapshot_waiters = self.snapshot_waiters, []
+                try:
+                    result = json.dumps(await sync_to_async(space_status_events)(StudySpace.objects.all()))
+                except Exception as error:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(error)
+                    continue
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(result)
+        finally:
+            self.snapshotter = None
+
+    def dispatch_threadsafe(self, message):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.dispatch, message)
+
+    async def _listen(self):
+        """Một kết nối pub/sub tới Redis cho cả tiến trình, tự kết nối lại khi lỗi"""
+        reconnecting = False
+        while True:
+            try:
+                client = redis.asyncio.Redis.from_url(settings.LIVE_EVENTS_REDIS_URL)
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(SPACE_STATUS_CHANNEL)
+                    if reconnecting:
+                        # Trong lúc mất kết nối có thể đã bỏ lỡ sự kiện
+                        self.dispatch(RESYNC)
+                    async for item in pubsub.listen():
+                        if item['type'] == 'message':
+                            self.dispatch(item['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except (redis.RedisError, OSError):
+                logger.warning("Mất kết nối Redis pub/sub, thử lại sau %ss", REDIS_RECONNECT_SECONDS, exc_info=True)
+                reconnecting = True
+                await asyncio.sleep(REDIS_RECONNECT_SECONDS)
+
+
+def get_broadcaster():
+    """Broadcaster của event loop đang chạy"""
+    loop = asyncio.get_running_loop()
+    if loop not in _broadcasters:
+        _broadcasters[loop] = SpaceStatusBroadcaster(loop)
+    return _broadcasters[loop]
+
+
+STREAM_TICKET_TTL_SECONDS = 30
+
+
+def _stream_ticket_key(ticket):
+    return f'resources:stream-ticket:{ticket}'
+
+
+def issue_stream_ticket(user):
+    """Tạo vé mở luồng SSE cho user, lưu trong cache dùng chung (CACHE_REDIS_URL)"""
+    ticket = secrets.token_urlsafe(32)
+    cache.set(_stream_ticket_key(ticket), user.id, STREAM_TICKET_TTL_SECONDS)
+    return ticket
+
+
+async def redeem_stream_ticket(ticket):
+    """Đổi vé lấy id người dùng; vé chỉ dùng được một lần, trả về None nếu sai hoặc hết hạn"""
+    key = _stream_ticket_key(ticket)
+    user_id = await cache.aget(key)
+    # Chỉ lần xóa thành công mới được dùng vé khi nhiều kết nối đổi cùng một vé
+    if user_id is None or not await cache.adelete(key):
+        return None
+    return user_id
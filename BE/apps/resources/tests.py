@@ -1,3 +1,207 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection
+from asgiref.sync import sync_to_async
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.bookings.models import Booking, Equipment, EquipmentType, QRCode
+from apps.bookings.tests import TemporaryMediaMixin
+from apps.users.models import User
+from .models import StudySpace
+from .services import SPACE_STATUS_CHANNEL, publish_space_status_task
+
+
+class SpacesUsageTests(TemporaryMediaMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.projector = EquipmentType.objects.create(name='Máy chiếu', total_quantity=100)
+        self.client.force_authenticate(user=self.student)
+
+    def add_spaces(self, count):
+        """Tạo count phòng, mỗi phòng một booking đang diễn ra và một booking sắp tới có mượn thiết bị"""
+        now = timezone.now()
+        # Booking sắp tới phải bắt đầu trước cuối ngày (UTC) như API đang tính
+        later = min(now + timedelta(minutes=1), now.replace(hour=23, minute=59))
+        offset = StudySpace.objects.count()
+        for i in range(offset, offset + count):
+            space = StudySpace.objects.create(name=f'A-{i:02d}', capacity=1, space_type='INDIVIDUAL')
+            Booking.objects.create(user=self.student, space=space, status='CHECK_IN',
+                                   start_time=now - timedelta(hours=1), end_time=later)
+            upcoming = Booking.objects.create(user=self.student, space=space, start_time=later,
+                                              end_time=later + timedelta(hours=1))
+            QRCode.generate_qr_code(upcoming).render_image()
+            Equipment.objects.create(equipment_type=self.projector, booking=upcoming, status='BORROWED')
+
+    def get_usage(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('spaces-usage'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_independent_of_space_count(self):
+        """Kiểm tra số truy vấn của spaces-usage không tăng theo số phòng"""
+        self.add_spaces(2)
+        response, small = self.get_usage()
+        self.assertEqual(len(response.data['spaces']), 2)
+        self.add_spaces(8)
+        response, large = self.get_usage()
+        self.assertEqual(len(response.data['spaces']), 10)
+        self.assertEqual(small, large)
+
+    def test_usage_payload(self):
+        """Kiểm tra trạng thái và booking trong ngày của từng phòng"""
+        self.add_spaces(1)
+        response, _ = self.get_usage()
+        space = response.data['spaces'][0]
+        self.assertEqual(space['current_status'], 'INUSE')
+        self.assertEqual(len(space['bookings_today']), 1)
+        booking = space['bookings_today'][0]
+        self.assertEqual(booking['user'], 'student1')
+        self.assertEqual(booking['space_name'], 'A-00')
+        self.assertEqual(booking['equipments'][0]['equipment_type']['name'], 'Máy chiếu')
+        self.assertTrue(booking['qr_code_url'].endswith(reverse('booking_qr_code_image', args=[booking['id']])))
+
+
+class StudySpaceStatusTests(APITestCase):
+    def setUp(self):
+        self.manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        self.student = User.objects.create_user(username='student1', email='student1@hcmut.edu.vn', role='student')
+        self.busy = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.idle = StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        now = timezone.now()
+        Booking.objects.create(user=self.student, space=self.busy, status='CHECK_IN',
+                               start_time=now - timedelta(minutes=5), end_time=now + timedelta(hours=1))
+        self.client.force_authenticate(user=self.manager)
+
+    def test_space_status_derived_from_bookings(self):
+        """Kiểm tra API không gian trả về trạng thái suy ra từ booking thay vì space_status đã lưu"""
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('study_space_list'))
+        statuses = {space['name']: space['space_status'] for space in response.data['results']}
+        self.assertEqual(statuses, {'A-01': 'INUSE', 'A-02': 'EMPTY'})
+        response = self.client.get(reverse('study_space_detail', args=[self.busy.id]))
+        self.assertEqual(response.data['space_status'], 'INUSE')
+        self.busy.refresh_from_db()
+        self.assertEqual(self.busy.space_status, 'EMPTY')
+
+    def test_manager_status_change_is_returned(self):
+        """Kiểm tra quản lý khóa phòng trống thì phản hồi trả về trạng thái vừa đặt"""
+        response = self.client.patch(reverse('study_space_detail', args=[self.idle.id]),
+                                      {'space_status': 'INUSE', 'capacity': 1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['space_status'], 'INUSE')
+
+
+@override_settings(LIVE_EVENTS_REDIS_URL=None)
+class SpaceStatusStreamTests(APITestCase):
+    def setUp(self):
+        self.student = User.objects.create_user(
+            username='student1',
+            email='student1@hcmut.edu.vn',
+            role='student',
+        )
+        self.space = StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL')
+        self.token = str(AccessToken.for_user(self.student))
+
+    async def read_event(self, stream):
+        chunk = await asyncio.wait_for(anext(stream), 5)
+        event, data = chunk.decode().strip().split('\n')
+        return event.removeprefix('event: '), json.loads(data.removeprefix('data: '))
+
+    def test_stream_requires_token(self):
+        """Kiểm tra luồng SSE từ chối khi không có hoặc sai JWT"""
+        self.assertEqual(self.client.get(reverse('spaces-usage-stream')).status_code, 401)
+        response = self.client.get(reverse('spaces-usage-stream'), {'ticket': 'invalid'})
+        self.assertEqual(response.status_code, 401)
+        # JWT không được nhận qua URL (tránh lọt vào access log)
+        response = self.client.get(reverse('spaces-usage-stream'), {'token': self.token})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_stream_ticket_is_single_use(self):
+        """Kiểm tra vé lấy bằng JWT mở được luồng SSE đúng một lần"""
+        headers = {'Authorization': f'Bearer {self.token}'}
+        response = await self.async_client.post(reverse('spaces-usage-stream-ticket'), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        ticket = response.json()['ticket']
+        response = await self.async_client.get(reverse('spaces-usage-stream'), {'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        stream = aiter(response.streaming_content)
+        event, _ = await self.read_event(stream)
+        self.assertEqual(event, 'snapshot')
+        await stream.aclose()
+        response = await self.async_client.get(reverse('spaces-usage-stream'), {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.post(reverse('spaces-usage-stream-ticket'))
+        self.assertEqual(response.status_code, 401)
+
+    def book_now(self, **fields):
+        now = timezone.now()
+        return dict(user=self.student, space=self.space, status='CHECK_IN',
+                    start_time=now - timedelta(minutes=5), end_time=now + timedelta(hours=1), **fields)
+
+    async def test_stream_sends_snapshot_with_valid_token(self):
+        """Kiểm tra luồng SSE với JWT hợp lệ gửi sự kiện snapshot chứa trạng thái hiện tại của mọi phòng"""
+        other = await StudySpace.objects.acreate(name='A-02', capacity=1, space_type='INDIVIDUAL')
+        await Booking.objects.abulk_create([Booking(**self.book_now())])
+        response = await self.async_client.get(reverse('spaces-usage-stream'),
+                                               headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'snapshot')
+        self.assertEqual([(s['space_id'], s['status']) for s in data], [(self.space.id, 'INUSE'), (other.id, 'EMPTY')])
+        await stream.aclose()
+
+    async def test_stream_sends_status_changes_after_commit(self):
+        """Kiểm tra luồng SSE nhận trạng thái mới khi booking được lưu, chỉ sau khi transaction commit"""
+        response = await self.async_client.get(reverse('spaces-usage-stream'),
+                                               headers={'Authorization': f'Bearer {self.token}'})
+        stream = aiter(response.streaming_content)
+        event, data = await self.read_event(stream)
+        self.assertEqual([(s['name'], s['status']) for s in data], [('A-01', 'EMPTY')])
+
+        def save_booking():
+            with self.captureOnCommitCallbacks(execute=True):
+                Booking.objects.create(**self.book_now())
+
+        with mock.patch('apps.bookings.services.refresh_usage_rollups_task'):
+            await sync_to_async(save_booking)()
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'status')
+        self.assertEqual((data['space_id'], data['status']), (self.space.id, 'INUSE'))
+        await stream.aclose()
+
+    def test_booking_save_publishes_through_redis_after_commit(self):
+        """Kiểm tra có Redis thì lưu booking chỉ đẩy task sau commit, task gửi trạng thái mới lên kênh pub/sub"""
+        with override_settings(LIVE_EVENTS_REDIS_URL='redis://live-events:6379/1'):
+            with mock.patch('apps.bookings.services.refresh_usage_rollups_task'), \
+                    mock.patch.object(publish_space_status_task, 'delay') as delay:
+                with self.assertNumQueries(1), self.captureOnCommitCallbacks() as callbacks:
+                    Booking.objects.create(**self.book_now())
+                delay.assert_not_called()
+                with self.assertNumQueries(0):
+                    for callback in callbacks:
+                        callback()
+                delay.assert_called_once_with([self.space.id])
+            with mock.patch('apps.resources.services._redis_client') as client:
+                publish_space_status_task.apply(delay.call_args.args)
+        channel, message = client.pipeline.return_value.publish.call_args.args
+        self.assertEqual(channel, SPACE_STATUS_CHANNEL)
+        self.assertEqual((json.loads(message)['space_id'], json.loads(message)['status']), (self.space.id, 'INUSE'))
+        client.pipeline.return_value.execute.assert_called_once_with()
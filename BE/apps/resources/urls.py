@@ -3,8 +3,10 @@ from . import views
 
 urlpatterns = [
     path('study-spaces/', views.StudySpaceListCreateAPIView.as_view(), name='study_space_list'),
-    path('get-space-status/<int:room_id>/', views.get_space_status, name='get_space_status'),
+    path('get-space-status/<int:space_id>/', views.get_space_status, name='get_space_status'),
     path('search-available-spaces/', views.search_available_spaces, name='search_available_spaces'),
     path('study-spaces/<int:pk>/', views.StudySpaceRetrieveUpdateDestroyAPIView.as_view(), name='study_space_detail'),
     path('spaces-usage/', views.SpacesUsageAPIView.as_view(), name='spaces-usage'),
+    path('spaces-usage/stream/', views.space_status_stream, name='spaces-usage-stream'),
+    path('spaces-usage/stream/ticket/', views.SpaceStatusStreamTicketAPIView.as_view(), name='spaces-usage-stream-ticket'),
 ]
\ No newline at end of file
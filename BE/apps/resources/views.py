@@ -12,6 +12,14 @@ from apps.bookings.permissions import IsManagerForStudySpace
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from asgiref.sync import sync_to_async
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from .services import RESYNC, STREAM_TICKET_TTL_SECONDS, get_broadcaster, issue_stream_ticket, redeem_stream_ticket
+from apps.users.models import User
+import asyncio
 
 
 class StandardResultsSetPagination(PageNumberPagination):
@@ -25,11 +33,18 @@ class StudySpaceListCreateAPIView(generics.ListCreateAPIView):
     permission_classes = [IsManagerForStudySpace]
     pagination_class = StandardResultsSetPagination
 
+    def get_queryset(self):
+        # Trạng thái hiện tại của cả trang trong cùng truy vấn danh sách
+        return StudySpace.with_current_status(super().get_queryset(), timezone.now()).order_by('id')
+
 class StudySpaceRetrieveUpdateDestroyAPIView(RetrieveUpdateDestroyAPIView):
     queryset = StudySpace.objects.all()
     serializer_class = StudySpaceSerializer
     permission_classes = [IsManagerForStudySpace]
 
+    def get_queryset(self):
+        return StudySpace.with_current_status(super().get_queryset(), timezone.now())
+
 @extend_schema(
     operation_id="get_space_status",
     summary="Lấy trạng thái của một không gian học tập",
@@ -128,14 +143,11 @@ def search_available_spaces(request):
     if start_time < timezone.now():
         return Response({'error': 'Không thể tìm kiếm phòng trong quá khứ'}, status=400)
 
-    # Lọc các StudySpace theo space_type
-    spaces = StudySpace.objects.filter(space_type=space_type)
-    available_spaces = []
-
-    # Kiểm tra từng không gian xem có trống không
-    for space in spaces:
-        if Booking.check_room_availability(space, start_time, end_time):
-            available_spaces.append(space)
+    # Lọc các StudySpace theo space_type và loại bỏ phòng bận trong cùng một truy vấn
+    available_spaces = Booking.available_spaces(
+        StudySpace.with_current_status(StudySpace.objects.filter(space_type=space_type), timezone.now()),
+        start_time, end_time,
+    )
 
     # Serialize kết quả
     serializer = StudySpaceSerializer(available_spaces, many=True)
@@ -191,7 +203,7 @@ class SpacesUsageAPIView(APIView):
     )
     def get(self, request):
         current_time = timezone.now()
-        spaces = StudySpace.objects.all()
+        spaces = StudySpaceUsageSerializer.setup_queryset(StudySpace.objects.all(), current_time)
         serializer = StudySpaceUsageSerializer(
             spaces,
             many=True,
@@ -200,4 +212,95 @@ class SpacesUsageAPIView(APIView):
         return Response({
             'current_time': current_time.isoformat(),
             'spaces': serializer.data
-        })
\ No newline at end of file
+        })
+
+# Khoảng thời gian gửi comment giữ kết nối SSE khi không có sự kiện
+STREAM_HEARTBEAT_SECONDS = 15
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+class SpaceStatusStreamTicketAPIView(APIView):
+    """
+    API cấp vé mở luồng SSE trạng thái phòng (EventSource không gửi được header Authorization).
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        operation_id="spaces_usage_stream_ticket",
+        summary="Cấp vé mở luồng trạng thái phòng",
+        description=f"Vé dùng một lần, hết hạn sau {STREAM_TICKET_TTL_SECONDS} giây: "
+                    "mở luồng bằng GET /api/spaces-usage/stream/?ticket=<ticket>.",
+        request=None,
+        responses={
+            200: {
+                'type': 'object',
+                'properties': {
+                    'ticket': {'type': 'string', 'example': 'k3Xn9...'},
+                    'expires_in': {'type': 'integer', 'example': STREAM_TICKET_TTL_SECONDS},
+                },
+            },
+        },
+    )
+    def post(self, request):
+        return Response({'ticket': issue_stream_ticket(request.user), 'expires_in': STREAM_TICKET_TTL_SECONDS})
+
+
+async def _authenticate_stream(request):
+    """
+    Xác thực luồng SSE: header Authorization: Bearer <token> hoặc ?ticket=<vé> lấy từ
+    SpaceStatusStreamTicketAPIView (không nhận JWT trên URL để token không lọt vào access log).
+    """
+    authentication = JWTAuthentication()
+    header = authentication.get_header(request)
+    raw_token = authentication.get_raw_token(header) if header else None
+    if raw_token:
+        try:
+            validated_token = authentication.get_validated_token(raw_token)
+            return await sync_to_async(authentication.get_user)(validated_token)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    ticket = request.GET.get('ticket')
+    user_id = await redeem_stream_ticket(ticket) if ticket else None
+    if user_id is None:
+        return None
+    return await User.objects.filter(id=user_id).afirst()
+
+
+async def space_status_stream(request):
+    """
+    Luồng Server-Sent Events trạng thái các không gian học tập.
+    - Sự kiện đầu tiên 'snapshot' chứa trạng thái toàn bộ phòng.
+    - Sau đó mỗi thay đổi là một sự kiện 'status' {space_id, name, status, at}.
+    - Nên chạy dưới máy chủ ASGI (BE.asgi) để một tiến trình giữ được nhiều kết nối.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    user = await _authenticate_stream(request)
+    if user is None or not user.is_active:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    async def events():
+        broadcaster = get_broadcaster()
+        queue = broadcaster.subscribe()
+        try:
+            message = RESYNC
+            while True:
+                if message is RESYNC:
+                    yield _sse('snapshot', await broadcaster.snapshot())
+                elif message is not None:
+                    yield _sse('status', message)
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    message = None
+                    yield ": ping\n\n"
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Tắt buffer của nginx
+    return response
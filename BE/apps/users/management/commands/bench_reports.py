@@ -0,0 +1,127 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from apps.bookings.management.benchmark import BenchmarkCommand, seed_bookings, seed_spaces, seed_users
+from apps.bookings.models import Booking, Equipment, EquipmentType
+from apps.resources.models import StudySpace
+from apps.users.models import User
+from apps.users.services import build_report_detailed, build_report_overview, build_usage_report
+
+
+class Command(BenchmarkCommand):
+    help = "Benchmark các báo cáo của ban quản lý."
+    scenarios = ('overview', 'detailed', 'usage')
+
+    def bench_overview(self):
+        """report-overview: khoảng 20 COUNT + 3×N get_space_status (cũ) so với aggregate có điều kiện."""
+        spaces = seed_spaces(self.scaled(5000))
+        users = seed_users(self.scaled(5000))
+        # Khung giờ hiện tại nằm giữa các booking đang diễn ra
+        seed_bookings(self.scaled(100_000), spaces, users, start=timezone.now() - timedelta(days=20),
+                      status_cycle=('CHECK_OUT', 'CONFIRMED', 'CHECK_IN', 'CANCELLED'))
+        equipment_type = EquipmentType.objects.create(name='bench', total_quantity=self.scaled(10_000))
+        Equipment.objects.bulk_create(
+            [Equipment(equipment_type=equipment_type) for _ in range(self.scaled(10_000))], batch_size=5000
+        )
+        current_time = timezone.now()
+
+        def legacy_overview():
+            # Bản sao phần thống kê cũ của report-overview
+            return {
+                'users': {
+                    'total_users': User.objects.count(),
+                    'students': User.objects.filter(role='student').count(),
+                    'teachers': User.objects.filter(role='teacher').count(),
+                    'managers': User.objects.filter(role='manager').count(),
+                    'bookings_by_students': Booking.objects.filter(user__role='student').count(),
+                    'bookings_by_teachers': Booking.objects.filter(user__role='teacher').count(),
+                },
+                'spaces': {
+                    'total_spaces': StudySpace.objects.count(),
+                    'individual_spaces': StudySpace.objects.filter(space_type='INDIVIDUAL').count(),
+                    'group_spaces': StudySpace.objects.filter(space_type='GROUP').count(),
+                    'mentoring_spaces': StudySpace.objects.filter(space_type='MENTORING').count(),
+                    'empty_spaces': sum(1 for space in StudySpace.objects.all()
+                                        if space.get_space_status(current_time) == 'EMPTY'),
+                    'booked_spaces': sum(1 for space in StudySpace.objects.all()
+                                         if space.get_space_status(current_time) == 'BOOKED'),
+                    'inuse_spaces': sum(1 for space in StudySpace.objects.all()
+                                        if space.get_space_status(current_time) == 'INUSE'),
+                },
+                'bookings': {
+                    'total_bookings': Booking.objects.count(),
+                    'confirmed_bookings': Booking.objects.filter(status='CONFIRMED').count(),
+                    'check_in_bookings': Booking.objects.filter(status='CHECK_IN').count(),
+                    'check_out_bookings': Booking.objects.filter(status='CHECK_OUT').count(),
+                    'cancelled_bookings': Booking.objects.filter(status='CANCELLED').count(),
+                },
+                'equipments': {
+                    'total_equipments': Equipment.objects.count(),
+                    'available_equipments': Equipment.objects.filter(status='AVAILABLE').count(),
+                    'borrowed_equipments': Equipment.objects.filter(status='BORROWED').count(),
+                    'broken_equipments': Equipment.objects.filter(status='BROKEN').count(),
+                    'maintenance_equipments': Equipment.objects.filter(status='MAINTENANCE').count(),
+                },
+                'generated_at': current_time.isoformat(),
+            }
+
+        assert legacy_overview() == build_report_overview(current_time)
+        self.section(f"{len(spaces)} phòng, {Booking.objects.count()} booking")
+        self.measure('COUNT riêng lẻ + get_space_status (cũ)', legacy_overview, repeat=min(self.options['repeat'], 3))
+        self.measure('aggregate có điều kiện', lambda: build_report_overview(current_time))
+
+    def bench_detailed(self):
+        """report-detailed trên 1M booking: đếm riêng lẻ + cộng giờ bằng Python (cũ) so với aggregate."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(5000))
+        seed_bookings(self.scaled(1_000_000), spaces, users, start=timezone.now() - timedelta(days=120))
+        # Cả học kỳ: gần như toàn bộ booking nằm trong khoảng
+        start_time, end_time = timezone.now() - timedelta(days=120), timezone.now() + timedelta(days=120)
+        bookings_in_range = Booking.objects.filter(start_time__gte=start_time, end_time__lte=end_time)
+
+        def legacy_detailed():
+            # Bản sao phần đếm và cộng giờ cũ của report-detailed
+            counts = [
+                bookings_in_range.count(),
+                *(bookings_in_range.filter(status=s).count()
+                  for s in ('CONFIRMED', 'CHECK_IN', 'CHECK_OUT', 'CANCELLED')),
+                *(bookings_in_range.filter(user__role=r).count() for r in ('student', 'teacher')),
+            ]
+            used_space_hours = 0
+            for booking in bookings_in_range.exclude(status='CANCELLED'):
+                used_space_hours += (booking.end_time - booking.start_time).total_seconds() / 3600
+            return counts, round(used_space_hours, 2)
+
+        legacy_counts, legacy_hours = legacy_detailed()
+        report = build_report_detailed(start_time, end_time)
+        assert legacy_counts[0] == report['bookings']['total_bookings']
+        assert legacy_hours == report['spaces']['total_space_hours_used']
+
+        self.section(f"{Booking.objects.count()} booking trong khoảng {(end_time - start_time).days} ngày")
+        self.measure('đếm riêng lẻ + vòng lặp Python (cũ)', legacy_detailed, repeat=min(self.options['repeat'], 3))
+        self.measure('aggregate trong database', lambda: build_report_detailed(start_time, end_time))
+        for breakdown in ('space', 'day'):
+            self.measure(f'aggregate + breakdown={breakdown}',
+                         lambda: build_report_detailed(start_time, end_time, breakdown))
+
+    def bench_usage(self):
+        """Báo cáo một năm: aggregate trên booking gốc so với đọc bảng tổng hợp theo ngày."""
+        spaces = seed_spaces(self.scaled(1000))
+        users = seed_users(self.scaled(5000))
+        seed_bookings(self.scaled(1_000_000), spaces, users, start=timezone.now() - timedelta(days=365),
+                      slot=timedelta(hours=8))
+        last_day = timezone.localdate()
+        first_day = last_day - timedelta(days=364)
+        start_time = timezone.now() - timedelta(days=365)
+
+        self.section(f"{Booking.objects.count()} booking, {len(spaces)} phòng, 365 ngày")
+        self.measure('backfill_usage_rollups (toàn bộ lịch sử)',
+                     lambda: call_command('backfill_usage_rollups', chunk_days=31, stdout=StringIO()),
+                     repeat=1)
+        self.measure('report-detailed trên booking gốc', lambda: build_report_detailed(start_time, timezone.now()))
+        for group_by in ('day', 'space', 'space_type'):
+            self.measure(f'report-usage group_by={group_by}',
+                         lambda: build_usage_report(first_day, last_day, group_by))
@@ -0,0 +1,272 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DateTimeField, DurationField, Exists, ExpressionWrapper, F, Min, OuterRef, Q, Sum
+from django.db.models.functions import Greatest, Least, TruncDate
+from django.utils import timezone
+
+from apps.bookings.models import (
+    SPACE_STATUS_MAPPING, Booking, Equipment, SpaceTypeUsageDaily, SpaceUsageDaily, UsageDaily,
+)
+from apps.resources.models import StudySpace
+from .models import User
+
+REPORT_OVERVIEW_CACHE_KEY = 'users:report-overview'
+
+
+def _count_by(field, values, **extra):
+    """Các Count(filter=Q(field=value)) đặt tên theo key, dùng trong một aggregate"""
+    return {key: Count('id', filter=Q(**{field: value})) for key, value in values.items()} | extra
+
+
+def build_report_overview(current_time):
+    """
+    Báo cáo tổng quan về người dùng, phòng học, đặt phòng và thiết bị.
+    - Mỗi bảng một truy vấn aggregate có điều kiện (Count với filter).
+    - Trạng thái phòng lấy từ một truy vấn nhóm các booking đang diễn ra,
+      cho kết quả giống get_space_status từng phòng.
+    """
+    users = User.objects.aggregate(**_count_by('role', {
+        'students': 'student',
+        'teachers': 'teacher',
+        'managers': 'manager',
+    }, total_users=Count('id')))
+
+    bookings = Booking.objects.aggregate(
+        **_count_by('status', {
+            'confirmed_bookings': 'CONFIRMED',
+            'check_in_bookings': 'CHECK_IN',
+            'check_out_bookings': 'CHECK_OUT',
+            'cancelled_bookings': 'CANCELLED',
+        }, total_bookings=Count('id')),
+        **_count_by('user__role', {
+            'bookings_by_students': 'student',
+            'bookings_by_teachers': 'teacher',
+        }),
+    )
+
+    # Booking đang diễn ra quyết định trạng thái phòng (booking có pk nhỏ nhất nếu chồng lấn,
+    # như get_space_status); phòng không có booking đang diễn ra dùng space_status đã lưu
+    active_bookings = Booking.objects.filter(
+        start_time__lte=current_time,
+        end_time__gt=current_time,
+    ).exclude(status='CANCELLED')
+    occupancy = {'EMPTY': 0, 'BOOKED': 0, 'INUSE': 0}
+    current_bookings = Booking.objects.filter(
+        pk__in=active_bookings.values('space').annotate(first_pk=Min('pk')).values('first_pk')
+    ).values('status').annotate(spaces=Count('id')).order_by()
+    for row in current_bookings:
+        occupancy[SPACE_STATUS_MAPPING.get(row['status'], 'EMPTY')] += row['spaces']
+
+    spaces = StudySpace.objects.annotate(
+        has_active_booking=Exists(active_bookings.filter(space=OuterRef('pk')))
+    ).aggregate(
+        **_count_by('space_type', {
+            'individual_spaces': 'INDIVIDUAL',
+            'group_spaces': 'GROUP',
+            'mentoring_spaces': 'MENTORING',
+        }, total_spaces=Count('id')),
+        **{
+            f'idle_{space_status}': Count('id', filter=Q(has_active_booking=False, space_status=space_status))
+            for space_status in occupancy
+        },
+    )
+    for space_status in occupancy:
+        occupancy[space_status] += spaces[f'idle_{space_status}']
+    spaces.update(
+        empty_spaces=occupancy['EMPTY'],
+        booked_spaces=occupancy['BOOKED'],
+        inuse_spaces=occupancy['INUSE'],
+    )
+
+    equipments = Equipment.objects.aggregate(**_count_by('status', {
+        'available_equipments': 'AVAILABLE',
+        'borrowed_equipments': 'BORROWED',
+        'broken_equipments': 'BROKEN',
+        'maintenance_equipments': 'MAINTENANCE',
+    }, total_equipments=Count('id')))
+
+    return {
+        'users': {
+            'total_users': users['total_users'],
+            'students': users['students'],
+            'teachers': users['teachers'],
+            'managers': users['managers'],
+            'bookings_by_students': bookings.pop('bookings_by_students'),
+            'bookings_by_teachers': bookings.pop('bookings_by_teachers'),
+        },
+        'spaces': {key: spaces[key] for key in (
+            'total_spaces', 'individual_spaces', 'group_spaces', 'mentoring_spaces',
+            'empty_spaces', 'booked_spaces', 'inuse_spaces',
+        )},
+        'bookings': {key: bookings[key] for key in (
+            'total_bookings', 'confirmed_bookings', 'check_in_bookings',
+            'check_out_bookings', 'cancelled_bookings',
+        )},
+        'equipments': {key: equipments[key] for key in (
+            'total_equipments', 'available_equipments', 'borrowed_equipments',
+            'broken_equipments', 'maintenance_equipments',
+        )},
+        'generated_at': current_time.isoformat(),
+    }
+
+
+REPORT_BREAKDOWNS = ('space', 'day')
+
+
+def _hours(duration):
+    """Đổi timedelta (hoặc None khi không có dòng nào) sang số giờ"""
+    return duration.total_seconds() / 3600 if duration else 0
+
+
+def build_report_detailed(start_time, end_time, breakdown=None):
+    """
+    Báo cáo chi tiết trong khoảng [start_time, end_time].
+    - Các con số tổng hợp (kể cả tổng giờ sử dụng) do database tính bằng aggregate.
+    - breakdown='space' hoặc 'day': giờ sử dụng theo phòng hoặc theo ngày (giờ địa phương),
+      tính trên các booking giao với khoảng thời gian và được cắt theo khoảng đó.
+    """
+    bookings_in_range = Booking.objects.filter(
+        start_time__gte=start_time,
+        end_time__lte=end_time
+    )
+    booking_stats = bookings_in_range.aggregate(
+        **_count_by('status', {
+            'confirmed_bookings': 'CONFIRMED',
+            'check_in_bookings': 'CHECK_IN',
+            'check_out_bookings': 'CHECK_OUT',
+            'cancelled_bookings': 'CANCELLED',
+        }, total_bookings=Count('id')),
+        **_count_by('user__role', {
+            'bookings_by_students': 'student',
+            'bookings_by_teachers': 'teacher',
+        }),
+        used_duration=Sum(
+            ExpressionWrapper(F('end_time') - F('start_time'), output_field=DurationField()),
+            filter=~Q(status='CANCELLED'),
+        ),
+    )
+    used_space_hours = _hours(booking_stats.pop('used_duration'))
+
+    # Thống kê tỷ lệ sử dụng phòng học
+    total_hours = (end_time - start_time).total_seconds() / 3600  # Tổng số giờ trong khoảng thời gian
+    space_stats = StudySpace.objects.aggregate(**_count_by('space_type', {
+        'individual_spaces': 'INDIVIDUAL',
+        'group_spaces': 'GROUP',
+        'mentoring_spaces': 'MENTORING',
+    }, total_spaces=Count('id')))
+    total_available_space_hours = total_hours * space_stats['total_spaces']  # Tổng số giờ-phòng khả dụng
+    utilization_rate = (used_space_hours / total_available_space_hours * 100) if total_available_space_hours > 0 else 0
+    space_stats.update(
+        utilization_rate_percent=round(utilization_rate, 2),
+        total_space_hours_used=round(used_space_hours, 2),
+        total_space_hours_available=round(total_available_space_hours, 2),
+    )
+
+    # Thống kê thiết bị trong khoảng thời gian
+    equipment_stats = Equipment.objects.filter(
+        booking__start_time__gte=start_time,
+        booking__end_time__lte=end_time
+    ).aggregate(**_count_by('status', {
+        'total_equipments_borrowed': 'BORROWED',
+        'broken_equipments': 'BROKEN',
+        'maintenance_equipments': 'MAINTENANCE',
+    }))
+
+    report = {
+        'time_range': {
+            'start_time': start_time.isoformat(),
+            'end_time': end_time.isoformat(),
+        },
+        'bookings': {key: booking_stats[key] for key in (
+            'total_bookings', 'confirmed_bookings', 'check_in_bookings', 'check_out_bookings',
+            'cancelled_bookings', 'bookings_by_students', 'bookings_by_teachers',
+        )},
+        'spaces': {key: space_stats[key] for key in (
+            'total_spaces', 'individual_spaces', 'group_spaces', 'mentoring_spaces',
+            'utilization_rate_percent', 'total_space_hours_used', 'total_space_hours_available',
+        )},
+        'equipments': equipment_stats,
+        'generated_at': timezone.now().isoformat(),
+    }
+    if breakdown:
+        report['breakdown'] = {'by': breakdown, 'items': build_usage_breakdown(start_time, end_time, breakdown)}
+    return report
+
+
+def build_usage_breakdown(start_time, end_time, breakdown):
+    """Giờ sử dụng theo phòng hoặc theo ngày, mỗi booking chỉ tính phần nằm trong khoảng thời gian"""
+    clipped = Booking.objects.filter(
+        start_time__lt=end_time,
+        end_time__gt=start_time,
+    ).exclude(status='CANCELLED').annotate(
+        clipped_start=Greatest('start_time', start_time, output_field=DateTimeField()),
+        clipped_end=Least('end_time', end_time, output_field=DateTimeField()),
+    )
+    used = Sum(ExpressionWrapper(F('clipped_end') - F('clipped_start'), output_field=DurationField()))
+    if breakdown == 'space':
+        rows = clipped.values('space_id', 'space__name').annotate(used=used).order_by('space_id')
+        return [
+            {'space_id': row['space_id'], 'space_name': row['space__name'], 'hours_used': round(_hours(row['used']), 2)}
+            for row in rows
+        ]
+    # Ngày tính theo giờ địa phương của thời điểm bắt đầu (đã cắt)
+    rows = clipped.annotate(
+        day=TruncDate('clipped_start', tzinfo=timezone.get_current_timezone())
+    ).values('day').annotate(used=used).order_by('day')
+    return [{'date': row['day'].isoformat(), 'hours_used': round(_hours(row['used']), 2)} for row in rows]
+
+
+USAGE_GROUPS = ('day', 'space', 'space_type')
+
+
+def _usage_metrics(row):
+    """Chuẩn hóa một dòng Sum của bảng tổng hợp (None khi không có dữ liệu, giờ làm tròn 2 chữ số)"""
+    return {
+        metric: round(row[metric] or 0, 2) if metric.endswith('_hours') else row[metric] or 0
+        for metric in UsageDaily.METRICS
+    }
+
+
+def build_usage_report(first_day, last_day, group_by='day'):
+    """
+    Báo cáo sử dụng theo ngày trong [first_day, last_day], đọc từ các bảng tổng hợp
+    (UsageDaily, SpaceTypeUsageDaily, SpaceUsageDaily) thay vì booking gốc.
+    """
+    sums = {metric: Sum(metric) for metric in UsageDaily.METRICS}
+    in_range = {'day__gte': first_day, 'day__lte': last_day}
+    totals = _usage_metrics(UsageDaily.objects.filter(**in_range).aggregate(**sums))
+    total_space_hours = StudySpace.objects.count() * 24 * ((last_day - first_day).days + 1)
+    totals['utilization_rate_percent'] = (
+        round(totals['booked_hours'] / total_space_hours * 100, 2) if total_space_hours else 0
+    )
+
+    if group_by == 'space':
+        rows = SpaceUsageDaily.objects.filter(**in_range).values(
+            'space_id', space_name=F('space__name')).annotate(**sums).order_by('space_id')
+        keys = ('space_id', 'space_name')
+    elif group_by == 'space_type':
+        rows = SpaceTypeUsageDaily.objects.filter(**in_range).values(
+            'space_type').annotate(**sums).order_by('space_type')
+        keys = ('space_type',)
+    else:
+        rows = UsageDaily.objects.filter(**in_range).values('day', *UsageDaily.METRICS).order_by('day')
+        keys = ('day',)
+
+    return {
+        'date_range': {
+            'start_date': first_day.isoformat(),
+            'end_date': last_day.isoformat(),
+        },
+        'totals': totals,
+        'group_by': group_by,
+        'items': [{**{key: row[key] for key in keys}, **_usage_metrics(row)} for row in rows],
+        'generated_at': timezone.now().isoformat(),
+    }
+
+
+def get_report_overview():
+    """Báo cáo tổng quan, lưu cache REPORT_OVERVIEW_CACHE_TTL giây (0 để tắt cache)"""
+    ttl = settings.REPORT_OVERVIEW_CACHE_TTL
+    if not ttl:
+        return build_report_overview(timezone.now())
+    return cache.get_or_set(REPORT_OVERVIEW_CACHE_KEY, lambda: build_report_overview(timezone.now()), ttl)
@@ -1,3 +1,187 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import Permission
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from apps.bookings.models import Booking, Equipment, EquipmentType
+from apps.bookings.services import rebuild_usage_rollups
+from apps.resources.models import StudySpace
+from .models import User
+
+
+class ManagerReportTests(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.manager = User.objects.create_user(username='manager1', email='manager1@hcmut.edu.vn', role='manager')
+        self.manager.user_permissions.add(*Permission.objects.filter(
+            content_type__app_label='users',
+            codename__in=['view_own_profile', 'edit_own_profile', 'generate_report'],
+        ))
+        self.student = User.objects.create_user(username='student1', email='student1@hcmut.edu.vn', role='student')
+        self.teacher = User.objects.create_user(username='teacher1', email='teacher1@hcmut.edu.vn', role='teacher')
+        self.spaces = [
+            StudySpace.objects.create(name='A-01', capacity=1, space_type='INDIVIDUAL'),
+            StudySpace.objects.create(name='A-02', capacity=1, space_type='INDIVIDUAL'),
+            StudySpace.objects.create(name='G-01', capacity=6, space_type='GROUP'),
+            StudySpace.objects.create(name='M-01', capacity=2, space_type='MENTORING'),
+        ]
+        now = timezone.now()
+        hour = timedelta(hours=1)
+        Booking.objects.create(user=self.student, space=self.spaces[0], start_time=now - hour, end_time=now + hour,
+                               status='CHECK_IN')
+        Booking.objects.create(user=self.teacher, space=self.spaces[1], start_time=now - hour, end_time=now + hour,
+                               status='CONFIRMED')
+        Booking.objects.create(user=self.student, space=self.spaces[2], start_time=now - hour, end_time=now + hour,
+                               status='CANCELLED')
+        Booking.objects.create(user=self.student, space=self.spaces[3], start_time=now - 3 * hour,
+                               end_time=now - 2 * hour, status='CHECK_OUT')
+        projector = EquipmentType.objects.create(name='Máy chiếu', total_quantity=3)
+        for equipment_status in ('AVAILABLE', 'BORROWED', 'BROKEN'):
+            Equipment.objects.create(equipment_type=projector, status=equipment_status)
+        self.client.force_authenticate(user=self.manager)
+        cache.clear()
+
+    @override_settings(REPORT_OVERVIEW_CACHE_TTL=0)
+    def test_report_overview_counts(self):
+        """Kiểm tra báo cáo tổng quan đúng số liệu, số truy vấn cố định"""
+        self.client.get(reverse('manager_action', args=['report-overview']))  # nạp cache quyền của user
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('manager_action', args=['report-overview']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(ctx.captured_queries), 5)
+        self.assertEqual(response.data['users'], {
+            'total_users': 3, 'students': 1, 'teachers': 1, 'managers': 1,
+            'bookings_by_students': 3, 'bookings_by_teachers': 1,
+        })
+        self.assertEqual(response.data['spaces'], {
+            'total_spaces': 4, 'individual_spaces': 2, 'group_spaces': 1, 'mentoring_spaces': 1,
+            'empty_spaces': 2, 'booked_spaces': 1, 'inuse_spaces': 1,
+        })
+        self.assertEqual(response.data['bookings'], {
+            'total_bookings': 4, 'confirmed_bookings': 1, 'check_in_bookings': 1,
+            'check_out_bookings': 1, 'cancelled_bookings': 1,
+        })
+        self.assertEqual(response.data['equipments'], {
+            'total_equipments': 3, 'available_equipments': 1, 'borrowed_equipments': 1,
+            'broken_equipments': 1, 'maintenance_equipments': 0,
+        })
+
+    @override_settings(REPORT_OVERVIEW_CACHE_TTL=30)
+    def test_report_overview_cached(self):
+        """Kiểm tra báo cáo tổng quan được cache trong REPORT_OVERVIEW_CACHE_TTL giây"""
+        first = self.client.get(reverse('manager_action', args=['report-overview']))
+        with self.assertNumQueries(0):
+            second = self.client.get(reverse('manager_action', args=['report-overview']))
+        self.assertEqual(first.data, second.data)
+
+    def test_report_overview_requires_permission(self):
+        """Kiểm tra người không có quyền generate_report bị từ chối"""
+        self.manager.user_permissions.remove(Permission.objects.get(codename='generate_report'))
+        self.client.force_authenticate(user=User.objects.get(pk=self.manager.pk))
+        response = self.client.get(reverse('manager_action', args=['report-overview']))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def legacy_report_detailed(self, start_time, end_time):
+        """Cách tính cũ của report-detailed (đếm riêng lẻ, cộng giờ bằng vòng lặp Python)"""
+        bookings_in_range = Booking.objects.filter(start_time__gte=start_time, end_time__lte=end_time)
+        used_space_hours = 0
+        for booking in bookings_in_range.exclude(status='CANCELLED'):
+            used_space_hours += (booking.end_time - booking.start_time).total_seconds() / 3600
+        total_available_space_hours = (end_time - start_time).total_seconds() / 3600 * StudySpace.objects.count()
+        return {
+            'bookings': {
+                'total_bookings': bookings_in_range.count(),
+                'confirmed_bookings': bookings_in_range.filter(status='CONFIRMED').count(),
+                'check_in_bookings': bookings_in_range.filter(status='CHECK_IN').count(),
+                'check_out_bookings': bookings_in_range.filter(status='CHECK_OUT').count(),
+                'cancelled_bookings': bookings_in_range.filter(status='CANCELLED').count(),
+                'bookings_by_students': bookings_in_range.filter(user__role='student').count(),
+                'bookings_by_teachers': bookings_in_range.filter(user__role='teacher').count(),
+            },
+            'spaces': {
+                'total_spaces': StudySpace.objects.count(),
+                'individual_spaces': StudySpace.objects.filter(space_type='INDIVIDUAL').count(),
+                'group_spaces': StudySpace.objects.filter(space_type='GROUP').count(),
+                'mentoring_spaces': StudySpace.objects.filter(space_type='MENTORING').count(),
+                'utilization_rate_percent': round(used_space_hours / total_available_space_hours * 100, 2),
+                'total_space_hours_used': round(used_space_hours, 2),
+                'total_space_hours_available': round(total_available_space_hours, 2),
+            },
+            'equipments': {
+                'total_equipments_borrowed': Equipment.objects.filter(
+                    booking__start_time__gte=start_time, booking__end_time__lte=end_time, status='BORROWED').count(),
+                'broken_equipments': Equipment.objects.filter(
+                    booking__start_time__gte=start_time, booking__end_time__lte=end_time, status='BROKEN').count(),
+                'maintenance_equipments': Equipment.objects.filter(
+                    booking__start_time__gte=start_time, booking__end_time__lte=end_time, status='MAINTENANCE').count(),
+            },
+        }
+
+    def get_detailed(self, start_time, end_time, **params):
+        return self.client.get(reverse('manager_action', args=['report-detailed']), {
+            'start_time': start_time.isoformat(), 'end_time': end_time.isoformat(), **params,
+        })
+
+    def test_report_detailed_matches_legacy(self):
+        """Kiểm tra báo cáo chi tiết tính trong database cho kết quả giống cách tính cũ"""
+        borrowed = Equipment.objects.get(status='BORROWED')
+        borrowed.booking = Booking.objects.get(status='CHECK_OUT')
+        borrowed.save()
+        Booking.objects.create(user=self.teacher, space=self.spaces[2], status='CHECK_OUT',
+                               start_time=timezone.now() - timedelta(days=2, minutes=50),
+                               end_time=timezone.now() - timedelta(days=2, minutes=5))
+        start_time, end_time = timezone.now() - timedelta(days=3), timezone.now() + timedelta(hours=2)
+        response = self.get_detailed(start_time, end_time)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        expected = self.legacy_report_detailed(start_time, end_time)
+        for section in ('bookings', 'spaces', 'equipments'):
+            self.assertEqual(response.data[section], expected[section])
+        self.assertNotIn('breakdown', response.data)
+
+    def test_report_detailed_breakdown_clipped_to_window(self):
+        """Kiểm tra breakdown theo phòng/ngày chỉ tính phần booking nằm trong khoảng thời gian"""
+        start_time, end_time = timezone.now(), timezone.now() + timedelta(hours=3)
+        # Hai booking đang diễn ra (A-01, A-02) chỉ còn 1 giờ trong khoảng; booking đã hủy không tính
+        response = self.get_detailed(start_time, end_time, breakdown='space')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['breakdown']['by'], 'space')
+        self.assertEqual(response.data['breakdown']['items'], [
+            {'space_id': self.spaces[0].id, 'space_name': 'A-01', 'hours_used': 1.0},
+            {'space_id': self.spaces[1].id, 'space_name': 'A-02', 'hours_used': 1.0},
+        ])
+        response = self.get_detailed(start_time, end_time, breakdown='day')
+        self.assertEqual(response.data['breakdown']['items'], [
+            {'date': timezone.localdate(start_time).isoformat(), 'hours_used': 2.0},
+        ])
+        self.assertEqual(self.get_detailed(start_time, end_time, breakdown='week').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_report_usage_reads_rollups(self):
+        """Kiểm tra báo cáo sử dụng đọc từ bảng tổng hợp, nhóm theo ngày/phòng/loại phòng"""
+        today = timezone.localdate()
+        rebuild_usage_rollups(today - timedelta(days=1), today + timedelta(days=1))
+        url = reverse('manager_action', args=['report-usage'])
+        params = {'start_date': (today - timedelta(days=1)).isoformat(), 'end_date': today.isoformat()}
+        # 2 truy vấn quyền của user + tổng, số phòng, nhóm theo loại phòng
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {**params, 'group_by': 'space_type'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        totals = response.data['totals']
+        self.assertEqual(totals['bookings'], 4)
+        self.assertEqual(totals['cancellations'], 1)
+        self.assertEqual(totals['booked_hours'], 5.0)
+        self.assertEqual(totals['used_hours'], 3.0)
+        self.assertEqual(totals['utilization_rate_percent'], round(5 / (4 * 48) * 100, 2))
+        self.assertEqual({item['space_type']: item['bookings'] for item in response.data['items']},
+                         {'INDIVIDUAL': 2, 'GROUP': 1, 'MENTORING': 1})
+        response = self.client.get(url, {**params, 'group_by': 'space'})
+        self.assertEqual([item['space_name'] for item in response.data['items']], ['A-01', 'A-02', 'G-01', 'M-01'])
+        self.assertEqual(self.client.get(url, {**params, 'group_by': 'week'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
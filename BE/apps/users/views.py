@@ -6,11 +6,10 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from .serializers import RegisterSerializer, UserSerializer, StudentProfileSerializer, TeacherProfileSerializer, ManagerProfileSerializer
 from .permissions import HasViewOwnProfilePermission, HasEditOwnProfilePermission, HasViewAllUsersPermission, HasGenerateReportPermission, IsOwnProfile
 from .models import User
+from .services import REPORT_BREAKDOWNS, USAGE_GROUPS, build_report_detailed, build_usage_report, get_report_overview
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils import timezone
-from datetime import datetime, timedelta
-from apps.resources.models import StudySpace
-from apps.bookings.models import Booking, Equipment
+from datetime import date, datetime, timedelta
 from dateutil.parser import isoparse
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter, extend_schema_view
 # Class UserAPIView
@@ -298,7 +297,7 @@ class TeacherAPIView(UserAPIView):
         parameters=[
             OpenApiParameter(
                 name="action",
-                description="Hành động cần thực hiện (profile, list-users, report, report-overview, report-detailed)",
+                description="Hành động cần thực hiện (profile, list-users, report, report-overview, report-detailed, report-usage)",
                 required=True,
                 type=str,
                 examples=[
@@ -307,6 +306,7 @@ class TeacherAPIView(UserAPIView):
                     OpenApiExample(name="Report", value="report", description="Tạo báo cáo thống kê"),
                     OpenApiExample(name="Report Overview", value="report-overview", description="Báo cáo tổng quan"),
                     OpenApiExample(name="Report Detailed", value="report-detailed", description="Báo cáo chi tiết"),
+                    OpenApiExample(name="Report Usage", value="report-usage", description="Báo cáo sử dụng theo ngày (bảng tổng hợp)"),
                 ],
             )
         ],
@@ -379,59 +379,13 @@ class ManagerAPIView(UserAPIView):
                     status=status.HTTP_403_FORBIDDEN
                 )
 
-            current_time = timezone.now()
-
-            # Thống kê người dùng
-            user_stats = {
-                'total_users': User.objects.count(),
-                'students': User.objects.filter(role='student').count(),
-                'teachers': User.objects.filter(role='teacher').count(),
-                'managers': User.objects.filter(role='manager').count(),
-                'bookings_by_students': Booking.objects.filter(user__role='student').count(),
-                'bookings_by_teachers': Booking.objects.filter(user__role='teacher').count(),
-            }
-
-            # Thống kê phòng học
-            space_stats = {
-                'total_spaces': StudySpace.objects.count(),
-                'individual_spaces': StudySpace.objects.filter(space_type='INDIVIDUAL').count(),
-                'group_spaces': StudySpace.objects.filter(space_type='GROUP').count(),
-                'mentoring_spaces': StudySpace.objects.filter(space_type='MENTORING').count(),
-                'empty_spaces': sum(1 for space in StudySpace.objects.all() if space.get_space_status(current_time) == 'EMPTY'),
-                'booked_spaces': sum(1 for space in StudySpace.objects.all() if space.get_space_status(current_time) == 'BOOKED'),
-                'inuse_spaces': sum(1 for space in StudySpace.objects.all() if space.get_space_status(current_time) == 'INUSE'),
-            }
-
-            # Thống kê đặt phòng (tổng quan)
-            booking_stats = {
-                'total_bookings': Booking.objects.count(),
-                'confirmed_bookings': Booking.objects.filter(status='CONFIRMED').count(),
-                'check_in_bookings': Booking.objects.filter(status='CHECK_IN').count(),
-                'check_out_bookings': Booking.objects.filter(status='CHECK_OUT').count(),
-                'cancelled_bookings': Booking.objects.filter(status='CANCELLED').count(),
-            }
-
-            # Thống kê thiết bị
-            equipment_stats = {
-                'total_equipments': Equipment.objects.count(),
-                'available_equipments': Equipment.objects.filter(status='AVAILABLE').count(),
-                'borrowed_equipments': Equipment.objects.filter(status='BORROWED').count(),
-                'broken_equipments': Equipment.objects.filter(status='BROKEN').count(),
-                'maintenance_equipments': Equipment.objects.filter(status='MAINTENANCE').count(),
-            }
-
-            return Response({
-                'users': user_stats,
-                'spaces': space_stats,
-                'bookings': booking_stats,
-                'equipments': equipment_stats,
-                'generated_at': current_time.isoformat(),
-            })
+            return Response(get_report_overview())
 
         elif action == "report-detailed":
             """
             Báo cáo chi tiết theo khoảng thời gian.
             - Query params: start_time, end_time (ISO format, ví dụ: 2025-05-01T00:00:00Z).
+            - breakdown (tùy chọn): 'space' hoặc 'day' để thêm giờ sử dụng theo phòng/ngày.
             """
             if not request.user.has_perm('users.generate_report'):
                 return Response(
@@ -459,66 +413,51 @@ class ManagerAPIView(UserAPIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Thống kê đặt phòng trong khoảng thời gian
-            bookings_in_range = Booking.objects.filter(
-                start_time__gte=start_time,
-                end_time__lte=end_time
-            )
-
-            booking_stats = {
-                'total_bookings': bookings_in_range.count(),
-                'confirmed_bookings': bookings_in_range.filter(status='CONFIRMED').count(),
-                'check_in_bookings': bookings_in_range.filter(status='CHECK_IN').count(),
-                'check_out_bookings': bookings_in_range.filter(status='CHECK_OUT').count(),
-                'cancelled_bookings': bookings_in_range.filter(status='CANCELLED').count(),
-                'bookings_by_students': bookings_in_range.filter(user__role='student').count(),
-                'bookings_by_teachers': bookings_in_range.filter(user__role='teacher').count(),
-            }
-
-            # Thống kê tỷ lệ sử dụng phòng học
-            total_hours = (end_time - start_time).total_seconds() / 3600  # Tổng số giờ trong khoảng thời gian
-            total_spaces = StudySpace.objects.count()
-            total_available_space_hours = total_hours * total_spaces  # Tổng số giờ-phòng khả dụng
+            breakdown = request.query_params.get('breakdown')
+            if breakdown and breakdown not in REPORT_BREAKDOWNS:
+                return Response(
+                    {'error': f"breakdown must be one of: {', '.join(REPORT_BREAKDOWNS)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            used_space_hours = 0
-            for booking in bookings_in_range.exclude(status='CANCELLED'):
-                duration = (booking.end_time - booking.start_time).total_seconds() / 3600
-                used_space_hours += duration
+            return Response(build_report_detailed(start_time, end_time, breakdown))
 
-            utilization_rate = (used_space_hours / total_available_space_hours * 100) if total_available_space_hours > 0 else 0
+        elif action == "report-usage":
+            """
+            Báo cáo sử dụng theo ngày, đọc từ các bảng tổng hợp.
+            - Query params: start_date, end_date (YYYY-MM-DD, mặc định 30 ngày gần nhất),
+              group_by ('day', 'space' hoặc 'space_type', mặc định 'day').
+            """
+            if not request.user.has_perm('users.generate_report'):
+                return Response(
+                    {'error': 'Permission denied'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
 
-            space_stats = {
-                'total_spaces': total_spaces,
-                'individual_spaces': StudySpace.objects.filter(space_type='INDIVIDUAL').count(),
-                'group_spaces': StudySpace.objects.filter(space_type='GROUP').count(),
-                'mentoring_spaces': StudySpace.objects.filter(space_type='MENTORING').count(),
-                'utilization_rate_percent': round(utilization_rate, 2),
-                'total_space_hours_used': round(used_space_hours, 2),
-                'total_space_hours_available': round(total_available_space_hours, 2),
-            }
+            try:
+                end_date = date.fromisoformat(request.query_params.get('end_date') or timezone.localdate().isoformat())
+                start_date = date.fromisoformat(request.query_params.get('start_date')
+                                                or (end_date - timedelta(days=30)).isoformat())
+            except ValueError:
+                return Response(
+                    {'error': 'Invalid date format. Use YYYY-MM-DD (e.g., 2025-05-01).'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            # Thống kê thiết bị trong khoảng thời gian
-            equipments_in_range = Equipment.objects.filter(
-                booking__start_time__gte=start_time,
-                booking__end_time__lte=end_time
-            )
+            if start_date > end_date:
+                return Response(
+                    {'error': 'start_date must not be after end_date.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            equipment_stats = {
-                'total_equipments_borrowed': equipments_in_range.filter(status='BORROWED').count(),
-                'broken_equipments': equipments_in_range.filter(status='BROKEN').count(),
-                'maintenance_equipments': equipments_in_range.filter(status='MAINTENANCE').count(),
-            }
+            group_by = request.query_params.get('group_by') or 'day'
+            if group_by not in USAGE_GROUPS:
+                return Response(
+                    {'error': f"group_by must be one of: {', '.join(USAGE_GROUPS)}."},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
-            return Response({
-                'time_range': {
-                    'start_time': start_time.isoformat(),
-                    'end_time': end_time.isoformat(),
-                },
-                'bookings': booking_stats,
-                'spaces': space_stats,
-                'equipments': equipment_stats,
-                'generated_at': timezone.now().isoformat(),
-            })
+            return Response(build_usage_report(start_date, end_date, group_by))
 
     def put(self, request, action=None):
         if action == "profile":